@@ -68,7 +68,11 @@ class Diagnostic(object):
 		self.units.prepare(self.simulation._reference_angular_frequency_SI)
 		
 		# Call the '_init' function of the child class
+		self._cacheKey = self._makeCacheKey(args, kwargs)
+		self._initArgs = (args, dict(kwargs, units=self.units))
+		self._prefetchQueue = None
 		remaining_kwargs = self._init(*args, **kwargs)
+		self.simulation._index.flush()
 		if remaining_kwargs is not None and len(remaining_kwargs) > 0:
 			self.valid = False
 			self._error += ["The following keyword-arguments are unknown: "+", ".join(remaining_kwargs.keys())]
@@ -158,8 +162,12 @@ class Diagnostic(object):
 		data = []
 
 		if timestep is None:
-			for t in self._timesteps:
-				data.append( self._dataAtTime(t) )
+			self._startPrefetch(self._timesteps)
+			try:
+				for t in self._timesteps:
+					data.append( self._dataAtTime(t) )
+			finally:
+				self._stopPrefetch()
 		elif timestep not in self._timesteps:
 			print("ERROR: timestep "+str(timestep)+" not available")
 		else:
@@ -167,6 +175,90 @@ class Diagnostic(object):
 
 		return data
 
+	def getDataArray(self, timesteps=None, file=None, dtype=None):
+		"""Obtains the data from the diagnostic, for several timesteps, in a single array.
+
+		Parameters:
+		-----------
+		timesteps: int or [int, int] (default: None, which means all selected timesteps)
+			One timestep (the nearest is taken), or the range of timesteps between two values.
+		file: path string (default: None)
+			If given, the array is a memory-mapped `.npy` file, written at this location,
+			which may be larger than the available memory.
+		dtype: numpy data type (default: the type of the data)
+
+		Returns:
+		--------
+		An array with the time as first dimension, followed by the dimensions of the data.
+		"""
+		if not self._validate(): return
+		if not hasattr(self, "_getDataAtTime"):
+			print("ERROR: this diagnostic cannot provide a data array")
+			return
+		self._prepare1() # prepare the vfactor
+		timesteps = self._timesteps if timesteps is None else self._selectTimesteps(timesteps, self._timesteps)
+		if len(timesteps) == 0:
+			print("ERROR: no timesteps found")
+			return
+		return self._dataArray(timesteps, file, dtype)
+
+	# Fill one array with the data of several timesteps
+	def _dataArray(self, timesteps, file=None, dtype=None):
+		self._startPrefetch(timesteps)
+		try:
+			# The first timestep gives the shape of the array
+			A = self._dataAtTime(timesteps[0])
+			shape = (len(timesteps),) + self._np.shape(A)
+			dtype = self._np.asarray(A).dtype if dtype is None else dtype
+			if file is None:
+				data = self._np.empty(shape, dtype=dtype)
+			else:
+				data = self._np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+			data[0] = A
+			del A
+			for i, t in enumerate(timesteps[1:]):
+				data[i+1] = self._dataAtTime(t)
+		finally:
+			self._stopPrefetch()
+		if file is not None:
+			data.flush()
+		return data
+
+	def asarray(self):
+		"""Obtains the data of all selected timesteps as a lazy array, indexed as [time, axis1, axis2, ...].
+
+		No data is read until the method `compute()` of the lazy array is called,
+		or until it is converted by `numpy.asarray`. Slicing the lazy array restricts the
+		data that is read. Elementwise operations and reductions (`sum`, `mean`, `min`, `max`)
+		return new lazy arrays, evaluated one timestep at a time.
+
+		Returns:
+		--------
+		A `LazyArray` object.
+		"""
+		if not self._validate(): return
+		if not hasattr(self, "_getDataAtTime"):
+			print("ERROR: this diagnostic cannot provide a data array")
+			return
+		self._prepare1() # prepare the vfactor
+		shape, dtype = self._dataLayout()
+		return _LazyData(self, self._np.array(self._timesteps), [(0, 1, int(n)) for n in shape], dtype)
+
+	# Shape and type of the data at each timestep (a transformation requires reading the first timestep)
+	def _dataLayout(self):
+		if callable(self._data_transform):
+			A = self._np.asarray(self._dataAtTime(self._timesteps[0]))
+			return A.shape, A.dtype
+		return tuple(self._shape), self._np.dtype("double")
+
+	# Obtain the data at a given timestep, restricted to `index` (a tuple of integers and slices)
+	def _dataAtTimeSubset(self, t, index):
+		return self._np.asarray(self._dataAtTime(t))[index]
+
+	# Selection in the files to read only the data restricted to `index`, or None if the data is read entirely
+	def _subsetSelection(self, index):
+		return None
+
 	def getTimesteps(self):
 		"""Obtains the list of timesteps selected in this diagnostic"""
 		if not self._validate(): return []
@@ -345,7 +437,7 @@ class Diagnostic(object):
 			if self._yfactor != 1.:
 				ylabel += " x "+str(self._yfactor)
 		# Loop times and accumulate data
-		A = self._np.double([self._dataAtTime(t) for t in self._timesteps])
+		A = self._dataArray(self._timesteps, dtype="double")
 		# Plot
 		ax.cla()
 		xmin = self._xfactor*self._centers[0][0]
@@ -370,7 +462,7 @@ class Diagnostic(object):
 		save = SaveAs(saveAs, fig, self._plt)
 		save.frame()
 
-	def animate(self, movie="", fps=15, dpi=200, saveAs=None, axes=None, **kwargs):
+	def animate(self, movie="", fps=15, dpi=200, saveAs=None, axes=None, workers=0, blit=False, **kwargs):
 		""" Animates the diagnostic over all its timesteps.
 		If the data is 1D, it is plotted as a curve, and is animated for all requested timesteps.
 		If the data is 2D, it is plotted as a map, and is animated for all requested timesteps.
@@ -400,6 +492,12 @@ class Diagnostic(object):
 			You can even specify a filename such as mydir/prefix.png
 			and it will automatically make successive files showing
 			the timestep: mydir/prefix0.png, mydir/prefix1.png, etc.
+		workers: int (default: 0)
+			If > 0, number of processes drawing the frames of `movie` and `saveAs`
+			in parallel, without display. Only the last frame is shown.
+		blit: bool (default: False)
+			If True, 2D maps are updated by redrawing only the map and the title
+			(the whole figure is redrawn only when the axes or colorbar limits change).
 
 		Example:
 		--------
@@ -419,32 +517,50 @@ class Diagnostic(object):
 		import sys
 		if hasattr(sys,"last_type"): del sys.last_type
 
+		# Draw frames in parallel if requested, then show the last one
+		if workers > 0:
+			if axes is not None:
+				print("WARNING: `workers` is not available with `axes`. Drawing frames one by one.")
+			elif _renderFrames(_DiagnosticFrames(self), len(self._timesteps), workers, fig, movie, fps, dpi, saveAs, self._verbose):
+				self._plotOnAxes(ax, self._timesteps[-1])
+				self._plt.draw()
+				self._plt.pause(0.00001)
+				return
+
 		# Movie requested ?
 		mov = Movie(fig, movie, fps, dpi)
 		# Save to file requested ?
 		save = SaveAs(saveAs, fig, self._plt)
 		# Plot first time
-		self._plotOnAxes(ax, self._timesteps[0])
-		mov.grab_frame()
-		save.frame(self._timesteps[0])
-		# Loop times for animation
-		for time in self._timesteps[1:]:
-			if self._verbose: print("timestep "+str(time))
-			# plot
-			if self._animateOnAxes(ax, time) is None: return
-			self._plt.draw()
-			self._plt.pause(0.00001)
-			# Catch ctrl-C
-			if hasattr(sys,"last_type"):
-				if sys.last_type is KeyboardInterrupt: break
-			# Copy to movie or file
+		self._startPrefetch(self._timesteps)
+		try:
+			self._plotOnAxes(ax, self._timesteps[0])
+			blitter = self._makeBlitter(ax) if blit else None
 			mov.grab_frame()
-			save.frame(time)
+			save.frame(self._timesteps[0])
+			# Loop times for animation
+			for time in self._timesteps[1:]:
+				if self._verbose: print("timestep "+str(time))
+				# plot
+				if blitter is not None:
+					self._blitOnAxes(ax, time, blitter)
+				else:
+					if self._animateOnAxes(ax, time) is None: return
+					self._plt.draw()
+					self._plt.pause(0.00001)
+				# Catch ctrl-C
+				if hasattr(sys,"last_type"):
+					if sys.last_type is KeyboardInterrupt: break
+				# Copy to movie or file
+				mov.grab_frame()
+				save.frame(time)
+		finally:
+			self._stopPrefetch()
 		# Movie ?
 		if mov.writer is not None: mov.finish()
 
 
-	def slide(self, axes=None, **kwargs):
+	def slide(self, axes=None, blit=False, **kwargs):
 		""" Plots the diagnostic with a slider to change the timestep
 		If the data is 1D, it is plotted as a curve
 		If the data is 2D, it is plotted as a map
@@ -462,6 +578,9 @@ class Diagnostic(object):
 			Axes limits.
 		xfactor, yfactor: floats (default: 1)
 			Factors to rescale axes.
+		blit: bool (default: False)
+			If True, 2D maps are updated by redrawing only the map, the title and the slider
+			(the whole figure is redrawn only when the axes or colorbar limits change).
 
 		Example:
 		--------
@@ -475,10 +594,14 @@ class Diagnostic(object):
 		fig = ax.figure
 		ax.set_position([0.1,0.2,0.85,0.7])
 		
+		blitter = []
 		def update(t):
 			time = self._timesteps[(self._np.abs(self._timesteps - t)).argmin()]
-			self._animateOnAxes(ax, time)
-			self._plt.draw()
+			if blitter:
+				self._blitOnAxes(ax, time, blitter[0])
+			else:
+				self._animateOnAxes(ax, time)
+				self._plt.draw()
 		
 		self._plotOnAxes(ax, self._timesteps[0])
 		
@@ -500,6 +623,12 @@ class Diagnostic(object):
 		self.slider.on_changed(update)
 		slider_axes.prevent_garbage_collect = self.slider
 		
+		# When blitting, the slider is redrawn with the map
+		if blit:
+			blitter += [self._makeBlitter(ax, [slider_axes])]
+			if blitter[0] is None: blitter.pop()
+			else: self.slider.drawon = False
+		
 		self.info()
 	
 	
@@ -664,8 +793,10 @@ class Diagnostic(object):
 		# prepare temporary data if zero-d plot
 		if self.dim == 0 and self._tmpdata is None:
 			self._tmpdata = self._np.zeros(self._timesteps.size)
+			self._startPrefetch(self._timesteps)
 			for i, t in enumerate(self._timesteps):
 				self._tmpdata[i] = self._dataAtTime(t)
+			self._stopPrefetch()
 		# prepare the colormap if 2d plot
 		if self.dim == 2 and self.options.transparent:
 			cmap = self.options.image["cmap"]
@@ -748,10 +879,18 @@ class Diagnostic(object):
 		self._setLimits(ax, xmin=self.options.xmin, xmax=self.options.xmax, ymin=self.options.vmin, ymax=self.options.vmax)
 		self._setTitle(ax, t)
 		return self._plot
+	# Returns the colorbar limits (vmin, vmax)
 	def _animateOnAxes_2D(self, ax, t, cax_id=0):
 		A = self._dataAtTime(t)
 		self._plot = self._animateOnAxes_2D_(ax, A)
 		self._setLimits(ax, xmin=self.options.xmin, xmax=self.options.xmax, ymin=self.options.ymin, ymax=self.options.ymax)
+		clim = self._colorLimits(A)
+		if clim != self._plot.get_clim():
+			self._plot.set_clim(*clim)
+			ax.cax[cax_id].mappable.set_clim(*clim)
+		self._setTitle(ax, t)
+		return clim
+	def _colorLimits(self, A):
 		vmin = self.options.vmin
 		vmax = self.options.vmax
 		if self.options.vsym:
@@ -764,9 +903,21 @@ class Diagnostic(object):
 			vmin = -vmax
 		if vmin is None: vmin = A.min()
 		if vmax is None: vmax = A.max()
-		self._plot.set_clim(vmin, vmax)
-		ax.cax[cax_id].mappable.set_clim(vmin, vmax)
-		self._setTitle(ax, t)
+		return vmin, vmax
+
+	# Methods to re-plot by blitting: only the map, the axes frame and the title are redrawn
+	# over the saved background, unless the axes or colorbar limits change
+	def _canBlit(self):
+		return self.dim == 2
+	def _makeBlitter(self, ax, others=()):
+		if not self._canBlit():
+			print("WARNING: `blit` is not available for this diagnostic")
+			return None
+		artists = [ax.patch, self._plot] + list(ax.spines.values()) + [ax.title] + list(others)
+		return Blitter(ax.figure, artists)
+	def _blitOnAxes(self, ax, t, blitter, cax_id=0):
+		clim = self._animateOnAxes_2D(ax, t, cax_id)
+		blitter.update((tuple(ax.get_xlim()), tuple(ax.get_ylim()), clim))
 		return self._plot
 
 	# Special case: 2D plot
@@ -851,10 +1002,64 @@ class Diagnostic(object):
 	def _mkdir(self, dir):
 		if not self._os.path.exists(dir): self._os.makedirs(dir)
 	
+	# Key identifying the data of this diagnostic in the simulation's cache
+	def _makeCacheKey(self, args, kwargs):
+		if callable(kwargs.get("data_transform")):
+			return None
+		kwargs = [(k,self._cacheKeyValue(v)) for k,v in kwargs.items() if k not in ["timesteps", "data_log"]]
+		return (type(self).__name__, tuple(self._results_path), self._cacheKeyValue(args), tuple(sorted(kwargs)))
+	def _cacheKeyValue(self, value):
+		# Hashable value identifying an argument (the repr of arrays is truncated)
+		if isinstance(value, self._np.ndarray) and value.dtype.hasobject:
+			return ("ndarray", value.shape, self._cacheKeyValue(value.tolist()))
+		if isinstance(value, self._np.ndarray):
+			import hashlib
+			digest = hashlib.sha1(self._np.ascontiguousarray(value).tobytes()).hexdigest()
+			return ("ndarray", value.shape, value.dtype.str, digest)
+		if isinstance(value, dict):
+			return ("dict", tuple(sorted( (repr(k), self._cacheKeyValue(v)) for k,v in value.items() )))
+		if isinstance(value, (list, tuple)):
+			return (type(value).__name__, tuple(self._cacheKeyValue(v) for v in value))
+		return repr(value)
+	
+	# Update the state of the diagnostic (e.g. axes) for a given timestep
+	def _setTime(self, t):
+		pass
+	
+	# Start reading the data of several timesteps in background processes
+	def _startPrefetch(self, timesteps):
+		self._prefetchQueue = None
+		if not hasattr(self, "_getDataAtTime"): return
+		timesteps = [t for t in timesteps if (self._cacheKey, t) not in self.simulation.cache]
+		self._prefetchQueue = self.simulation._prefetcher.start(
+			self.simulation._workerArgs(), type(self), self._initArgs[0], self._initArgs[1], timesteps
+		)
+	def _stopPrefetch(self):
+		self._prefetchQueue = None
+	
+	# Obtain the data, from the simulation's cache or from the prefetched data if possible
+	def _getCachedDataAtTime(self, t):
+		key = (self._cacheKey, t)
+		if self._cacheKey is not None:
+			A = self.simulation.cache.get(key)
+			if A is not None:
+				self._setTime(t)
+				return A
+		A = None
+		if self._prefetchQueue is not None:
+			A = self._prefetchQueue.pop(t)
+			if A is not None:
+				self._setTime(t)
+		if A is None:
+			A = self._getDataAtTime(t)
+		if self._cacheKey is not None:
+			self.simulation.cache.put(key, A)
+		return A
+	
 	def _dataAtTime(self, t):
-		return self._vfactor*self._getDataAtTime(t)
+		return self._vfactor*self._getCachedDataAtTime(t)
 	def _dataLogAtTime(self, t):
-		return self._np.log10( self._vfactor*self._getDataAtTime(t) )
+		return self._np.log10( self._vfactor*self._getCachedDataAtTime(t) )
 	
 	# Convert data to VTK format
 	def toVTK(self, numberOfPieces=1):
@@ -881,11 +1086,9 @@ class Diagnostic(object):
 		if self.dim == 2:
 			dt = self._timesteps[1]-self._timesteps[0]
 
-			# Get the data
-			data = self._np.zeros(list(self._shape)+[ntimes])
-			for itime in range(ntimes):
-				data[:,:,itime] = self._dataAtTime(self._timesteps[itime])
-			arr = vtk.Array(self._np.ascontiguousarray(data.flatten(order='F'), dtype='float32'), self._title)
+			# Get the data, ordered as x, y, t (x fastest)
+			data = self._dataArray(self._timesteps, dtype="float32")
+			arr = vtk.Array(self._np.ascontiguousarray(data.transpose(0,2,1)).ravel(), self._title)
 
 			# If all timesteps are regularly spaced
 			if (self._np.diff(self._timesteps)==dt).all():
@@ -909,6 +1112,7 @@ class Diagnostic(object):
 
 		# If 3D data, then do a 3D plot
 		elif self.dim == 3:
+			self._startPrefetch(self._timesteps)
 			for itime in range(ntimes):
 				data = self._np.ascontiguousarray(self._dataAtTime(self._timesteps[itime]).flatten(order='F'), dtype='float32')
 				arr = vtk.Array(data, self._title)
@@ -918,4 +1122,5 @@ class Diagnostic(object):
 				filename = fileprefix+"_{:08d}.pvti".format(int(self._timesteps[itime]))
 				if self._verbose: print("* Processing {}".format(filename))
 				vtk.WriteImage(arr, origin, extent, spacings, filename, numberOfPieces)
+			self._stopPrefetch()
 			if self._verbose: print("Successfully exported 3D plot to VTK, folder='"+self._exportDir)
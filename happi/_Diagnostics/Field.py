@@ -4,9 +4,10 @@ from .._Utils import *
 class Field(Diagnostic):
 	"""Class for loading a Field diagnostic"""
 	
-	def _init(self, diagNumber=None, field=None, timesteps=None, subset=None, average=None, data_log=False, data_transform=None, moving=False, **kwargs):
+	def _init(self, diagNumber=None, field=None, timesteps=None, subset=None, average=None, data_log=False, data_transform=None, moving=False, chunksize=10000000, **kwargs):
 		
 		self.moving = moving
+		self._chunksize = chunksize
 		self._subsetinfo = {}
 		self.cylindrical = self.namelist.Main.geometry == "AMcylindrical"
 		
@@ -35,31 +36,28 @@ class Field(Diagnostic):
 		self.diagNumber = diag_numbers[i]
 		self.diagName = diag_names[i]
 		
-		# Open the file(s) and load the data
+		# Get the content of the file(s) from the index
 		self._h5items = {}
 		self._fields = []
 		for path in self._results_path:
 			file = path+self._os.sep+'Fields'+str(self.diagNumber)+'.h5'
-			try:
-				f = self._h5py.File(file, 'r')
-			except Exception as e:
+			entry = self.simulation._index.get(file)
+			if entry is None:
 				continue
-			self._h5items.update( dict(f["data"]) )
+			for key in entry["data_keys"]:
+				self._h5items[key] = file
 			# Select only the fields that are common to all simulations
-			values = f["data"].values()
-			if len(values)==0:
+			if len(entry["data_keys"])==0:
 				self._fields = []
 			elif len(self._fields)==0:
-				self._fields = list(next(iter(values)).keys())
+				self._fields = list(entry["fields"])
 			else:
-				self._fields = [f for f in next(iter(values)).keys() if f in self._fields]
+				self._fields = [f for f in entry["fields"] if f in self._fields]
 		if not self._h5items:
 			self._error += ["Diagnostic not loaded: Could not open any file Fields"+str(self.diagNumber)+".h5"]
 			return
-		# Remove "tmp" dataset
-		if "tmp" in self._h5items: del self._h5items["tmp"]
-		# Converted to ordered list
-		self._h5items = sorted(self._h5items.values(), key=lambda x:int(x.name[6:]))
+		# Converted to ordered list of (key, file)
+		self._h5items = sorted(self._h5items.items(), key=lambda x:int(x[0]))
 		
 		# Case of a cylindrical geometry
 		# Build the list of fields that can be reconstructed
@@ -142,6 +140,16 @@ class Field(Diagnostic):
 			self._error += ["Diagnostic not loaded: No fields found"]
 			return
 		
+		# Open the file(s)
+		h5files = {}
+		for file in set(file for key, file in self._h5items):
+			try:
+				h5files[file] = self._h5py.File(file, 'r')
+			except Exception as e:
+				self._error += ["Diagnostic not loaded: Could not open file "+file]
+				return
+		self._h5items = [(key, h5files[file]) for key, file in self._h5items]
+		
 		# Get available fields
 		sortedfields = reversed(sorted(self._fields, key = len))
 		
@@ -149,15 +157,20 @@ class Field(Diagnostic):
 		# -------------------------------------------------------------------
 		# Parse the `field` argument
 		self.operation = field
-		self._operation = self.operation
+		operation = self.operation
 		self._fieldname = []
 		for f in sortedfields:
-			if self._re.search(r"\b"+f+r"\b",self._operation):
-				self._operation = self._re.sub(r"(?<!')"+f+r"\b","C['"+f+"']",self._operation)
+			if self._re.search(r"\b"+f+r"\b",operation):
+				operation = self._re.sub(r"\b"+f+r"\b","C_"+f,operation)
 				self._fieldname.append(f)
 		if not self._fieldname:
 			self._error += ["String "+self.operation+" does not seem to include any field"]
 			return
+		try:
+			self._operation = Operation(operation)
+		except Exception as e:
+			self._error += ["Cannot understand operation '"+self.operation+"'"]
+			return
 		
 		# Check subset
 		if subset is None: subset = {}
@@ -223,7 +236,7 @@ class Field(Diagnostic):
 					print("WARNING: field "+f+" does not have mode(s): "+','.join(unavailable_modes))
 		
 		# Get the shape of fields
-		fields = [f for f in self._h5items[0].values() if f]
+		fields = [f for f in self._h5item(0).values() if f]
 		self._raw_shape = fields[0].shape
 		self._initialShape = fields[0].shape
 		for fd in fields:
@@ -340,6 +353,21 @@ class Field(Diagnostic):
 			self._complex_selection_real = tuple(self._complex_selection_real)
 			self._complex_selection_imag = tuple(self._complex_selection_imag)
 			
+			# In the case of "theta", complex modes are read as contiguous blocks
+			# of interleaved (real, imaginary) numbers, then viewed as complex
+			if theta is not None and self._is_complex:
+				rows = range(self._raw_shape[1]//2)
+				if type(self._selection[1]) is slice:
+					rows = rows[self._selection[1]]
+					self._mode_subselection = (Ellipsis, slice(None, None, rows.step))
+				else:
+					rows = rows[self._selection[1]:self._selection[1]+1]
+					self._mode_subselection = (Ellipsis, slice(None))
+				self._mode_selection = (self._selection[0], slice(2*rows[0], 2*rows[-1]+2))
+				self._mode_shape = (self._finalShape[0], 2*(rows[-1]-rows[0]+1))
+				self._cos = dict( (imode, self._np.cos(imode*self._theta)) for imode in self._modes )
+				self._sin = dict( (imode, self._np.sin(imode*self._theta)) for imode in self._modes )
+			
 			# In the case of "build3d", prepare some data for the 3D construction
 			if build3d is not None:
 				# Calculate the raw data positions
@@ -354,15 +382,8 @@ class Field(Diagnostic):
 				if len(x)==0 or len(y)==0 or len(z)==0:
 					self._error += ["Error: The array shape to be constructed seems to be empty"]
 					return
-				y2, z2 = self._np.meshgrid(y,z)
-				r2 = self._np.sqrt(y2**2 + z2**2)
-				self._theta = self._np.arctan2(z2, y2)
-				del y2, z2
-				r3 = self._np.tile(r2, (len(x), 1, 1))
-				self._theta = self._np.tile(self._theta, (len(x), 1, 1))[self._selection]
-				x3 = self._np.rollaxis(self._np.tile(x,(len(y),len(z),1)),2)
-				self._xr = self._np.stack((x3, r3), axis=-1)
-				del x3, r3, r2
+				# Prepare the interpolation from the cylindrical grid to the box
+				self._interpolator = CylindricalInterpolator(self._raw_positions, x, y, z, self._selection)
 		
 		# Build units
 		units = {}
@@ -403,10 +424,15 @@ class Field(Diagnostic):
 	
 	# get all available timesteps
 	def getAvailableTimesteps(self):
-		try:    times = [float(a.name[6:]) for a in self._h5items]
+		try:    times = [float(key) for key, f in self._h5items]
 		except Exception as e: times = []
 		return self._np.double(times)
 	
+	# get the h5 group of a given time index
+	def _h5item(self, index):
+		key, f = self._h5items[index]
+		return f["data/"+key]
+	
 	# get the value of x_moved for a requested timestep
 	def getXmoved(self, t):
 		if not self._validate(): return
@@ -416,11 +442,98 @@ class Field(Diagnostic):
 			return []
 		# get h5 iteration group
 		index = self._data[t]
-		h5item = self._h5items[index]
+		h5item = self._h5item(index)
 		# Change units
 		factor, _ = self.units._convert("L_r", None)
 		return h5item.attrs["x_moved"]*factor if "x_moved" in h5item.attrs else 0.
 	
+	# Handle moving window
+	def _setTime(self, t):
+		if not self.moving or self.cylindrical or 'x' not in self._type:
+			return
+		h5item = self._h5item(self._data[t])
+		if "x_moved" in h5item.attrs:
+			self._xoffset = h5item.attrs["x_moved"]
+			if self.dim>1 and hasattr(self,"_extent"):
+				self._extent[0] = self._xfactor*(self._xoffset + self._centers[0][ 0])
+				self._extent[1] = self._xfactor*(self._xoffset + self._centers[0][-1])
+	
+	# Blocks of rows along the first axis, containing about `chunksize` cells each
+	# (only one block if the operation is not elementwise, e.g. "Ex/Ex.max()")
+	def _blocks(self):
+		if not self._operation.elementwise:
+			return ChunkedRange(self._finalShape[0], self._finalShape[0])
+		rowsize = max(int(self._np.prod(self._finalShape[1:])), 1)
+		return ChunkedRange(self._finalShape[0], max(self._chunksize // rowsize, 1))
+	
+	# Selection of a block of rows in the file
+	def _blockSelection(self, first, last):
+		s = self._selection[0]
+		if type(s) is slice:
+			start, step = s.start or 0, s.step or 1
+			s = slice(start + first*step, start + last*step, step)
+		return (s,) + tuple(self._selection[1:])
+	
+	# Read a dataset into a new array
+	def _read(self, dataset, shape, selection):
+		B = self._np.empty(shape)
+		try:
+			dataset.read_direct(B, source_sel=selection) # get array
+		except Exception as e:
+			B = self._np.squeeze(B)
+			dataset.read_direct(B, source_sel=selection) # get array
+			B = self._np.reshape(B, shape)
+		return B
+
+	# Selection in the file restricted to `index` (integers or slices along the axes of the data)
+	def _subsetSelection(self, index):
+		# Only possible when the data is not averaged or transformed, and the operation is elementwise
+		if self.cylindrical or any(self._averages) or callable(self._data_transform) or not self._operation.elementwise:
+			return None
+		index = iter(index)
+		selection = []
+		whole = True
+		for s, n in zip(self._selection, self._finalShape):
+			if type(s) is slice:
+				axis = (s.start or 0, s.step or 1, int(n))
+				k = _composeAxis(axis, next(index))
+				whole = whole and k == axis
+				if type(k) is tuple:
+					if k[1] < 0 or k[2] == 0: return None
+					k = _axisToSlice(k)
+			else:
+				k = s
+			selection.append(k)
+		# The whole data is read as usual, so that it is cached and prefetched
+		if whole:
+			return None
+		return tuple(selection)
+
+	# Read only the data restricted to `index`, unless the whole timestep is already available
+	def _dataAtTimeSubset(self, t, index):
+		selection = self._subsetSelection(index)
+		if selection is None or (self._cacheKey, t) in self.simulation.cache:
+			return Diagnostic._dataAtTimeSubset(self, t, index)
+		readSelection = tuple(s if type(s) is slice else slice(s, s+1, 1) for s in selection)
+		key = None
+		if self._cacheKey is not None:
+			key = ((self._cacheKey, tuple((s.start, s.stop, s.step) for s in readSelection)), t)
+		A = self.simulation.cache.get(key) if key is not None else None
+		if A is None:
+			h5item = self._h5item(self._data[t])
+			self._setTime(t)
+			shape = tuple(len(range(s.start, s.stop, s.step)) for s in readSelection)
+			C = {}
+			for field in self._fieldname:
+				C["C_"+field] = self._read(h5item[field], shape, readSelection)
+			A = self._np.reshape(self._operation(C), shape)
+			if key is not None:
+				self.simulation.cache.put(key, A)
+		else:
+			self._setTime(t)
+		A = A[tuple(slice(None) if type(s) is slice else 0 for s in selection)]
+		return self._np.log10(self._vfactor*A) if self._data_log else self._vfactor*A
+
 	# Method to obtain the data only
 	def _getDataAtTime(self, t):
 		if not self._validate(): return
@@ -430,34 +543,51 @@ class Field(Diagnostic):
 			return []
 		# Get arrays from requested field
 		index = self._data[t]
-		C = {}
-		h5item = self._h5items[index]
+		h5item = self._h5item(index)
 		
 		# Handle moving window
-		if self.moving and "x_moved" in h5item.attrs and 'x' in self._type:
-			self._xoffset = h5item.attrs["x_moved"]
-			if self.dim>1 and hasattr(self,"_extent"):
-				self._extent[0] = self._xfactor*(self._xoffset + self._centers[0][ 0])
-				self._extent[1] = self._xfactor*(self._xoffset + self._centers[0][-1])
+		self._setTime(t)
 		
-		 # for each field in operation, obtain the data
-		for field in self._fieldname:
-			B = self._np.empty(self._finalShape)
-			try:
-				h5item[field].read_direct(B, source_sel=self._selection) # get array
-			except Exception as e:
-				B = self._np.squeeze(B)
-				h5item[field].read_direct(B, source_sel=self._selection) # get array
-				B = self._np.reshape(B, self._finalShape)
-			C.update({ field:B })
-		
-		# Calculate the operation
-		A = eval(self._operation)
-		# Apply the averaging
-		A = self._np.reshape(A,self._finalShape)
-		for iaxis in range(self._naxes):
-			if self._averages[iaxis]:
-				A = self._np.mean(A, axis=iaxis, keepdims=True)
+		# Read and calculate the operation by blocks along the first axis,
+		# so that temporary arrays remain small. The averages are accumulated
+		# block by block, in the same order as numpy.mean for identical results
+		blocks = self._blocks()
+		if self._averages[0]:
+			# The first axis is averaged: accumulate the sum of rows
+			# (numpy sums single-element rows differently, so they are not split)
+			if blocks.nchunks > 1 and self._np.prod(self._finalShape[1:]) == 1:
+				blocks = ChunkedRange(self._finalShape[0], self._finalShape[0])
+			A = None
+		else:
+			# The other axes are averaged in each block
+			reducedShape = [1 if avg else n for n, avg in zip(self._finalShape, self._averages)]
+			reducedShape[0] = self._finalShape[0]
+			A = self._np.empty(reducedShape)
+		for first, last, nrows in blocks:
+			shape = (nrows,) + tuple(self._finalShape[1:])
+			selection = self._blockSelection(first, last)
+			C = {}
+			for field in self._fieldname:
+				C["C_"+field] = self._read(h5item[field], shape, selection)
+			B = self._np.reshape(self._operation(C), shape)
+			if self._averages[0]:
+				if blocks.nchunks == 1:
+					A = self._np.mean(B, axis=0, keepdims=True)
+					break
+				for row in B:
+					if A is None: A = row.copy()
+					else        : A += row
+			else:
+				for iaxis in range(1, self._naxes):
+					if self._averages[iaxis]:
+						B = self._np.mean(B, axis=iaxis, keepdims=True)
+				A[first:last] = B
+		if self._averages[0]:
+			if blocks.nchunks > 1:
+				A = self._np.reshape(A / self._finalShape[0], (1,)+tuple(self._finalShape[1:]))
+			for iaxis in range(1, self._naxes):
+				if self._averages[iaxis]:
+					A = self._np.mean(A, axis=iaxis, keepdims=True)
 		# remove averaged axes
 		A = self._np.squeeze(A)
 		# transform if requested
@@ -476,13 +606,20 @@ class Field(Diagnostic):
 		# get data
 		index = self._data[t]
 		C = {}
-		h5item = self._h5items[index]
+		h5item = self._h5item(index)
 		for field in self._fieldname: # for each field in operation
 			available_modes = self._fields[field]
 			F = self._np.zeros(self._finalShape)
 			f = field + "_mode_"
 			for imode in self._modes:
 				if imode not in available_modes: continue
+				if self._is_complex:
+					B = self._read(h5item[f+str(imode)], self._mode_shape, self._mode_selection)
+					B = B.view(self._np.complex128)[self._mode_subselection]
+					F += self._cos[imode] * B.real
+					if imode > 0:
+						F += self._sin[imode] * B.imag
+					continue
 				B_real = self._np.empty(self._finalShape)
 				B_imag = self._np.empty(self._finalShape)
 				try:
@@ -501,10 +638,10 @@ class Field(Diagnostic):
 				if imode > 0:
 					F += (self._np.sin(imode*self._theta)) * B_imag
 				
-			C.update({ field:F })
+			C.update({ "C_"+field:F })
 		
 		# Calculate the operation
-		A = eval(self._operation)
+		A = self._operation(C)
 		# Apply the averaging
 		A = self._np.reshape(A,self._finalShape)
 		for iaxis in range(self._naxes):
@@ -518,7 +655,6 @@ class Field(Diagnostic):
 	# Method to obtain the data only
 	# Specific to cylindrical geometry, to reconstruct a 3d box
 	def _build3d_getDataAtTime(self, t):
-		from scipy.interpolate import RegularGridInterpolator
 		if not self._validate(): return
 		# Verify that the timestep is valid
 		if t not in self._timesteps:
@@ -528,7 +664,7 @@ class Field(Diagnostic):
 		# Get arrays from requested field
 		index = self._data[t]
 		C = {}
-		h5item = self._h5items[index]
+		h5item = self._h5item(index)
 		step = 2 if self._is_complex else 1
 		for field in self._fieldname: # for each field in operation
 			available_modes = self._fields[field]
@@ -543,16 +679,14 @@ class Field(Diagnostic):
 					B = self._np.squeeze(B)
 					h5item[f+str(imode)].read_direct(B)
 					B = self._np.reshape(B, self._raw_shape)
-				B_real = RegularGridInterpolator(self._raw_positions, B[:,0::step], bounds_error=False, fill_value=0.)(self._xr)
-				F += self._np.cos(imode*self._theta) * B_real[self._selection]
+				F += self._interpolator.cos(imode) * self._interpolator(B[:,0::step])
 				if imode > 0.:
-					B_imag = RegularGridInterpolator(self._raw_positions, B[:,1::step], bounds_error=False, fill_value=0.)(self._xr)
-					F += self._np.sin(imode*self._theta) * B_imag[self._selection]
+					F += self._interpolator.sin(imode) * self._interpolator(B[:,1::step])
 				
-			C.update({ field:F })
+			C.update({ "C_"+field:F })
 		
 		# Calculate the operation
-		A = eval(self._operation)
+		A = self._operation(C)
 		# Apply the averaging
 		A = self._np.reshape(A,self._finalShape)
 		for iaxis in range(self._naxes):
@@ -1,5 +1,7 @@
 from .Diagnostic import Diagnostic
 from .._Utils import *
+from collections import OrderedDict
+from copy import deepcopy
 
 class ParticleBinning(Diagnostic):
 	"""Class for loading a particle binning diagnostic"""
@@ -7,7 +9,9 @@ class ParticleBinning(Diagnostic):
 	_diagName = "ParticleBinning"
 	hasComposite = False
 	
-	def _init(self, diagNumber=None, timesteps=None, subset=None, sum=None, data_log=False, data_transform=None, include={}, **kwargs):
+	def _init(self, diagNumber=None, timesteps=None, subset=None, sum=None, data_log=False, data_transform=None, include={}, chunksize=10000000, **kwargs):
+		
+		self._chunksize = chunksize
 		
 		# Search available diags
 		diag_numbers, diag_names = self.simulation.getDiags(self._diagName)
@@ -58,6 +62,7 @@ class ParticleBinning(Diagnostic):
 		except Exception as e:
 			self._error += ["Cannot understand operation '"+self.operation+"'"]
 			return
+		self._operation = Operation(self._re.sub(r"#(\d+)", r"A_\1", self.operation), self._include)
 		# Verify that all requested diags all have the same shape
 		self._axes = {}
 		self._naxes = {}
@@ -200,13 +205,15 @@ class ParticleBinning(Diagnostic):
 			
 			# Get limits when auto limits
 			if axis["min"] == "auto":
-				axis["auto_min"] = [it.attrs["min%d"%iaxis] for it in self._h5items[self._diags[0]]]
+				axis["auto_min"] = [limits["min%d"%iaxis] for limits in self._getAutoLimits()]
 				self.auto_axes = True
 			if axis["max"] == "auto":
-				axis["auto_max"] = [it.attrs["max%d"%iaxis] for it in self._h5items[self._diags[0]]]
+				axis["auto_max"] = [limits["max%d"%iaxis] for limits in self._getAutoLimits()]
 				self.auto_axes =  True
 		
 		# Set all axes sum/subset
+		self._axesCache = OrderedDict()
+		self._axesCacheBytes = 0
 		if not self._updateAxes(self._timesteps[0]):
 			return
 		
@@ -267,46 +274,66 @@ class ParticleBinning(Diagnostic):
 		return title, units
 	
 	# Gets info about diagnostic number "diagNumber"
+	# The info is kept in the simulation object, and a copy is returned
 	def _getInfo(self,diagNumber):
+		key = (self._diagName, diagNumber, tuple(self._results_path))
+		info = self.simulation._diagInfo.get(key)
+		if info is None:
+			info = self._readInfo(diagNumber)
+			if not info:
+				return info
+			self.simulation._diagInfo[key] = info
+		return deepcopy(info)
+	
+	# Gets the automatic limits of the axes at each timestep
+	# They are kept in the simulation object, so that each group is read only once
+	def _getAutoLimits(self):
+		key = (self._diagName, self._diags[0], tuple(self._results_path), "limits")
+		limits = self.simulation._diagInfo.setdefault(key, {})
+		for it in self._h5items[self._diags[0]]:
+			if it.name not in limits:
+				limits[it.name] = dict( (k,v) for k,v in it.attrs.items() if k[:3] in ["min","max"] )
+		return [limits[it.name] for it in self._h5items[self._diags[0]]]
+	
+	# Parses the attributes of diagnostic number "diagNumber"
+	def _readInfo(self,diagNumber):
 		info = {}
 		for path in self._results_path:
-			# Open file
-			try:
-				file = path+self._os.sep+self._diagName+str(diagNumber)+'.h5'
-				f = self._h5py.File(file, 'r')
-			except Exception as e:
+			# Get the file attributes from the index
+			file = path+self._os.sep+self._diagName+str(diagNumber)+'.h5'
+			entry = self.simulation._index.get(file)
+			if entry is None:
 				continue
 			# get attributes from file
 			axes = []
 			deposited_quantity = "weight_power" # necessary for radiation spectrum
 			time_average = None
 			# Parse each attribute
-			for name, value in f.attrs.items():
+			for name, value in entry["attrs"].items():
 				if name == "deposited_quantity":
 					try:
-						deposited_quantity = bytes.decode(value)
+						deposited_quantity = _decode(value)
 					except Exception as e:
 						deposited_quantity = "user_function"
 				elif name == "time_average":
 					time_average = int(value)
 				elif name == "species":
-					species = bytes.decode(value.strip()).split() # get all species numbers
+					species = _decode(value.strip()).split() # get all species numbers
 					species = [int(s) for s in species]
 				elif name[0:4] == "axis":
 					n = int(name[4:]) # axis number
-					sp = bytes.decode(value).split()
+					sp = _decode(value).split()
 					while len(axes)<n+1: axes.append({}) # extend the array to the adequate size
 					axes[n] = dict(
 						type = sp[0], min = sp[1], max = sp[2], size = int(sp[3]),
 						log = bool(int(sp[4])), edges_included = bool(int(sp[5])), coefficients = 0 if sp[6]=="[]" else eval(sp[6])
 					)
 				elif name == "photon_energy_axis":
-					sp = bytes.decode(value).split()
+					sp = _decode(value).split()
 					axes.append( dict(
 						type = "gamma", min = float(sp[0]), max = float(sp[1]), size = int(sp[2]),
 						log = bool(int(sp[3])), edges_included = bool(int(sp[4]))
 					))
-			f.close()
 			# Verify that the info corresponds to the diag in the other paths
 			if info == {}:
 				info = {"#":diagNumber, "deposited_quantity":deposited_quantity, "tavg":time_average, "species":species, "axes":axes}
@@ -353,7 +380,40 @@ class ParticleBinning(Diagnostic):
 			if "subsetInfo" in ax: info += ax["subsetInfo"]+"\n"
 		return info
 	
+	# State of the axes that depends on the limits of the axes
+	_axesState = ["_finalShape", "_selection", "_type", "_shape", "_centers", "_log", "_label", "_units", "_bsize"]
+	_axesCacheMaxBytes = 100e6
+	
+	# Set the axes for a given timestep. Axes previously calculated for the same limits are re-used
 	def _updateAxes(self, timestep):
+		i = self._indexOfTime[self._diags[0]][timestep]
+		limits = tuple(
+			( axis["auto_min"][i] if axis["min"]=="auto" else float(axis["min"]),
+			  axis["auto_max"][i] if axis["max"]=="auto" else float(axis["max"]) )
+			for axis in self._axes
+		)
+		state = self._axesCache.pop(limits, None)
+		if state is None:
+			if not self._calculateAxes(limits):
+				return False
+			state = (
+				[getattr(self, name) for name in self._axesState],
+				[dict( (k, axis[k]) for k in ["edges", "centers", "sumInfo", "subsetInfo"] if k in axis ) for axis in self._axes]
+			)
+			self._axesCacheBytes += self._np.size(self._bsize) * 8
+		else:
+			for name, value in zip(self._axesState, state[0]):
+				setattr(self, name, value)
+			for axis, values in zip(self._axes, state[1]):
+				axis.update(values)
+		# Keep the most recent axes, within a memory limit
+		self._axesCache[limits] = state
+		while len(self._axesCache) > 1 and self._axesCacheBytes > self._axesCacheMaxBytes:
+			_, (old, _) = self._axesCache.popitem(last=False)
+			self._axesCacheBytes -= self._np.size(old[-1]) * 8
+		return True
+	
+	def _calculateAxes(self, limits):
 		uniform = True
 		plot_diff = []
 		coeff = 1.
@@ -365,11 +425,9 @@ class ParticleBinning(Diagnostic):
 		self._log     = []
 		self._label   = []
 		self._units   = []
-		i = self._indexOfTime[self._diags[0]][timestep]
 		
 		for iaxis, axis in enumerate(self._axes):
-			axismin = axis["auto_min"][i] if axis["min"]=="auto" else float(axis["min"])
-			axismax = axis["auto_max"][i] if axis["max"]=="auto" else float(axis["max"])
+			axismin, axismax = limits[iaxis]
 			
 			# Find the vector of values along the axis
 			if axis["log"]:
@@ -452,8 +510,9 @@ class ParticleBinning(Diagnostic):
 			elif len(plot_diff)==1:
 				self._bsize = plot_diff[0]
 			else:
-				self._bsize = self._np.prod( self._np.array( self._np.meshgrid( *plot_diff ) ), axis=0)
-				self._bsize = self._bsize.transpose([1,0]+list(range(2,len(plot_diff))))
+				self._bsize = plot_diff[0]
+				for d in plot_diff[1:]:
+					self._bsize = self._np.multiply.outer(self._bsize, d)
 		self._bsize = 1. / self._bsize
 		if not self.hasComposite:
 			self._bsize *= coeff
@@ -474,21 +533,17 @@ class ParticleBinning(Diagnostic):
 		else:
 			times = set()
 			for path in self._results_path:
-				try:
-					file = path+self._os.sep+self._diagName+str(diagNumber)+'.h5'
-					f = self._h5py.File(file, 'r')
-				except Exception as e:
+				file = path+self._os.sep+self._diagName+str(diagNumber)+'.h5'
+				entry = self.simulation._index.get(file)
+				if entry is None:
 					print("Cannot open file "+file)
 					return self._np.array([])
-				times.update( set(f.keys()) )
-				f.close()
+				times.update( set(entry["keys"]) )
 			times = [int(t.strip("timestep")) for t in times]
 			return self._np.array(times)
 	
-	# Method to obtain the data only
-	def _getDataAtTime(self, t):
-		if not self._validate(): return
-		# Auto axes require recalculation of bin size and centers
+	# Auto axes require recalculation of bin size and centers
+	def _setTime(self, t):
 		if self.auto_axes:
 			self._updateAxes(t)
 			if len(self._shape) > 1:
@@ -505,37 +560,105 @@ class ParticleBinning(Diagnostic):
 				if self._log[1]:
 					self._extent[2] = self._np.log10(self._extent[2])
 					self._extent[3] = self._np.log10(self._extent[3])
-		# Get arrays from all requested diagnostics
-		A = {}
-		for d in self._diags:
-			# find the index of the array corresponding to the requested timestep
-			try:
-				index = self._indexOfTime[d][t]
-			except Exception as e:
-				print("Timestep "+str(t)+" not found in this diagnostic")
-				return []
-			# get data
-			B = self._np.empty(self._finalShape)
-			try:
-				self._h5items[d][index].read_direct(B, source_sel=self._selection) # get array
-			except Exception as e:
-				B = self._np.squeeze(B)
-				self._h5items[d][index].read_direct(B, source_sel=self._selection) # get array
-				B = self._np.reshape(B, self._finalShape)
-			B[self._np.isnan(B)] = 0.
-			# Divide by the bins size
-			B *= self._bsize
-			# Append this diag's array for the operation
-			A.update({ d:B })
-		# Calculate operation
-		data_operation = self.operation
-		for d in reversed(self._diags):
-			data_operation = data_operation.replace("#"+str(d),"A["+str(d)+"]")
-		A = eval(data_operation, self._include, locals())
-		# Apply the summing
+	
+	# Read a slab of the selected data of one diag, between `start` and `stop` along `axis`
+	# (all the selection if `axis` is None), and divide by the bins size
+	def _readSlab(self, d, index, axis, start, stop):
+		h5item = self._h5items[d][index]
+		selection = [s if type(s) is slice else slice(s, s+1) for s in self._selection]
+		shape = list(self._finalShape)
+		bsize = self._bsize
+		if axis is not None:
+			indices = self._np.arange(h5item.shape[axis])[selection[axis]]
+			selection[axis] = slice(indices[start], indices[stop-1]+1, selection[axis].step)
+			shape[axis] = stop - start
+			if self._np.ndim(bsize) > 0:
+				bsize = bsize[(slice(None),)*axis + (slice(start, stop),)]
+		B = self._np.empty(shape)
+		h5item.read_direct(B, source_sel=tuple(selection)) # get array
+		B[self._np.isnan(B)] = 0.
+		B *= bsize
+		return B
+	
+	# Choose how the data is read by slabs, so that the sums are accumulated slab by slab.
+	# Returns the axis (or None if all is read at once), the slabs bounds, and whether
+	# the slabs must be accumulated (when all the axes with more than one bin are summed)
+	def _slabs(self, index):
+		# Operations that are not elementwise (e.g. "#0/#0.sum()") need the whole arrays
+		if not self._operation.elementwise:
+			return None, [(0, 1)], False
+		shape = [int(n) for n in self._finalShape]
+		summed = ["sum" in axis for axis in self._axes]
+		accumulate = False
+		axis = None
 		for iaxis in range(self._naxes):
-			if "sum" in self._axes[iaxis]:
-				A = self._np.sum(A, axis=iaxis, keepdims=True)
+			if not summed[iaxis] and shape[iaxis] > 1:
+				axis = iaxis
+				break
+		if axis is None:
+			# Rows of a single element would not be summed in the same order
+			if self._naxes > 1 and summed[0] and self._np.prod(shape[1:]) > 1:
+				axis = 0
+				accumulate = True
+			else:
+				return None, [(0, 1)], False
+		thickness = max(1, self._chunksize // max(1, self._np.prod(shape)//shape[axis]))
+		# Slabs of a single element would not be summed in the same order as the whole array
+		thickness = max(2, thickness)
+		# Align slabs on the HDF5 chunks
+		chunks = self._h5items[self._diags[0]][index].chunks
+		sel = self._selection[axis]
+		if chunks and type(sel) is slice and (sel.step or 1) == 1 and thickness > chunks[axis]:
+			thickness = thickness // chunks[axis] * chunks[axis]
+		# The last slab is merged with the previous one if smaller
+		bounds = list(range(0, shape[axis]-thickness+1, thickness)) + [shape[axis]]
+		if len(bounds) == 1: bounds = [0] + bounds
+		return axis, list(zip(bounds[:-1], bounds[1:])), accumulate
+	
+	# Method to obtain the data only
+	def _getDataAtTime(self, t):
+		if not self._validate(): return
+		self._setTime(t)
+		# find the index of the arrays corresponding to the requested timestep
+		try:
+			index = dict( (d, self._indexOfTime[d][t]) for d in self._diags )
+		except Exception as e:
+			print("Timestep "+str(t)+" not found in this diagnostic")
+			return []
+		# The data is read by slabs, in which the sums are calculated
+		axis, slabs, accumulate = self._slabs(index[self._diags[0]])
+		result = None
+		for start, stop in slabs:
+			# Get arrays from all requested diagnostics
+			A = {}
+			for d in self._diags:
+				A.update({ "A_"+str(d):self._readSlab(d, index[d], axis, start, stop) })
+			# Calculate operation
+			A["t"] = t
+			A = self._operation(A)
+			if accumulate:
+				# Continue the sum over the first axis, row after row
+				if result is not None:
+					A = self._np.concatenate((result, A))
+				result = self._np.sum(A, axis=0, keepdims=True)
+				continue
+			# Apply the summing
+			for iaxis in range(self._naxes):
+				if "sum" in self._axes[iaxis]:
+					A = self._np.sum(A, axis=iaxis, keepdims=True)
+			if axis is None:
+				result = A
+				break
+			if result is None:
+				shape = list(A.shape)
+				shape[axis] = self._finalShape[axis]
+				result = self._np.empty(shape)
+			result[(slice(None),)*axis + (slice(start, stop),)] = A
+		A = result
+		if accumulate:
+			for iaxis in range(1, self._naxes):
+				if "sum" in self._axes[iaxis]:
+					A = self._np.sum(A, axis=iaxis, keepdims=True)
 		# remove summed axes
 		A = self._np.squeeze(A)
 		# transform if requested
@@ -52,14 +52,120 @@ def LinXYCurveMatrix2D(n, oversize=0):
 	A[o:-o, o:-o] = np.arange(n[0]*n[1]).reshape(n[0],n[1]).T
 	return A
 
-# Method to partition a matrix depending on a list of values
+# Tables of the Hilbert functions in `dim` dimensions, for all values 0 <= i < 2^dim:
+# inverse gray code, entry points and intra sub-hypercube directions.
+# Taken from src/DomainDecomposition/Hilbert_functions.cpp
+def _hilbertTables(dim):
+	import numpy as np
+	def gcinv(g):
+		i, j = g, 1
+		while (1<<j) <= g:
+			i ^= g >> j
+			j += 1
+		return i
+	def tsb(i):
+		k = 0
+		while i & 1:
+			i >>= 1
+			k += 1
+		return k
+	def direction(i):
+		if i == 0: return 0
+		return tsb(i if i & 1 else i-1) % dim
+	def entry(i):
+		if i == 0: return 0
+		g = 2*((i-1)//2)
+		return g ^ (g>>1)
+	n = 2**dim
+	return (
+		np.array([gcinv(i) for i in range(n)], dtype="int64"),
+		np.array([entry(i) for i in range(n)], dtype="int64"),
+		np.array([direction(i) for i in range(n)], dtype="int64")
+	)
+
+# Bitwise rotations of the `dim` first bits of arrays, for 1 <= shift <= dim
+def _rotl(value, shift, dim):
+	return ((value << shift) | (value >> (dim - shift))) & ((1<<dim) - 1)
+def _rotr(value, shift, dim):
+	return ((value >> shift) | (value << (dim - shift))) & ((1<<dim) - 1)
+
+# Hilbert index of the patches of coordinates `coords` (one array per dimension) in a
+# hypercube with 2^m patches per side, starting from the entry points `e` and directions `d`.
+# Returns the index and the final entry points and directions.
+def _hilbertIndex(m, coords, e, d):
+	dim = len(coords)
+	gcinv, entry, direction = _hilbertTables(dim)
+	h = 0 * coords[0]
+	for i in range(m-1, -1, -1):
+		l = 0 * coords[0]
+		for k, c in enumerate(coords):
+			l |= ((c >> i) & 1) << k
+		w = gcinv[_rotr(l ^ e, d+1, dim)]
+		e = e ^ _rotl(entry[w], d+1, dim)
+		d = (d + direction[w] + 1) % dim
+		h = (h << dim) | w
+	return h, e, d
+
+# Hilbert index of the patches x, y in a box with 2^m0 x 2^m1 patches
+def _generalHilbertIndex2D(m0, m1, x, y):
+	e = 0 * x
+	d = 0 * x
+	if m0 >= m1:
+		mmin = m1
+		h = (x >> mmin) << (2*mmin)
+		x = x & ((1<<mmin) - 1)
+	else:
+		mmin = m0
+		d += 1
+		h = (y >> mmin) << (2*mmin)
+		y = y & ((1<<mmin) - 1)
+	if mmin > 0:
+		hl, e, d = _hilbertIndex(mmin, [x, y], e, d)
+		h = h + hl
+	return h, e, d
+
+# Hilbert index of the patches x, y, z in a box with 2^m[0] x 2^m[1] x 2^m[2] patches
+def _generalHilbertIndex3D(m, x, y, z):
+	coords = [x, y, z]
+	if m[0] >= m[1] and m[0] >= m[2]:
+		dimmax = 0
+	elif m[1] > m[0] and m[1] >= m[2]:
+		dimmax = 1
+	else:
+		dimmax = 2
+	if m[(dimmax+1)%3] >= m[(dimmax+2)%3]:
+		dimmed, dimmin = (dimmax+1)%3, (dimmax+2)%3
+	else:
+		dimmed, dimmin = (dimmax+2)%3, (dimmax+1)%3
+	mmin = m[dimmin]
+	# First on a flattened 2D grid along dimmax and dimmed
+	h, e, d = _generalHilbertIndex2D(m[dimmax]-mmin, m[dimmed]-mmin, coords[dimmax] >> mmin, coords[dimmed] >> mmin)
+	# Then in the local cube of side 2^mmin
+	mask = (1<<mmin) - 1
+	hl, _, _ = _hilbertIndex(mmin, [coords[dimmax] & mask, coords[dimmed] & mask, coords[dimmin] & mask], e, d)
+	return (h << (3*mmin)) + hl
+
+# Method to create a matrix containing the hindex of a 3D Hilbert curve (indices x, y, z)
+def HilbertCurveMatrix3D(m):
+	import numpy as np
+	x, y, z = np.indices((2**m[0], 2**m[1], 2**m[2]), dtype="int64")
+	return _generalHilbertIndex3D(m, x, y, z).astype("uint32")
+
+# Method to create a matrix containing the hindex of a 3D linXYZ curve (indices x, y, z)
+def LinXYZCurveMatrix3D(n):
+	import numpy as np
+	return np.arange(n[0]*n[1]*n[2], dtype="uint32").reshape(n[0], n[1], n[2])
+
+# Method to create a matrix containing the hindex of a 3D linZYX curve (indices x, y, z)
+def LinZYXCurveMatrix3D(n):
+	import numpy as np
+	return np.arange(n[0]*n[1]*n[2], dtype="uint32").reshape(n[2], n[1], n[0]).transpose(2, 1, 0)
+
+# Method to partition a matrix depending on a sorted list of values: each element
+# gets the index of the last value which is lower or equal
 def PartitionMatrix( matrix, listOfValues, oversize=0 ):
 	import numpy as np
-	partitioned = np.empty(matrix.shape, dtype="uint32")
-	max_index = 0
-	for v in listOfValues:
-		partitioned[matrix >= v] = max_index
-		max_index += 1
+	partitioned = (np.searchsorted(np.asarray(listOfValues), matrix, side="right") - 1).astype("uint32")
 	if oversize>0:
 		partitioned[ :oversize,:] = np.uint32(-1)
 		partitioned[:, :oversize] = np.uint32(-1)
@@ -145,12 +251,10 @@ class Performances(Diagnostic):
 			if type(map) is not str:
 				self._error += ["Diagnostic not loaded: argument `map` must be a string"]
 				return
-			if self._ndim_fields > 2:
-				self._error += ["Diagnostic not loaded: argument `map` not available in "+str(self._ndim_fields)+"D"]
-				return
 			self.operation = map
 			self._mode = "map"
 			self._m = [int(self._np.log2(n)) for n in self._number_of_patches]
+			self._hindices = None
 
 		elif histogram is not None:
 			if type(histogram) is not list or len(histogram) != 4:
@@ -298,16 +402,13 @@ class Performances(Diagnostic):
 		# get data
 		index = self._data[t]
 		C = []
-		h5item = self._h5items[index]["quantities_uint"]
-		for index_in_file in self._quantities_uint:
-			B = self._np.empty((self._nprocs,), dtype="uint")
-			h5item.read_direct( B, source_sel=self._np.s_[index_in_file,:] )
-			C.append( B )
-		h5item = self._h5items[index]["quantities_double"]
-		for index_in_file in self._quantities_double:
-			B = self._np.empty((self._nprocs,), dtype="double")
-			h5item.read_direct( B, source_sel=self._np.s_[index_in_file,:] )
-			C.append( B )
+		# Read all quantities at once
+		if self._quantities_uint:
+			B = self._h5items[index]["quantities_uint"][()]
+			C += [ self._np.array(B[index_in_file], dtype="uint") for index_in_file in self._quantities_uint ]
+		if self._quantities_double:
+			B = self._h5items[index]["quantities_double"][()]
+			C += [ self._np.array(B[index_in_file], dtype="double") for index_in_file in self._quantities_double ]
 
 		# Calculate the operation
 		# First patch performance information
@@ -373,42 +474,154 @@ class Performances(Diagnostic):
 
 			if self._ndim_fields == 1:
 				# Make a matrix with MPI ranks at each patch location
-				ranks = self._np.empty((self._number_of_patches[0],), dtype=self._np.uint32)
-				previous_h = 0
-				rank = 0
-				for h in hindices[1:]:
-					ranks[previous_h:h] = rank
-					rank += 1
-					previous_h = h
-				ranks[h:] = rank
+				ranks = PartitionMatrix( self._np.arange(self._number_of_patches[0]), hindices )
 
 				# For each patch, associate the data of corresponding MPI rank
 				return A[ranks]
 
-			elif self._ndim_fields == 2:
-				# Make a matrix with patch indices on the Hilbert curve
+			else:
+				# Make a matrix with patch indices on the curve (shared by all diagnostics)
 				if not hasattr(self, "_curvematrix"):
-					if self.patch_arrangement == 'hilbertian':
-						self._curvematrix = HilbertCurveMatrix2D(self._m[0], self._m[1], oversize=1)
-					elif self.patch_arrangement == 'linearized_XY':
-						self._curvematrix = LinXYCurveMatrix2D(self._number_of_patches, oversize=1)
-					elif self.patch_arrangement == 'linearized_YX':
-						self._curvematrix = LinYXCurveMatrix2D(self._number_of_patches, oversize=1)
-					else:
-						print("Error: patch arrangement "+str(self.patch_arrangement)+" not implemented")
+					self._curvematrix = self._getCurveMatrix()
+					if self._curvematrix is None:
 						return []
-					
-				# Make a matrix with MPI ranks at each patch location
-				self._ranks = PartitionMatrix( self._curvematrix, hindices, oversize=1 )
+
+				# Make a matrix with MPI ranks at each patch location (only when the ranks change)
+				if self._hindices is None or not self._np.array_equal(hindices, self._hindices):
+					self._hindices = hindices
+					if self._ndim_fields == 2:
+						self._ranks = PartitionMatrix( self._curvematrix, hindices, oversize=1 )
+					else:
+						self._ranks = PartitionMatrix( self._curvematrix, hindices )
 
 				# For each patch, associate the data of corresponding MPI rank
-				return A[self._ranks[1:-1,1:-1]]
+				if self._ndim_fields == 2:
+					return A[self._ranks[1:-1,1:-1]]
+				else:
+					return A[self._ranks]
 
 		# If histogram requested
 		elif self._mode == "hist":
 			histogram, _ = self._np.histogram( A, self._edges )
 			return histogram
 
+	# In 2D, maps are indexed as [y, x]
+	def _dataLayout(self):
+		if self._mode == "map" and self._ndim_fields == 2 and not callable(self._data_transform):
+			return tuple(reversed(self._shape)), self._np.dtype("double")
+		return Diagnostic._dataLayout(self)
+
+	# Matrix of the patch indices along the curve of the patch arrangement
+	def _getCurveMatrix(self):
+		arrangement = getattr(self, "patch_arrangement", "hilbertian")
+		key = ("PerformancesCurve", arrangement, tuple(self._number_of_patches))
+		if key in self.simulation._diagInfo:
+			return self.simulation._diagInfo[key]
+		if self._ndim_fields == 2 and arrangement == 'hilbertian':
+			matrix = HilbertCurveMatrix2D(self._m[0], self._m[1], oversize=1)
+		elif self._ndim_fields == 2 and arrangement == 'linearized_XY':
+			matrix = LinXYCurveMatrix2D(self._number_of_patches, oversize=1)
+		elif self._ndim_fields == 2 and arrangement == 'linearized_YX':
+			matrix = LinYXCurveMatrix2D(self._number_of_patches, oversize=1)
+		elif self._ndim_fields == 3 and arrangement == 'hilbertian':
+			matrix = HilbertCurveMatrix3D(self._m)
+		elif self._ndim_fields == 3 and arrangement == 'linearized_XYZ':
+			matrix = LinXYZCurveMatrix3D(self._number_of_patches)
+		elif self._ndim_fields == 3 and arrangement == 'linearized_ZYX':
+			matrix = LinZYXCurveMatrix3D(self._number_of_patches)
+		else:
+			print("Error: patch arrangement "+str(arrangement)+" not implemented")
+			return None
+		self.simulation._diagInfo[key] = matrix
+		return matrix
+
+	# Read the quantities of all timesteps and all processes, for the given rows of quantities_double.
+	# Kept in the data cache of the simulation object.
+	def _readAllQuantities(self, rows):
+		first, last = min(rows), max(rows)+1
+		key = ("PerformancesQuantities", tuple(self._results_path), len(self._h5items), first, last)
+		Q = self.simulation.cache.get(key)
+		if Q is None:
+			Q = self._np.empty((len(self._h5items), last-first, self._nprocs))
+			for i, item in enumerate(self._h5items):
+				item["quantities_double"].read_direct( Q[i], source_sel=self._np.s_[first:last,:] )
+			self.simulation.cache.put(key, Q)
+		return Q[:, [r-first for r in rows], :]
+
+	# Analysis of the load balance
+	def getLoadAnalysis(self, threshold=3.5):
+		"""
+		Analysis of the time spent by each process, at the selected timesteps
+		
+		Parameters:
+		-----------
+		threshold: float (default 3.5)
+			A process is an outlier at a given timestep when its time deviates from the median
+			of all processes by more than `threshold` times the median absolute deviation.
+		
+		Returns:
+		--------
+		A dictionary of arrays. The times are those spent between consecutive outputs.
+		"""
+		if not self._validate(): return
+		names = self._availableQuantities_double
+		missing = [q for q in ["timer_total", "total_load"] if q not in names]
+		if missing:
+			print("ERROR: quantities "+", ".join(missing)+" not found in this Performances diagnostic")
+			return
+		timers = [q for q in names if q.startswith("timer_") and q not in ["timer_global", "timer_total"]]
+		rows = [names.index(q) for q in ["timer_total", "total_load"] + timers]
+		key = ("PerformancesAnalysis", tuple(self._results_path), tuple(self._timesteps), threshold)
+		analysis = self.simulation._diagInfo.get(key)
+		if analysis is not None:
+			return self._copyAnalysis(analysis)
+		Q = self._readAllQuantities(rows)
+		load = Q[:, 1, :]
+		# Timers are cumulated: get the time between outputs (timers restart from zero after a restart)
+		cumulated = self._np.delete(Q, 1, axis=1)
+		T = cumulated.copy()
+		T[1:] -= cumulated[:-1]
+		reset = self._np.broadcast_to(T[:, :1, :] < 0., T.shape).copy()
+		T[reset] = cumulated[reset]
+		# Keep the selected timesteps
+		selected = self._np.flatnonzero(self._np.isin(self.getAvailableTimesteps(), self._timesteps))
+		T = T[selected]
+		load = load[selected]
+		total = T[:, 0, :]
+		with self._np.errstate(invalid="ignore", divide="ignore"):
+			mean = total.mean(axis=1)
+			critical_rank = total.argmax(axis=1)
+			critical_time = total.max(axis=1)
+			imbalance = critical_time / mean
+			shares = T[:, 1:, :].sum(axis=2) / total.sum(axis=1)[:,None]
+			critical_shares = T[self._np.arange(len(selected)), 1:, critical_rank] / critical_time[:,None]
+			load_imbalance = load.max(axis=1) / load.mean(axis=1)
+			# Outliers (robust z-score)
+			# When most processes have the same time, the MAD is zero: use the mean absolute deviation
+			deviation = self._np.abs(total - self._np.median(total, axis=1)[:,None])
+			mad = 1.4826 * self._np.median(deviation, axis=1)[:,None]
+			mad[mad == 0.] = 1.2533 * deviation.mean(axis=1)[:,None][mad == 0.]
+			outliers = self._np.argwhere( (deviation > threshold * mad) & (mad > 0.) )
+		analysis = {
+			"times"          : self._timesteps,
+			"timers"         : timers,
+			"mean_time"      : mean,
+			"critical_time"  : critical_time,
+			"critical_rank"  : critical_rank,
+			"imbalance"      : imbalance,
+			"shares"         : shares,
+			"critical_shares": critical_shares,
+			"load_imbalance" : load_imbalance,
+			"outliers"       : outliers,
+			"outlier_counts" : self._np.bincount(outliers[:,1], minlength=self._nprocs),
+		}
+		self.simulation._diagInfo[key] = analysis
+		return self._copyAnalysis(analysis)
+
+	# The analysis kept in the simulation object must not be modified by the user
+	def _copyAnalysis(self, analysis):
+		return dict( (k, v.copy() if hasattr(v, "copy") else list(v)) for k, v in analysis.items() )
+
 	# Convert data to VTK format
 	def toVTK(self,numberOfPieces=1,axis_quantity="patch"):
 		"""
@@ -517,4 +730,8 @@ class Performances(Diagnostic):
 		ax.collections = [c for c in ax.collections if c not in [self._vlines,self._hlines]]
 		self._vlines = ax.vlines( vlines_i, vlines_jmin, vlines_jmax, **self.options.plot)
 		self._hlines = ax.hlines( hlines_j, hlines_imin, hlines_imax, **self.options.plot)
-		return self._plot
\ No newline at end of file
+		return self._plot
+
+	# The patch contours change at each frame: no blitting
+	def _canBlit(self):
+		return False
\ No newline at end of file
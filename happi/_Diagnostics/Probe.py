@@ -100,6 +100,11 @@ class Probe(Diagnostic):
 		self._fieldn = [ int(f[1:]) for f in requested_fields ] # indexes of the requested fields
 		self._fieldn = list(set(self._fieldn))
 		self._fieldname = [ fields[i] for i in self._fieldn ] # names of the requested fields
+		try:
+			self._operation = Operation(self._re.sub(r"#(\d+)", r"C_\1", self.operation))
+		except Exception as e:
+			self._error += ["Cannot understand operation '"+field+"'"]
+			return
 
 		# Check subset
 		if subset is None: subset = {}
@@ -253,8 +258,6 @@ class Probe(Diagnostic):
 			self._ordering = self._np.array([0.], dtype=int)
 		
 		else:
-			self._ordering = self._np.zeros((self._finalShape.prod(),), dtype=int)-1
-			
 			# calculate matrix inverse
 			if self._naxes==1:
 				p  = self._np.sqrt(self._np.sum(self._np.array(p)**2))
@@ -266,35 +269,21 @@ class Probe(Diagnostic):
 					tmpShape = self._np.hstack((tmpShape, 1))
 				invp = self._np.linalg.inv(self._np.array(p).transpose())
 			
-			# calculate ordering
-			p0 = self._myinfo["p0"]
-			for first, last, npart in ChunkedRange(self.numpoints, chunksize):
-				positions = self._h5probe[0]["positions"][first:last,:].T # actual probe points positions
-				# Subtract by p0
-				for i in range(p0.size):
-					positions[i,:] -= p0[i]
-				# In 1D convert positions to distances
-				if self._naxes==1:
-					positions = self._np.sqrt(self._np.sum(positions**2,0))[self._np.newaxis,:]
-				# Find the indices of the points
-				ijk = (self._np.dot(invp, positions)*(tmpShape-1)[:,self._np.newaxis]).round().astype(int)
-				keep = self._np.ones( (npart,), dtype=bool )
-				for d,sel in enumerate(self._selection): # keep only points in selection
-					start = sel.start or 0
-					stop = sel.stop or tmpShape[d]
-					step = sel.step or 1
-					keep *= (ijk[d] >= start) * (ijk[d] < stop) * ((ijk[d]-start) % step == 0)
-				ijk = ijk[:,keep]
-				indexInFile = self._np.arange(first, last, dtype=int)[keep]
-				# Convert to indices in the selection
-				for d,sel in enumerate(self._selection):
-					ijk[d] = (ijk[d] - (sel.start or 0)) // (sel.step or 1)
-				# Linearize index
-				indexInArray = ijk[0]
-				for d in range(1,len(self._finalShape)):
-					indexInArray = indexInArray*self._finalShape[d] + ijk[d]
-				# Store ordering
-				self._ordering[indexInArray] = indexInFile
+			# calculate ordering, or retrieve it from a previous calculation
+			self._ordering = self._getOrdering(invp, tmpShape, chunksize)
+		
+		# Prepare the gathering of the points, block by block
+		self._gather = []
+		for first, last, npart in ChunkedRange(self.numpoints, chunksize):
+			o = self._ordering - first
+			keep = self._np.flatnonzero((o>=0) * (o<npart))
+			if keep.size == 0: continue
+			o = o[keep]
+			start = o.min()
+			self._gather.append(( first+start, first+o.max()+1, keep, o-start ))
+		self._rows = sorted(self._fieldn)
+		self._block = {}
+		self._blockTimesteps = []
 		
 		# Build units
 		titles = {}
@@ -337,7 +326,7 @@ class Probe(Diagnostic):
 		if info is None: info = self._getMyInfo()
 		printedInfo = "Probe #%s: "%info["probeNumber"]
 		if "dimension" in info:
-			printedInfo += str(info["dimension"])+"-dimensional,"+" with fields "+bytes.decode(info["fields"])
+			printedInfo += str(info["dimension"])+"-dimensional,"+" with fields "+_decode(info["fields"])
 			i = 0
 			while "p"+str(i) in info:
 				printedInfo += "\n\tp"+str(i)+" = "+" ".join(info["p"+str(i)].astype(str).tolist())
@@ -355,23 +344,21 @@ class Probe(Diagnostic):
 		out = {}
 		out["probeNumber"] = probeNumber
 		for path in self._results_path:
-			try:
-				file = path+"/Probes"+str(probeNumber)+".h5"
-				probe = self._h5py.File(file, 'r')
-			except Exception as e:
+			file = path+"/Probes"+str(probeNumber)+".h5"
+			entry = self.simulation._index.get(file)
+			if entry is None:
 				continue
-			out["dimension"] = probe.attrs["dimension"]
-			out["shape"] = self._np.array(probe["number"], dtype=int)
-			out["fields"] = probe.attrs["fields"]
-			if "time_integral" in probe.attrs:
-				out["time_integral"] = probe.attrs["time_integral"]
+			out["dimension"] = entry["attrs"]["dimension"]
+			out["shape"] = self._np.array(entry["datasets"]["number"], dtype=int)
+			out["fields"] = entry["attrs"]["fields"]
+			if "time_integral" in entry["attrs"]:
+				out["time_integral"] = entry["attrs"]["time_integral"]
 			else:
 				out["time_integral"] = False
 			i = 0
-			while "p"+str(i) in probe.keys():
-				out["p"+str(i)] = self._np.array(probe["p"+str(i)])
+			while "p"+str(i) in entry["datasets"]:
+				out["p"+str(i)] = self._np.array(entry["datasets"]["p"+str(i)])
 				i += 1
-			probe.close()
 			return out
 		self._error += ["\tWarning: Cannot open file Probes"+str(probeNumber)+".h5"]
 		return out
@@ -382,7 +369,11 @@ class Probe(Diagnostic):
 	# get all available fields
 	def getFields(self):
 		for file in self._h5probe:
-			fields_here = bytes.decode(file.attrs["fields"]).split(",")
+			entry = self.simulation._index.get(file.filename)
+			if entry is not None:
+				fields_here = entry["attrs"]["fields"].split(",")
+			else:
+				fields_here = bytes.decode(file.attrs["fields"]).split(",")
 			try:
 				fields = [f for f in fields_here if f in fields]
 			except Exception as e:
@@ -407,6 +398,114 @@ class Probe(Diagnostic):
 	def getAvailableTimesteps(self):
 		return self._alltimesteps
 
+	# Obtain the ordering of the points from the simulation's cache, from the file
+	# `.happi_probeN_ordering.npz` saved by a previous calculation, or calculate it
+	def _getOrdering(self, invp, tmpShape, chunksize):
+		import hashlib
+		positions = self._h5probe[0]["positions"]
+		key = hashlib.sha1()
+		key.update(repr((self.numpoints, self._finalShape.tolist(), list(tmpShape), self._selection)).encode())
+		key.update(self._np.ascontiguousarray(invp, dtype="double").tobytes())
+		# All the positions identify the ordering (it changes with the patch decomposition)
+		for first, last, npoints in ChunkedRange(self.numpoints, chunksize):
+			key.update(self._np.ascontiguousarray(positions[first:last]).tobytes())
+		key = "ordering_"+key.hexdigest()
+		file = self._os.path.dirname(self._h5probe[0].filename) + self._os.sep + ".happi_probe"+str(self.probeNumber)+"_ordering.npz"
+		cacheKey = ("ProbeOrdering", file, key)
+		ordering = self.simulation.cache.get(cacheKey)
+		if ordering is not None:
+			return ordering
+		try:
+			with self._np.load(file) as f:
+				if key in f.files:
+					ordering = f[key]
+		except Exception as e:
+			pass
+		if ordering is None:
+			ordering = self._computeOrdering(invp, tmpShape, chunksize)
+			if self.simulation._index.persistent:
+				self._saveOrdering(file, key, ordering)
+		self.simulation.cache.put(cacheKey, ordering)
+		return ordering
+	
+	# Only the most recent orderings are kept in the file
+	_maxSavedOrderings = 4
+	def _saveOrdering(self, file, key, ordering):
+		from collections import OrderedDict
+		orderings = OrderedDict()
+		try:
+			with self._np.load(file) as f:
+				for k in f.files[-(self._maxSavedOrderings-1):]:
+					if k != key: orderings[k] = f[k]
+		except Exception as e:
+			pass
+		orderings[key] = ordering
+		tmpfile = file+".tmp"+str(self._os.getpid())
+		try:
+			with open(tmpfile, 'wb') as f:
+				self._np.savez(f, **orderings)
+			self._os.rename(tmpfile, file)
+		except Exception as e:
+			# Directory not writable: the ordering remains in memory only
+			try: self._os.remove(tmpfile)
+			except Exception as e: pass
+	
+	# Calculate the location, in the file, of each point of the selection
+	def _computeOrdering(self, invp, tmpShape, chunksize):
+		ordering = self._np.zeros((self._finalShape.prod(),), dtype=int)-1
+		p0 = self._myinfo["p0"]
+		for first, last, npart in ChunkedRange(self.numpoints, chunksize):
+			positions = self._h5probe[0]["positions"][first:last,:].T # actual probe points positions
+			# Subtract by p0
+			for i in range(p0.size):
+				positions[i,:] -= p0[i]
+			# In 1D convert positions to distances
+			if self._naxes==1:
+				positions = self._np.sqrt(self._np.sum(positions**2,0))[self._np.newaxis,:]
+			# Find the indices of the points
+			ijk = (self._np.dot(invp, positions)*(tmpShape-1)[:,self._np.newaxis]).round().astype(int)
+			keep = self._np.ones( (npart,), dtype=bool )
+			for d,sel in enumerate(self._selection): # keep only points in selection
+				start = sel.start or 0
+				stop = sel.stop or tmpShape[d]
+				step = sel.step or 1
+				keep *= (ijk[d] >= start) * (ijk[d] < stop) * ((ijk[d]-start) % step == 0)
+			ijk = ijk[:,keep]
+			indexInFile = self._np.arange(first, last, dtype=int)[keep]
+			# Convert to indices in the selection
+			for d,sel in enumerate(self._selection):
+				ijk[d] = (ijk[d] - (sel.start or 0)) // (sel.step or 1)
+			# Linearize index
+			indexInArray = ijk[0]
+			for d in range(1,len(self._finalShape)):
+				indexInArray = indexInArray*self._finalShape[d] + ijk[d]
+			# Store ordering
+			ordering[indexInArray] = indexInFile
+		return ordering
+	
+	# Read the requested fields of several timesteps, and put the points in order.
+	# Each timestep is read with one HDF5 call per block of points.
+	def _readTimesteps(self, timesteps):
+		C = self._np.zeros((len(timesteps), len(self._rows), self._ordering.size))
+		for first, last, keep, source in self._gather:
+			data = self._np.empty((len(timesteps), len(self._rows), last-first))
+			for i, t in enumerate(timesteps):
+				self._dataForTime[t].read_direct(data[i], self._np.s_[self._rows, first:last])
+			C[:,:,keep] = data[:,:,source]
+		return C
+	
+	# When looping over timesteps, read them by blocks
+	def _startPrefetch(self, timesteps):
+		Diagnostic._startPrefetch(self, timesteps)
+		self._block = {}
+		self._blockTimesteps = []
+		if self._prefetchQueue is None:
+			self._blockTimesteps = [t for t in timesteps if (self._cacheKey, t) not in self.simulation.cache]
+	def _stopPrefetch(self):
+		Diagnostic._stopPrefetch(self)
+		self._block = {}
+		self._blockTimesteps = []
+	
 	# Method to obtain the data only
 	def _getDataAtTime(self, t):
 		if not self._validate(): return
@@ -415,20 +514,33 @@ class Probe(Diagnostic):
 			print("Timestep "+t+" not found in this diagnostic")
 			return []
 		# Get arrays from requested field
-		# get data
+		if t not in self._block and t in self._blockTimesteps:
+			# read this timestep and the following ones together
+			i = self._blockTimesteps.index(t)
+			n = max(1, self._chunksize // max(1, len(self._rows)*self._ordering.size))
+			timesteps = self._blockTimesteps[i:i+n]
+			self._blockTimesteps = self._blockTimesteps[:i] + self._blockTimesteps[i+n:]
+			block = self._readTimesteps(timesteps)
+			for j, tj in enumerate(timesteps):
+				self._block[tj] = block[j]
+		if t in self._block:
+			data = self._block.pop(t)
+		else:
+			data = self._readTimesteps([t])[0]
 		C = {}
-		op = self.operation
-		for n in reversed(self._fieldn): # for each field in operation
-			buffer = self._np.zeros((self._ordering.size,), dtype="double")
-			for first, last, npart in ChunkedRange(self.numpoints, self._chunksize):
-				o = self._ordering - first
-				keep = self._np.flatnonzero((o>=0) * (o<npart))
-				data = self._dataForTime[t][n,first:last]
-				buffer[keep] = data[o[keep]]
-			C.update({ n:buffer })
-			op = op.replace("#"+str(n), "C["+str(n)+"]")
-		# Calculate the operation
-		A = eval(op)
+		for j, n in enumerate(self._rows): # for each field in operation
+			C.update({ "C_"+str(n):data[j] })
+		# Calculate the operation, by blocks of points if it is elementwise,
+		# so that temporary arrays remain small
+		npoints = self._ordering.size
+		if self._operation.elementwise and npoints > self._chunksize:
+			A = None
+			for first, last, n in ChunkedRange(npoints, self._chunksize):
+				B = self._operation(dict( (name, c[first:last]) for name, c in C.items() ))
+				if A is None: A = self._np.empty((npoints,), dtype=self._np.result_type(B))
+				A[first:last] = B
+		else:
+			A = self._operation(C)
 		# Reshape array because it is flattened in the file
 		A = self._np.reshape(A, self._finalShape)
 		# Apply the averaging
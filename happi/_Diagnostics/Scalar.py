@@ -44,37 +44,13 @@ class Scalar(Diagnostic):
 		self._data_log = data_log
 		self._data_transform = data_transform
 		
-		# Already get the data from the file
-		# Loop file line by line
-		self._alltimesteps = []
-		self._values = []
-		times_values = {}
-		for path in self._results_path:
-			try:
-				with open(path+'/scalars.txt') as f:
-					for line in f:
-						line = line.strip()
-						if line[0]!="#": break
-						prevline = line
-					scalars = prevline[1:].strip().split() # list of scalars
-					scalarindex = scalars.index(scalar) # index of the requested scalar
-					line = str(line.strip()).split()
-					times_values[ int( self._np.round(float(line[0]) / float(self.timestep)) ) ] = float(line[scalarindex])
-					for line in f:
-						line = str(line.strip()).split()
-						times_values[ int( self._np.round(float(line[0]) / float(self.timestep)) ) ] = float(line[scalarindex])
-			except:
-				continue
-		self._alltimesteps  = self._np.array(sorted(times_values.keys()))
-		self._values = self._np.array([times_values[k] for k in self._alltimesteps])
+		# Already get the data from the table of all scalars
+		names, self._alltimesteps, table = self.simulation._scalarTable.get(self._results_path, self.timestep)
+		self._values = table[:, names.index(scalar)]
 		self._timesteps = self._np.copy(self._alltimesteps)
 		
 		# 2 - Manage timesteps
 		# -------------------------------------------------------------------
-		# fill the "_data" dictionary with the index to each time
-		self._data = {}
-		for i,t in enumerate(self._timesteps):
-			self._data.update({ t : i })
 		# If timesteps is None, then keep all timesteps otherwise, select timesteps
 		if timesteps is not None:
 			try:
@@ -88,6 +64,9 @@ class Scalar(Diagnostic):
 			self._error += ["Timesteps not found"]
 			return
 		
+		# fill the "_data" dictionary with the index to each time
+		self._data = dict(zip( self._timesteps.tolist(), self._np.searchsorted(self._alltimesteps, self._timesteps).tolist() ))
+		
 		
 		# 3 - Build units
 		# -------------------------------------------------------------------
@@ -120,33 +99,11 @@ class Scalar(Diagnostic):
 	
 	# get all available scalars
 	def getScalars(self):
-		allScalars = None
-		for path in self._results_path:
-			try:
-				file = path+'/scalars.txt'
-				f = open(file, 'r')
-			except Exception as e:
-				continue
-			try:
-				# Find last commented line
-				prevline = ""
-				for line in f:
-					line = line.strip()
-					if line[0]!="#": break
-					prevline = line[1:].strip()
-				scalars = str(prevline).split() # list of scalars
-				scalars = scalars[1:] # remove first, which is "time"
-			except Exception as e:
-				scalars = []
-			f.close()
-			if allScalars is None:
-				allScalars = scalars
-			else:
-				allScalars = self._np.intersect1d(allScalars, scalars)
-		if allScalars is None:
+		names = self.simulation._scalarTable.get(self._results_path, self.timestep)[0]
+		if names is None:
 			self._error += ["Cannot open 'scalars.txt'"]
 			return []
-		return allScalars
+		return names[1:] # remove first, which is "time"
 	
 	# get all available timesteps
 	def getAvailableTimesteps(self):
@@ -156,7 +113,7 @@ class Scalar(Diagnostic):
 	def _getDataAtTime(self, t):
 		if not self._validate(): return
 		# Verify that the timestep is valid
-		if t not in self._timesteps:
+		if t not in self._data:
 			print("Timestep "+str(t)+" not found in this diagnostic")
 			return []
 		# Get value at selected time
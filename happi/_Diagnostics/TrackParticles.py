@@ -18,11 +18,186 @@ def findClosingCharacter(string, character, start=0):
 			del stack[-1]
 	raise Exception("Error in selector syntax: missing `"+character+"`")
 
+# Order by ID the particles of one timestep (an h5 group of the disordered file)
+# that belong between `first` and `last` in the ordered file
+def _orderParticles(group, properties, fillvalues, offset, selectedIds, first, last, chunksize):
+	import numpy as np
+	data = {}
+	for k, name in properties:
+		data[name] = np.empty((last-first,), dtype=group[k].dtype)
+		data[name].fill(fillvalues[name])
+	# Loop chunks of the input
+	for first_i, last_i, npart_i in ChunkedRange(group["id"].shape[0], chunksize):
+		# Obtain IDs
+		ID = group["id"][first_i:last_i]
+		# Extract useful IDs for this output chunk
+		if selectedIds is None:
+			loc_in_output = ID.astype("uint32") + offset[ (ID>>32).astype("uint32") & 0b111111111111111111111111 ] - 1
+			keep = np.flatnonzero((loc_in_output >= first) * (loc_in_output < last))
+			loc_in_output = loc_in_output[keep] - first
+		else:
+			_,keep,loc_in_output = np.intersect1d( ID, selectedIds, return_indices=True )
+		# Fill arrays with this chunk
+		for k, name in properties:
+			data[name][loc_in_output] = group[k][first_i:last_i][keep]
+	return data
+
+# Intervals of values, used to evaluate a particle selector on the zone map of the sorted file
+# (minimum and maximum of each property in blocks of particles)
+class _ZoneInterval(object):
+	__array_ufunc__ = None # numpy must defer to the operators below
+	__array_priority__ = 1000
+	
+	def __init__(self, lo, hi):
+		self.lo = lo
+		self.hi = hi
+	
+	@staticmethod
+	def _make(value):
+		if isinstance(value, _ZoneInterval):
+			return value
+		if isinstance(value, _ZoneTruth) or not isinstance(value, (int, float)):
+			raise TypeError("Cannot make an interval")
+		return _ZoneInterval(value, value)
+	
+	def __getitem__(self, key):
+		return self
+	def __pos__(self):
+		return self
+	def __neg__(self):
+		return _ZoneInterval(-self.hi, -self.lo)
+	def __add__(self, other):
+		other = _ZoneInterval._make(other)
+		return _ZoneInterval(self.lo+other.lo, self.hi+other.hi)
+	__radd__ = __add__
+	def __sub__(self, other):
+		return self + (-_ZoneInterval._make(other))
+	def __rsub__(self, other):
+		return _ZoneInterval._make(other) + (-self)
+	@staticmethod
+	def _product(a, b):
+		# 0*inf is 0: infinite bounds only mean that the finite values are not bounded
+		# (NaN bounds, from blocks without particles, remain NaN)
+		import numpy as np
+		with np.errstate(invalid="ignore"):
+			p = np.multiply(a, b)
+		return np.where(np.isnan(p) & ~np.isnan(a) & ~np.isnan(b), 0., p)
+	def __mul__(self, other):
+		import numpy as np
+		other = _ZoneInterval._make(other)
+		products = [_ZoneInterval._product(a, b) for a in (self.lo, self.hi) for b in (other.lo, other.hi)]
+		return _ZoneInterval(np.minimum.reduce(products), np.maximum.reduce(products))
+	__rmul__ = __mul__
+	def __truediv__(self, other):
+		import numpy as np
+		other = _ZoneInterval._make(other)
+		with np.errstate(divide="ignore"):
+			inverse = _ZoneInterval(np.divide(1., other.hi), np.divide(1., other.lo))
+		result = self * inverse
+		# Unbounded when the divisor interval contains zero
+		zero = (other.lo <= 0.) & (other.hi >= 0.)
+		return _ZoneInterval(np.where(zero, -np.inf, result.lo), np.where(zero, np.inf, result.hi))
+	__div__ = __truediv__
+	def __rtruediv__(self, other):
+		return _ZoneInterval._make(other) / self
+	__rdiv__ = __rtruediv__
+	def __abs__(self):
+		import numpy as np
+		lo = np.where(self.lo >= 0., self.lo, np.where(self.hi <= 0., -self.hi, 0.))
+		return _ZoneInterval(lo, np.maximum(np.abs(self.lo), np.abs(self.hi)))
+	def __pow__(self, exponent):
+		if not isinstance(exponent, (int, float)) or exponent < 0:
+			raise TypeError("Unsupported exponent")
+		if exponent == int(exponent) and int(exponent) % 2 == 0:
+			base = abs(self)
+		elif exponent == int(exponent):
+			base = self
+		else:
+			if (self.lo < 0.).any(): raise TypeError("Unsupported exponent")
+			base = self
+		return _ZoneInterval(base.lo**exponent, base.hi**exponent)
+	
+	# Comparisons tell where they may be true; they may always be false (particles not existing)
+	def __gt__(self, other):
+		return _ZoneTruth(self.hi > _ZoneInterval._make(other).lo)
+	def __ge__(self, other):
+		return _ZoneTruth(self.hi >= _ZoneInterval._make(other).lo)
+	def __lt__(self, other):
+		return _ZoneTruth(self.lo < _ZoneInterval._make(other).hi)
+	def __le__(self, other):
+		return _ZoneTruth(self.lo <= _ZoneInterval._make(other).hi)
+	def __eq__(self, other):
+		other = _ZoneInterval._make(other)
+		return _ZoneTruth((self.lo <= other.hi) & (other.lo <= self.hi))
+	def __ne__(self, other):
+		return _ZoneTruth(True)
+
+class _ZoneTruth(object):
+	__array_ufunc__ = None
+	__array_priority__ = 1000
+	
+	def __init__(self, canBeTrue, canBeFalse=True):
+		self.canBeTrue = canBeTrue
+		self.canBeFalse = canBeFalse
+	
+	@staticmethod
+	def _make(value):
+		if isinstance(value, _ZoneTruth):
+			return value
+		if isinstance(value, bool):
+			return _ZoneTruth(value, not value)
+		raise TypeError("Cannot make a truth value")
+	
+	def __mul__(self, other):
+		other = _ZoneTruth._make(other)
+		return _ZoneTruth(self.canBeTrue & other.canBeTrue, self.canBeFalse | other.canBeFalse)
+	__rmul__ = __and__ = __rand__ = __mul__
+	def __add__(self, other):
+		other = _ZoneTruth._make(other)
+		return _ZoneTruth(self.canBeTrue | other.canBeTrue, self.canBeFalse & other.canBeFalse)
+	__radd__ = __or__ = __ror__ = __add__
+	def __invert__(self):
+		return _ZoneTruth(self.canBeFalse, self.canBeTrue)
+
+# Disordered files opened in each worker process
+_disorderedFiles = {}
+
+def _orderParticlesWorker(file, group, *args):
+	if file not in _disorderedFiles:
+		import h5py
+		_disorderedFiles[file] = h5py.File(file, "r")
+	return _orderParticles(_disorderedFiles[file][group], *args)
+
+# Read particles first to last of a group of a disordered file, for the given list of
+# (axis, dataset name), optionally in the given buffers (reused from one call to the next)
+def _readChunk(group, axes, first, last, xmoved, buffers=None):
+	import numpy as np
+	data = {}
+	for axis, name in axes:
+		dataset = group[name]
+		if buffers is None:
+			data[axis] = np.empty((last-first,), dtype=dataset.dtype)
+		else:
+			if axis not in buffers or buffers[axis].dtype != dataset.dtype or buffers[axis].size < last-first:
+				buffers[axis] = np.empty((last-first,), dtype=dataset.dtype)
+			data[axis] = buffers[axis][:last-first]
+		if last > first:
+			dataset.read_direct(data[axis], source_sel=np.s_[first:last])
+		if axis == "moving_x":
+			data[axis] -= xmoved
+	return data
+
+def _mapChunkWorker(file, group, axes, first, last, xmoved, func, timestep):
+	if file not in _disorderedFiles:
+		import h5py
+		_disorderedFiles[file] = h5py.File(file, "r")
+	return func(timestep, _readChunk(_disorderedFiles[file][group], axes, first, last, xmoved))
+
 
 class TrackParticles(Diagnostic):
 	"""Class for loading a TrackParticles diagnostic"""
 
-	def _init(self, species=None, select="", axes=[], timesteps=None, sort=True, sorted_as="", length=None, chunksize=20000000, **kwargs):
+	def _init(self, species=None, select="", axes=[], timesteps=None, sort=True, sorted_as="", length=None, chunksize=20000000, workers=0, memory=None, layout=None, compression=None, **kwargs):
 
 		# If argument 'species' not provided, then print available species and leave
 		if species is None:
@@ -99,9 +274,17 @@ class TrackParticles(Diagnostic):
 		if sort:
 			# If the first path does not contain the ordered file (or it is incomplete), we must create it
 			if needsOrdering:
-				self._orderFiles(orderedfile, chunksize, sort)
+				self._orderFiles(orderedfile, chunksize, sort, workers, memory)
 				if self._needsOrdering(orderedfile):
 					return
+				# Change the storage of the sorted file if requested
+				if layout is not None or compression is not None:
+					if self._verbose: print("Rewriting the sorted file ...")
+					try:
+						self._rewriteSorted(orderedfile, layout, compression, chunksize)
+					except Exception as e:
+						self._error += ["Error rewriting the sorted file: "+str(e)]
+						return
 			# Create arrays to store h5 items
 			self._lastfile = self._h5py.File(orderedfile, "r")
 			for prop in ["Id", "x", "y", "z", "px", "py", "pz", "q", "w", "chi",
@@ -152,6 +335,7 @@ class TrackParticles(Diagnostic):
 		
 		# Select particles
 		# -------------------------------------------------------------------
+		self._gatherBudget = memory*1e6 if memory is not None else chunksize*8
 		if sort:
 			self.selectedParticles = self._selectParticles( select, True, chunksize )
 			if self.selectedParticles is None:
@@ -337,6 +521,8 @@ class TrackParticles(Diagnostic):
 				return properties
 			
 			if already_sorted:
+				# Get the zone map: minimum and maximum of the properties in blocks of particles
+				zonemap = self._getZoneMap(set(sum(doubleProps+int16Props, [])), chunksize)
 				# Setup the chunks of particles (if too many particles)
 				chunks = ChunkedRange(self.nParticles, chunksize)
 				# Allocate buffers
@@ -347,27 +533,33 @@ class TrackParticles(Diagnostic):
 					# Execute each of the selector items
 					stack = []
 					for k in range(nOperations):
-						selection = self._np.empty((chunks.adjustedchunksize,), dtype=bool)
+						selection = self._np.empty((actual_chunksize,), dtype=bool)
 						if   seltype[k] == "any(": selection.fill(False)
 						elif seltype[k] == "all(": selection.fill(True )
 						requiredProps = doubleProps[k] + int16Props[k] + ["Id"]
 						# Loop times
 						for time in eval(timeSelector[k]):
 							if self._verbose: print("   Selecting block `"+selstr[k]+")`, at time "+str(time))
-							# Extract required properties from h5 files
 							it = self._locationForTime[time]
-							for prop in requiredProps:
-								self._h5items[prop].read_direct(properties[prop], source_sel=self._np.s_[it,chunkstart:chunkstop], dest_sel=self._np.s_[:actual_chunksize])
-							# Calculate the selector
-							selectionAtTimeT = eval(particleSelector[k]) # array of True or False
+							selectionAtTimeT = self._np.zeros((actual_chunksize,), dtype=bool)
+							existing = self._np.zeros((actual_chunksize,), dtype=bool)
+							# Only read the ranges of particles where the selector may be true
+							for first, last in self._zoneCandidates(zonemap, particleSelector[k], it, chunkstart, chunkstop):
+								# Extract required properties from h5 files
+								for prop in requiredProps:
+									self._h5items[prop].read_direct(properties[prop], source_sel=self._np.s_[it,first:last], dest_sel=self._np.s_[:last-first])
+								# Calculate the selector
+								namespace = {"self":self, "actual_chunksize":last-first, "properties":properties}
+								sel = eval(particleSelector[k], globals(), namespace) # array of True or False
+								sel[self._np.isnan(sel)] = False
+								selectionAtTimeT[first-chunkstart:last-chunkstart] = sel
+								existing[first-chunkstart:last-chunkstart] = properties["Id"][:last-first]>0 # existing particles at that timestep
 							# Combine with selection of previous times
-							selectionAtTimeT[self._np.isnan(selectionAtTimeT)] = False
-							existing = properties["Id"][:actual_chunksize]>0 # existing particles at that timestep
 							if   seltype[k] == "any(": selection[existing] += selectionAtTimeT[existing]
 							elif seltype[k] == "all(": selection *= selectionAtTimeT * existing
 						stack.append(selection)
 					# Merge all stack items according to the operations
-					selectedParticles = self._np.union1d( selectedParticles, eval(operation).nonzero()[0] )
+					selectedParticles = self._np.union1d( selectedParticles, (chunkstart + eval(operation).nonzero()[0]).astype(self._np.uint64) )
 			else:
 				# Execute the selector item
 				selectedParticles = self._np.array([], dtype="uint64")
@@ -406,6 +598,90 @@ class TrackParticles(Diagnostic):
 			except:
 				return
 
+	# Obtain the zone map of the sorted file for the requested properties: for each timestep,
+	# the minimum and maximum of each property in blocks of particles. It is built once and
+	# saved in a file `.happi_TrackParticles_<species>_zonemap.npz` next to the sorted file
+	def _getZoneMap(self, props, chunksize):
+		props = [p for p in props if p in self._h5items]
+		file = self._lastfile.filename
+		stat = self._os.stat(file)
+		key = self._np.array([stat.st_size, stat.st_mtime])
+		sidecar = self._os.path.join(self._os.path.dirname(file), ".happi_"+self._os.path.basename(file)[:-3]+"_zonemap.npz")
+		zonemap = self.simulation._diagInfo.get(("TrackParticlesZoneMap", file))
+		if zonemap is None or not (zonemap["key"] == key).all():
+			zonemap = {"key":key}
+			try:
+				with self._np.load(sidecar) as f:
+					if (f["key"] == key).all():
+						zonemap = dict(f.items())
+			except Exception as e:
+				pass
+			self.simulation._diagInfo[("TrackParticlesZoneMap", file)] = zonemap
+		missing = [p for p in props if "min_"+p not in zonemap]
+		if not missing:
+			return zonemap
+		# Blocks of particles (at most 1024 blocks, aligned on the HDF5 chunks)
+		ntimes, nparticles = self._h5items["Id"].shape
+		if "blocksize" not in zonemap:
+			blocksize = max(4096, -(-nparticles // 1024))
+			chunks = self._h5items["Id"].chunks
+			if chunks:
+				blocksize = -(-blocksize // chunks[1]) * chunks[1]
+			zonemap["blocksize"] = self._np.array(blocksize)
+		blocksize = int(zonemap["blocksize"])
+		nblocks = -(-nparticles // blocksize)
+		columns = max(1, chunksize // max(1, ntimes*blocksize)) * blocksize
+		if self._verbose: print("Building the zone map of "+", ".join(missing)+" ...")
+		for p in missing:
+			mins = self._np.empty((ntimes, nblocks))
+			maxs = self._np.empty((ntimes, nblocks))
+			for first in range(0, nparticles, columns):
+				last = min(first+columns, nparticles)
+				data = self._h5items[p][:, first:last].astype(self._np.double)
+				starts = self._np.arange(0, last-first, blocksize)
+				mins[:, first//blocksize:first//blocksize+starts.size] = self._np.fmin.reduceat(data, starts, axis=1)
+				maxs[:, first//blocksize:first//blocksize+starts.size] = self._np.fmax.reduceat(data, starts, axis=1)
+			zonemap["min_"+p] = mins
+			zonemap["max_"+p] = maxs
+		if self.simulation._index.persistent:
+			tmpfile = sidecar+".tmp"+str(self._os.getpid())
+			try:
+				with open(tmpfile, 'wb') as f:
+					self._np.savez(f, **zonemap)
+				self._os.rename(tmpfile, sidecar)
+			except Exception as e:
+				# Directory not writable: the zone map remains in memory only
+				try: self._os.remove(tmpfile)
+				except Exception as e: pass
+		return zonemap
+	
+	# List the ranges of particles, between `first` and `last`, where a selector may be true
+	# at the timestep index `it`, according to the zone map
+	def _zoneCandidates(self, zonemap, selector, it, first, last):
+		blocksize = int(zonemap.get("blocksize", 0))
+		if blocksize == 0:
+			return [(first, last)]
+		b0, b1 = first // blocksize, (last-1) // blocksize + 1
+		properties = {}
+		for prop in self._re.findall(r"properties\['(\w+)'\]", selector):
+			if "min_"+prop not in zonemap:
+				return [(first, last)]
+			properties[prop] = _ZoneInterval(zonemap["min_"+prop][it, b0:b1], zonemap["max_"+prop][it, b0:b1])
+		try:
+			result = eval(selector, {}, {"properties":properties, "actual_chunksize":0})
+			candidates = self._np.ones((b1-b0,), dtype=bool) & _ZoneTruth._make(result).canBeTrue
+		except Exception as e:
+			return [(first, last)]
+		# Merge consecutive blocks into ranges
+		ranges = []
+		for b in self._np.flatnonzero(candidates) + b0:
+			start, stop = max(first, b*blocksize), min(last, (b+1)*blocksize)
+			if ranges and ranges[-1][1] == start:
+				ranges[-1] = (ranges[-1][0], stop)
+			else:
+				ranges.append((start, stop))
+		return ranges
+	
 	# Method to get info
 	def _info(self):
 		info = "Track particles: species '"+self.species+"'"
@@ -415,25 +691,61 @@ class TrackParticles(Diagnostic):
 				info += "\n                with selection of "+str(self.nselectedParticles)+" particles"
 		return info
 
-	# Read hdf5 dataset faster with unstrusctured list of indices
+	# Read hdf5 dataset faster with unstrusctured list of indices.
+	# The indices are grouped in runs of contiguous particles, and read by blocks of
+	# particles which fit in the memory budget. Each block is read either entirely and
+	# filtered in memory (when the selection is dense) or as a union of hyperslabs.
 	def _readUnstructuredH5(self, dataset, indices, first_time, last_time=None):
 		if last_time is None:
 			last_time = first_time + 1
-		cs = 1000
-		if type(indices) is slice or len(indices) < cs:
+		if type(indices) is slice or len(indices) == 0:
 			return dataset[first_time:last_time, indices]
-		else:
-			n = len(indices)
-			result = self._np.empty(( last_time - first_time, n ), dtype=dataset.dtype)
-			chunksize = min(cs,n)
-			nchunks = int(n/chunksize)
-			chunksize = int(n / nchunks)
-			chunkstop = 0
-			for ichunk in range(nchunks):
-				chunkstart = chunkstop
-				chunkstop  = min(chunkstart + chunksize, n)
-				result[:,chunkstart:chunkstop] = dataset[first_time:last_time, indices[chunkstart:chunkstop]]
-			return result
+		indices = self._np.asarray(indices, dtype=self._np.int64)
+		# The gather works with sorted, unique indices
+		order = None
+		if self._np.any(indices[1:] <= indices[:-1]):
+			indices, order = self._np.unique(indices, return_inverse=True)
+		ntimes = last_time - first_time
+		n = len(indices)
+		result = self._np.empty(( ntimes, n ), dtype=dataset.dtype)
+		# Number of particles read at once
+		budget = getattr(self, "_gatherBudget", 20000000)
+		width = max(1, int(budget // (ntimes*dataset.dtype.itemsize)))
+		# Runs of contiguous indices: result[:, runstart[i]:runstart[i+1]] comes from
+		# the particles indices[runstart[i]] ... indices[runstart[i]] + runlength[i] - 1
+		runstart = self._np.concatenate(([0], self._np.flatnonzero(self._np.diff(indices) != 1) + 1))
+		runlength = self._np.diff(self._np.append(runstart, n))
+		runfirst = indices[runstart]
+		fspace = dataset.id.get_space()
+		start = 0
+		while start < len(runstart):
+			# Runs whose first particle is in the current block
+			blockfirst = runfirst[start]
+			stop = max(start+1, self._np.searchsorted(runfirst, blockfirst + width, side="left"))
+			blocklast = runfirst[stop-1] + runlength[stop-1]
+			r0 = runstart[start]
+			r1 = runstart[stop] if stop < len(runstart) else n
+			# Dense: reading the whole block costs less than the individual runs
+			if blocklast - blockfirst <= (r1 - r0) + 64*(stop - start) and blocklast - blockfirst <= 2*width:
+				block = self._np.empty((ntimes, blocklast - blockfirst), dtype=dataset.dtype)
+				dataset.read_direct(block, source_sel=self._np.s_[first_time:last_time, blockfirst:blocklast])
+				result[:, r0:r1] = block[:, indices[r0:r1] - blockfirst]
+			# Sparse: union of hyperslabs, limited to a few thousand runs at once
+			else:
+				for s0 in range(start, stop, 4096):
+					s1 = min(s0 + 4096, stop)
+					q0 = runstart[s0]
+					q1 = runstart[s1] if s1 < len(runstart) else n
+					fspace.select_none()
+					for irun in range(s0, s1):
+						fspace.select_hyperslab((first_time, int(runfirst[irun])), (ntimes, int(runlength[irun])), op=self._h5py.h5s.SELECT_OR)
+					out = self._np.empty((ntimes, q1 - q0), dtype=dataset.dtype)
+					dataset.id.read(self._h5py.h5s.create_simple(out.shape), fspace, out)
+					result[:, q0:q1] = out
+			start = stop
+		if order is not None:
+			result = result[:, order]
+		return result
 
 	# get all available tracked species
 	def getTrackSpecies(self):
@@ -462,7 +774,7 @@ class TrackParticles(Diagnostic):
 		return disorderedfiles
 
 	# Make the particles ordered by Id in the file, in case they are not
-	def _orderFiles( self, fileOrdered, chunksize, sort ):
+	def _orderFiles( self, fileOrdered, chunksize, sort, workers=0, memory=None ):
 		if self._verbose:
 			print("Ordering particles ... (this could take a while)")
 			if type(sort) is str:
@@ -489,7 +801,6 @@ class TrackParticles(Diagnostic):
 			offset[0] = 0
 			# Do the particle selection if requested
 			selectedIds = None
-			selectedIndices = self._np.s_[:]
 			nparticles_to_write = total_number_of_particles
 			if type(sort) is str:
 				selectedIds = self._selectParticles( sort, False, chunksize )
@@ -500,73 +811,81 @@ class TrackParticles(Diagnostic):
 			for k, name in self._short_properties_from_raw.items():
 				try   : f0.create_dataset(name, size, group[k].dtype, fillvalue=(0 if name=="Id" else self._np.nan))
 				except: pass
-			# Loop times and fill arrays
+			properties = [(k, name) for k, name in self._short_properties_from_raw.items() if name in f0]
+			fillvalues = dict( (name, f0[name].fillvalue) for k, name in properties )
+			# Number of processes, and number of particles ordered at once (limited if a memory budget is given)
+			workers = max(0, int(workers or 0))
+			depth = 2*workers
+			if memory is not None:
+				itemsize = sum([f0[name].dtype.itemsize for k, name in properties])
+				chunksize = max(1, min(chunksize, int(memory*1e6 / (2*itemsize*(depth+1)))))
+			# List the pieces of work: each timestep is split in chunks of the output
+			pieces = []
 			for it, t in enumerate(self._timesteps):
-				
 				# Skip previously-ordered times
 				if it<=latestOrdered: continue
-				
-				if self._verbose: print("    Ordering @ timestep = "+str(t))
 				f, _ = self._locationForTime[t]
-				group = f["data/"+"%010i/"%t+"particles/"+self.species]
+				groupname = "data/"+"%010i/"%t+"particles/"+self.species
+				group = f[groupname]
 				nparticles = group["id"].size
-				if nparticles == 0: continue
-				
-				# If not too many particles, sort all at once
-				if nparticles_to_write < chunksize and nparticles < chunksize:
-					# Get the Ids and find where they should be stored in the final file
-					if selectedIds is None:
-						locs = (
-							group["id"][()].astype("uint32") # takes the second hald of id (meaning particle number)
-							+ offset[ (group["id"][()]>>32).astype("uint32") & 0b111111111111111111111111 ]
-							-1
+				chunks = [(0,0,0)]
+				if nparticles > 0 and nparticles_to_write > 0:
+					chunks = list(ChunkedRange(nparticles_to_write, chunksize))
+				for ichunk, (first_o, last_o, npart_o) in enumerate(chunks):
+					args = None
+					if last_o > first_o:
+						args = (
+							[(k, name) for k, name in properties if k in group], fillvalues, offset,
+							None if selectedIds is None else selectedIds[first_o:last_o],
+							first_o, last_o, chunksize
 						)
-					else:
-						_,selectedIndices,locs = self._np.intersect1d( group["id"][()], selectedIds, return_indices=True )
-					# Loop datasets and order them
-					if len(locs) > 0:
-						for k, name in self._short_properties_from_raw.items():
-							if k not in group: continue
-							ordered = self._np.empty((nparticles_to_write, ), dtype=group[k].dtype)
-							if k == "id": ordered.fill(0)
-							else        : ordered.fill(self._np.nan)
-							ordered[locs] = group[k][()][selectedIndices]
-							f0[name].write_direct(ordered, dest_sel=self._np.s_[it,:])
-				
-				# If too many particles, sort by chunks
-				else:
-					data = {}
-					for k, name in self._short_properties_from_raw.items():
-						data[k] = self._np.empty((chunksize,), dtype=self._np.int16 if k == "charge" else self._np.double)
-					# Loop chunks of the output
-					for first_o, last_o, npart_o in ChunkedRange(nparticles_to_write, chunksize):
-						for k, name in self._short_properties_from_raw.items():
-							if k not in group: continue
-							if k == "id": data[k].fill(0)
-							else        : data[k].fill(self._np.nan)
-						# Loop chunks of the input
-						for first_i, last_i, npart_i in ChunkedRange(nparticles, chunksize):
-							# Obtain IDs
-							ID = group["id"][first_i:last_i]
-							# Extract useful IDs for this output chunk
-							if selectedIds is None:
-								loc_in_output = ID.astype("uint32") + offset[ (ID>>32).astype("uint32") & 0b111111111111111111111111 ] - 1
-								keep = self._np.flatnonzero((loc_in_output >= first_o) * (loc_in_output < last_o))
-								loc_in_output = loc_in_output[keep] - first_o
-							else:
-								_,keep,loc_in_output = self._np.intersect1d( ID, selectedIds[first_o:last_o], return_indices=True )
-							# Fill datasets with this chunk
-							for k, name in self._short_properties_from_raw.items():
-								if k not in group: continue
-								data[k][loc_in_output] = group[k][first_i:last_i][keep]
-						# Accumulated data is written out
-						for k, name in self._short_properties_from_raw.items():
-							if k not in group: continue
-							f0[name][it, first_o:last_o] = data[k][:npart_o]
-						
-				# Indicate that this iteration was succesfully ordered
-				f0.attrs["latestOrdered"] = it
-				f0.flush()
+					pieces.append(( it, t, f.filename, groupname, args, nparticles if ichunk==len(chunks)-1 else None ))
+			# Order the pieces in worker processes (if any), while the main process writes them in order
+			pool = None
+			if workers > 0 and len(pieces) > 1:
+				import multiprocessing
+				if hasattr(multiprocessing, "get_context"):
+					# New processes are started (not forked), so that they do not inherit the open files
+					pool = multiprocessing.get_context("spawn").Pool(workers)
+			try:
+				import time
+				from collections import deque
+				start = lastflush = time.time()
+				nordered = 0
+				pending = deque(pieces)
+				running = deque()
+				while pending or running:
+					while pending and (len(running) < max(depth,1) or not running):
+						it, t, file, groupname, args, nparticles = pending.popleft()
+						if pool is not None and args is not None:
+							job = pool.apply_async(_orderParticlesWorker, (file, groupname)+args)
+						else:
+							job = None
+						running.append(( it, t, groupname, args, nparticles, job ))
+					it, t, groupname, args, nparticles, job = running.popleft()
+					# Write this piece
+					if args is not None:
+						if job is not None:
+							data = job.get()
+						else:
+							data = _orderParticles(self._locationForTime[t][0][groupname], *args)
+						first_o, last_o = args[4], args[5]
+						for name, ordered in data.items():
+							f0[name].write_direct(ordered, dest_sel=self._np.s_[it,first_o:last_o])
+					# Last piece of this timestep
+					if nparticles is not None:
+						nordered += nparticles
+						if self._verbose:
+							print("    Ordered timestep = %d (%d/%d), %.3g particles/s"
+								% (t, it+1, len(self._timesteps), nordered/max(time.time()-start, 1e-9)))
+						# Indicate that this iteration was succesfully ordered
+						if not running and not pending or time.time() - lastflush > 10.:
+							f0.attrs["latestOrdered"] = it
+							f0.flush()
+							lastflush = time.time()
+			finally:
+				if pool is not None:
+					pool.terminate()
 			if self._verbose: print("    Finalizing the ordering process")
 			# Create the "Times" dataset
 			f0.create_dataset("Times", data=self._timesteps)
@@ -595,6 +914,123 @@ class TrackParticles(Diagnostic):
 				self._locationForTime[t][0].close()
 		if self._verbose: print("Ordering succeeded")
 
+	# Shape of the HDF5 chunks of a dataset (times x particles) of the sorted file
+	def _chunkShape(self, layout, shape, itemsize):
+		if layout is None or 0 in shape:
+			return None
+		if type(layout) in [tuple, list]:
+			return tuple( max(1, min(int(c), n)) for c, n in zip(layout, shape) )
+		ntimes, nparticles = shape
+		size = max(1, int(1e6 // itemsize)) # chunks of about 1 MB
+		if layout == "time":
+			return (1, min(nparticles, size))
+		elif layout == "particle":
+			ntimes = min(ntimes, size)
+			return (ntimes, min(nparticles, max(1, size // ntimes)))
+		elif layout == "tiled":
+			ntimes = min(ntimes, int(self._np.sqrt(size)))
+			return (ntimes, min(nparticles, max(1, size // ntimes)))
+		raise Exception("`layout` must be 'time', 'particle', 'tiled' or a chunk shape")
+
+	# Rewrite the sorted file with another chunk layout and compression
+	def _rewriteSorted(self, file, layout, compression, chunksize):
+		filters = {}
+		if compression is True:
+			filters = dict(compression="gzip", shuffle=True)
+		elif type(compression) is int:
+			filters = dict(compression="gzip", compression_opts=compression, shuffle=True)
+		elif compression:
+			filters = dict(compression=compression, shuffle=True)
+		tmpfile = file+".tmp"+str(self._os.getpid())
+		try:
+			with self._h5py.File(file, "r") as f, self._h5py.File(tmpfile, "w") as g:
+				for key, value in f.attrs.items():
+					g.attrs[key] = value
+				for name, dataset in f.items():
+					if dataset.ndim != 2:
+						g.create_dataset(name, data=dataset[()])
+						continue
+					ntimes, nparticles = dataset.shape
+					chunks = self._chunkShape(layout, dataset.shape, dataset.dtype.itemsize)
+					if 0 in dataset.shape:
+						g.create_dataset(name, dataset.shape, dataset.dtype, fillvalue=dataset.fillvalue)
+						continue
+					out = g.create_dataset(name, dataset.shape, dataset.dtype, chunks=chunks or (True if filters else None), fillvalue=dataset.fillvalue, **filters)
+					# Copy blocks of particles, aligned on the chunks
+					columns = max(1, chunksize // ntimes)
+					if out.chunks and columns > out.chunks[1]:
+						columns = columns // out.chunks[1] * out.chunks[1]
+					for first in range(0, nparticles, columns):
+						last = min(first+columns, nparticles)
+						out[:, first:last] = dataset[:, first:last]
+			self._os.rename(tmpfile, file)
+		except Exception as e:
+			try: self._os.remove(tmpfile)
+			except Exception as e: pass
+			raise
+
+	def rechunk(self, layout="particle", compression=None, chunksize=20000000):
+		"""Rewrites the sorted file with another storage layout, to speed up some reads.
+
+		Parameters:
+		-----------
+		layout: "time", "particle", "tiled" or a tuple (times, particles) (default: "particle")
+			Shape of the HDF5 chunks. "particle" is best to read the trajectories of a few
+			particles, "time" is best to read all particles at a few timesteps.
+		compression: None, True, an integer (gzip level) or the name of an HDF5 filter (e.g. "lzf")
+			Lossless compression of the data.
+		chunksize: int (default 20000000)
+			Approximate number of values copied at once.
+		"""
+		if not self._validate(): return
+		if not self._sort:
+			print("ERROR: only sorted particles can be rechunked")
+			return
+		file = self._lastfile.filename
+		self._lastfile.close()
+		try:
+			self._rewriteSorted(file, layout, compression, chunksize)
+		finally:
+			self._lastfile = self._h5py.File(file, "r")
+			for prop in self._h5items:
+				self._h5items[prop] = self._lastfile[prop]
+
+	# Read the sorted data of the particles `selection` (indices or slice) for the requested axes
+	def _readSortedParticles(self, selection, axes, verbose=False):
+		rawData = {}
+		first_time = self._locationForTime[self._timesteps[0]]
+		last_time  = self._locationForTime[self._timesteps[-1]] + 1
+		ID = self._readUnstructuredH5(self._h5items["Id"], selection, first_time, last_time)
+		deadParticles = (ID==0).nonzero()
+		for axis in axes:
+			if verbose: print("   axis: "+axis)
+			if axis == "Id":
+				rawData[axis] = ID
+			else:
+				if axis=="moving_x":
+					data = self._readUnstructuredH5(self._h5items["x"], selection, first_time, last_time)
+					for it, time in enumerate(self._timesteps):
+						data[it,:] -= self._XmovedForTime[time]
+				else:
+					data = self._readUnstructuredH5(self._h5items[axis], selection, first_time, last_time)
+				data[deadParticles] = self._np.nan
+				rawData[axis] = data
+		return rawData
+
+	# Find where the lines are broken (e.g. loop around the box): array of shape (times-1, particles)
+	# which is True when the particle moves faster than c between two consecutive times
+	def _findLineBreaks(self, rawData):
+		nparticles = next(iter(rawData.values())).shape[1]
+		breaks = self._np.zeros((max(0, self._timesteps.size-1), nparticles), dtype=bool)
+		if self._timesteps.size > 1:
+			dt = self._np.diff(self._timesteps)*self.timestep
+			for axis in ["x","y","z"]:
+				if axis in rawData:
+					# NaNs already break lines
+					with self._np.errstate(invalid="ignore"):
+						breaks |= self._np.abs(self._np.diff(rawData[axis],axis=0)) > dt[:,None]
+		return breaks
+
 	# Method to generate the raw data (only done once)
 	def _generateRawData(self, times=None):
 		if not self._validate(): return
@@ -602,68 +1038,43 @@ class TrackParticles(Diagnostic):
 
 		if self._sort:
 			if self._rawData is None:
-				self._rawData = {}
-				first_time = self._locationForTime[self._timesteps[0]]
-				last_time  = self._locationForTime[self._timesteps[-1]] + 1
 				if self._verbose: print("Loading data ...")
-				# fill up the data
-				ID = self._readUnstructuredH5(self._h5items["Id"], self.selectedParticles, first_time, last_time)
-				deadParticles = (ID==0).nonzero()
-				for axis in self.axes:
-					if self._verbose: print("   axis: "+axis)
-					if axis == "Id":
-						self._rawData[axis] = ID
-					else:
-						if axis=="moving_x":
-							data = self._readUnstructuredH5(self._h5items["x"], self.selectedParticles, first_time, last_time)
-							for it, time in enumerate(self._timesteps):
-								data[it,:] -= self._XmovedForTime[time]
-						else:
-							data = self._readUnstructuredH5(self._h5items[axis], self.selectedParticles, first_time, last_time)
-						data[deadParticles] = self._np.nan
-						self._rawData[axis] = data
+				self._rawData = self._readSortedParticles(self.selectedParticles, self.axes, self._verbose)
 
 				if self._verbose: print("Process broken lines ...")
-				# Add the lineBreaks array which indicates where lines are broken (e.g. loop around the box)
-				self._rawData['brokenLine'] = self._np.zeros((self.nselectedParticles,), dtype=bool)
-				self._rawData['lineBreaks'] = {}
-				if self._timesteps.size > 1:
-					dt = self._np.diff(self._timesteps)*self.timestep
-					for axis in ["x","y","z"]:
-						if axis in self.axes:
-							dudt = self._np.diff(self._rawData[axis],axis=0)
-							for i in range(dudt.shape[1]): dudt[:,i] /= dt
-							dudt[~self._np.isnan(dudt)] = 0. # NaNs already break lines
-							# Line is broken if velocity > c
-							self._rawData['brokenLine'] += self._np.abs(dudt).max(axis=0) > 1.
-							broken_particles = self._np.flatnonzero(self._rawData['brokenLine'])
-							for broken_particle in broken_particles:
-								broken_times = list(self._np.flatnonzero(self._np.abs(dudt[:,broken_particle]) > 1.)+1)
-								if broken_particle in self._rawData['lineBreaks'].keys():
-									self._rawData['lineBreaks'][broken_particle] += broken_times
-								else:
-									self._rawData['lineBreaks'][broken_particle] = broken_times
+				# Lines are broken where they loop around the box. The broken particles are listed
+				# in `brokenParticles`; the time indices where their line `i` restarts are
+				# `breakTimes[breakOffsets[i]:breakOffsets[i+1]]`
+				breaks = self._findLineBreaks(self._rawData)
+				self._rawData['brokenLine'] = breaks.any(axis=0)
+				self._rawData['brokenParticles'] = self._np.flatnonzero(self._rawData['brokenLine'])
+				particles, times = breaks[:,self._rawData['brokenParticles']].T.nonzero()
+				self._rawData['breakOffsets'] = self._np.searchsorted(particles, self._np.arange(self._rawData['brokenParticles'].size+1))
+				self._rawData['breakTimes'] = times + 1
 				# Add the times array
 				self._rawData["times"] = self._timesteps
 				if self._verbose: print("... done")
 
 		# If not sorted, get different kind of data
 		else:
-			if self._rawData is None:
-				self._rawData = {}
+			# Only the requested times are kept, to avoid accumulating whole timesteps
+			rawData = {}
 
 			if self._verbose: print("Loading data ...")
 			properties = dict(self._raw_properties_from_short, moving_x="position/x")
 			if times is None: times = self._timesteps
 			for time in times:
-				if time in self._rawData: continue
+				if self._rawData is not None and time in self._rawData:
+					rawData[time] = self._rawData[time]
+					continue
 				[f, timeIndex] = self._locationForTime[time]
 				group = f["data/"+"%010i"%time+"/particles/"+self.species]
-				self._rawData[time] = {}
+				rawData[time] = {}
 				for axis in self.axes:
-					self._rawData[time][axis] = group[properties[axis]][()]
+					rawData[time][axis] = group[properties[axis]][()]
 				if "moving_x" in self.axes:
-					self._rawData[time]["moving_x"] -= self._XmovedForTime[time]
+					rawData[time]["moving_x"] -= self._XmovedForTime[time]
+			self._rawData = rawData
 
 			if self._verbose: print("... done")
 
@@ -692,10 +1103,9 @@ class TrackParticles(Diagnostic):
 		if self._sort:
 			for axis, factor in zip(self.axes, self._factors):
 				if timestep is None:
-					data[axis] = self._rawData[axis]
+					data[axis] = self._rawData[axis] * factor
 				else:
-					data[axis] = self._rawData[axis][indexOfRequestedTime]
-				data[axis] *= factor
+					data[axis] = self._rawData[axis][indexOfRequestedTime] * factor
 		else:
 			for t in ts:
 				data[t] = {}
@@ -706,6 +1116,46 @@ class TrackParticles(Diagnostic):
 	def get(self):
 		return self.getData()
 
+	# Disordered files containing the requested timesteps: list of
+	# (timestep, file, group name, number of particles, x_moved)
+	# The files are scanned again only when they have changed
+	def _disorderedLocations(self, timesteps=None):
+		files = self._findDisorderedFiles()
+		stamp = [(file, self._os.path.getsize(file), self._os.path.getmtime(file)) for file in files]
+		if getattr(self, "_disorderedStamp", None) != stamp:
+			self._disorderedTimes = {}
+			self._disorderedStamp = stamp
+			for file in files:
+				with self._h5py.File(file, "r") as f:
+					for t, T in f["data"].items():
+						if "particles/"+self.species in T:
+							group = T["particles/"+self.species]
+							self._disorderedTimes[int(t)] = (file, group.name, group["id"].shape[0], T.attrs.get("x_moved", 0.))
+		locations = self._disorderedTimes
+		available = self._np.array(sorted(locations), dtype=int)
+		if timesteps is None:
+			times = [t for t in self._timesteps if t in locations]
+		else:
+			timesteps = self._np.double(timesteps).ravel()
+			if timesteps.size == 1:
+				times = available[available == timesteps[0]]
+			elif timesteps.size == 2:
+				times = available[(available >= timesteps[0]) * (available <= timesteps[1])]
+			else:
+				raise Exception("Argument `timesteps` must be one or two non-negative integers")
+		return [(int(t),)+locations[t] for t in times]
+
+	# List of (axis, dataset name) in the disordered files
+	def _disorderedAxes(self, axes):
+		raw_properties_from_short = dict((v,k) for k,v in self._short_properties_from_raw.items())
+		raw_properties_from_short["moving_x"] = "position/x"
+		if axes is None:
+			axes = self.axes
+		for axis in axes:
+			if axis not in raw_properties_from_short:
+				raise Exception("Unknown axis `"+str(axis)+"`")
+		return [(axis, raw_properties_from_short[axis]) for axis in axes]
+
 	# Iterator on UNSORTED particles for a given timestep
 	def iterParticles(self, timestep, chunksize=1):
 		if not self._validate(): return
@@ -715,44 +1165,93 @@ class TrackParticles(Diagnostic):
 			print("ERROR: timestep "+str(timestep)+" not available")
 			return
 
-		properties = self._raw_properties_from_short + {"moving_x":"x"}
+		for t, data in self._iterChunks([timestep], chunksize, None, False):
+			yield data
 
-		disorderedfiles = self._findDisorderedFiles()
-		for file in disorderedfiles:
-			f = self._h5py.File(file, "r")
-			# This is the timestep for which we want to produce an iterator
-			try:
-				group = f["data/"+("%010d"%timestep)+"/particles/"+self.species]
-			except:
-				f.close()
-				continue
-			npart = group["id"].size
-			ID          = self._np.empty((chunksize,), dtype=self._np.uint64)
-			data_double = self._np.empty((chunksize,), dtype=self._np.double)
-			data_int16  = self._np.empty((chunksize,), dtype=self._np.int16 )
+	def _iterChunks(self, timesteps, chunksize, axes, reuse):
+		axes = self._disorderedAxes(axes)
+		chunksize = max(1, int(chunksize))
+		buffers = {} if reuse else None
+		for t, file, groupname, npart, xmoved in self._disorderedLocations(timesteps):
+			with self._h5py.File(file, "r") as f:
+				group = f[groupname]
+				for chunkstart in range(0, npart, chunksize):
+					yield t, _readChunk(group, axes, chunkstart, min(chunkstart+chunksize, npart), xmoved, buffers)
+
+	# Iterator on UNSORTED particles, by chunks, for several timesteps
+	def iterChunks(self, timesteps=None, chunksize=1000000, axes=None):
+		"""Iterates on the particles, unsorted, by chunks of fixed size, over several timesteps.
+		
+		Parameters:
+		-----------
+		timesteps: int or [int, int] (optional)
+			One timestep, or a range of timesteps. Default: the timesteps of the diagnostic.
+		chunksize: int (default 1000000)
+			The number of particles in each chunk.
+		axes: list of str (optional)
+			The particle properties to read. Default: the axes of the diagnostic.
+		
+		Returns:
+		--------
+		An iterator yielding `(timestep, data)`, where data is a dictionary `{axis: array}`.
+		The arrays are buffers reused for the next chunk: copy them to keep them.
+		"""
+		if not self._validate(): return
+		for t, data in self._iterChunks(timesteps, chunksize, axes, True):
+			yield t, data
+
+	# Map a function on the UNSORTED particles, by chunks, and reduce the results
+	def mapReduce(self, func, reducer, timesteps=None, chunksize=1000000, axes=None, workers=0):
+		"""Applies a function on chunks of particles in several processes, and reduces the results.
+		
+		Parameters:
+		-----------
+		func: function
+			Called as `func(timestep, data)` for each chunk, as provided by `iterChunks`.
+			With several processes, it must be defined at the top level of a module.
+		reducer: function
+			Called as `reducer(result1, result2)` to combine the results, in the order of the chunks.
+		timesteps, chunksize, axes:
+			As in `iterChunks`.
+		workers: int (optional)
+			The number of processes. Default: 0 (everything in the current process).
+		
+		Returns:
+		--------
+		The reduced result, or None if there are no particles.
+		"""
+		if not self._validate(): return
+		workers = max(0, int(workers or 0))
+		import multiprocessing
+		if not hasattr(multiprocessing, "get_context"):
+			workers = 0
+		result = []
+		def reduce(value):
+			result[:] = [reducer(result[0], value) if result else value]
+		# Without workers, read in reused buffers
+		if workers == 0:
+			for t, data in self._iterChunks(timesteps, chunksize, axes, True):
+				reduce(func(t, data))
+			return result[0] if result else None
+		# Otherwise, list the chunks and send them to the processes, a few at a time
+		axes = self._disorderedAxes(axes)
+		chunksize = max(1, int(chunksize))
+		pending = []
+		for t, file, groupname, npart, xmoved in self._disorderedLocations(timesteps):
 			for chunkstart in range(0, npart, chunksize):
-				chunkend = chunkstart + chunksize
-				if chunkend > npart:
-					chunkend = npart
-					ID          = self._np.empty((chunkend-chunkstart,), dtype=self._np.uint64)
-					data_double = self._np.empty((chunkend-chunkstart,), dtype=self._np.double)
-					data_int16  = self._np.empty((chunkend-chunkstart,), dtype=self._np.int16 )
-				data = {}
-				for axis in self.axes:
-					if axis == "Id":
-						group[properties[axis]].read_direct(ID, source_sel=self._np.s_[chunkstart:chunkend])
-						data[axis] = ID.copy()
-					elif axis == "q":
-						group[properties[axis]].read_direct(data_int16, source_sel=self._np.s_[chunkstart:chunkend])
-						data[axis] = data_int16.copy()
-					elif axis == "moving_x":
-						group[properties["x"]].read_direct(data_double, source_sel=self._np.s_[chunkstart:chunkend])
-						data[axis] = data_double.copy()
-					else:
-						group[properties[axis]].read_direct(data_double, source_sel=self._np.s_[chunkstart:chunkend])
-						data[axis] = data_double.copy()
-				yield data
-			f.close()
+				pending.append(( file, groupname, axes, chunkstart, min(chunkstart+chunksize, npart), xmoved, func, t ))
+		from collections import deque
+		pool = multiprocessing.get_context("spawn").Pool(workers)
+		try:
+			pending = deque(pending)
+			running = deque()
+			while pending or running:
+				while pending and len(running) < 2*workers:
+					running.append( pool.apply_async(_mapChunkWorker, pending.popleft()) )
+				reduce(running.popleft().get())
+		finally:
+			pool.terminate()
+		return result[0] if result else None
 
 	# We override _prepare3
 	def _prepare3(self):
@@ -787,6 +1286,10 @@ class TrackParticles(Diagnostic):
 		self._setAxesOptions(ax)
 		return self._plot
 	
+	# Trajectories are lines, not maps: no blitting
+	def _canBlit(self):
+		return False
+	
 	def _animateOnAxes_2D(self, ax, t, cax_id=0):
 		if hasattr(ax, "_lines"):
 			if self in ax._lines:
@@ -810,21 +1313,24 @@ class TrackParticles(Diagnostic):
 		# Then plot the broken lines
 		try   : ax.hold("on")
 		except: pass
-		for line, breaks in self._rawData['lineBreaks'].items():
-			x = self._tmpdata[0][:, line]
-			y = self._tmpdata[1][:, line]
-			prevline = None
-			for ibrk in range(len(breaks)):
-				if breaks[ibrk] <= itmin: continue
-				iti = itmin
-				if ibrk>0: iti = max(itmin, breaks[ibrk-1])
-				itf = min( itmax, breaks[ibrk] )
-				if prevline:
-					ax._lines[self] += ax.plot(self._xfactor*x[iti:itf], self._yfactor*y[iti:itf], color=prevline.get_color(), **self.options.plot)
-				else:
-					prevline, = ax.plot(self._xfactor*x[iti:itf], self._yfactor*y[iti:itf], **self.options.plot)
-				ax._lines[self] += [prevline]
-				if breaks[ibrk] > itmax: break
+		# Each broken line is plotted once, with NaNs inserted where it is broken
+		brokenParticles = self._rawData['brokenParticles']
+		if brokenParticles.size > 0:
+			nt = itmax - itmin + 1
+			offsets = self._rawData['breakOffsets']
+			line = self._np.repeat(self._np.arange(brokenParticles.size), self._np.diff(offsets))
+			time = self._rawData['breakTimes'] - itmin
+			keep = (time > 0) * (time < nt)
+			breaks = self._np.zeros((nt, brokenParticles.size), dtype=bool)
+			breaks[time[keep], line[keep]] = True
+			lines = []
+			for A in self._tmpdata[:2]:
+				A = A[itmin:itmax+1, brokenParticles]
+				B = self._np.empty((2*nt-1, brokenParticles.size))
+				B[0::2] = A
+				B[1::2] = self._np.where(breaks[1:], self._np.nan, A[1:])
+				lines.append(B)
+			ax._lines[self] += ax.plot(self._xfactor*lines[0], self._yfactor*lines[1], **self.options.plot)
 		try   : ax.hold("off")
 		except: pass
 		# Add labels and options
@@ -927,8 +1433,14 @@ class TrackParticles(Diagnostic):
 		# Trajectory mode
 		elif (rendering == "trajectory"):
 
+			# The legacy format is written directly, by chunks of particles
+			if data_format == "vtk":
+				self._writeTrajectories(fileprefix+".{}".format(extension), xaxis)
+				print("Successfully exported tracked particles to VTK, folder='"+self._exportDir)
+				return
+
 			data = self.getData()
-			pcoords = self._np.stack((data[xaxis],data["y"],data["z"])).transpose()
+			pcoords = self._np.stack((data[xaxis].T,data["y"].T,data["z"].T), axis=-1)
 			npoints, nt, nd = pcoords.shape
 
 			pcoords = self._np.reshape(pcoords, (npoints*nt, nd))
@@ -938,16 +1450,82 @@ class TrackParticles(Diagnostic):
 			pcoords = vtk.Array(pcoords, "")
 
 			# Segments between points to describe the trajectories
-			connectivity = self._np.ascontiguousarray([[nt]+[nt*i+j for j in range(nt)] for i in range(npoints)])
+			ncells, connectivity = self._trajectoryCells(self._rawData, xaxis, 0)
 
 			# List of scalar arrays
 			attributes = []
 			for ax in self.axes:
 				if ax not in ["x", "y", "z", "moving_x", "Id"]:
-					attributes += [vtk.Array(self._np.ascontiguousarray(data[ax].flatten(),'float32'),ax)]
+					attributes += [vtk.Array(self._np.ascontiguousarray(data[ax].T.flatten(),'float32'),ax)]
 				# Integer arrays
 				elif ax == "Id":
-					attributes += [vtk.Array(self._np.ascontiguousarray(data[ax].flatten(),'int32'),ax)]
+					attributes += [vtk.Array(self._np.ascontiguousarray(data[ax].T.flatten(),'int32'),ax)]
 
-			vtk.WriteLines(pcoords, connectivity, attributes, data_format, fileprefix+".{}".format(extension))
+			vtk.WriteLines(pcoords, connectivity, attributes, data_format, fileprefix+".{}".format(extension), ncells)
 			print("Successfully exported tracked particles to VTK, folder='"+self._exportDir)
+
+	# Cells of the trajectories, in the VTK layout [n, id1, ... idn, n, ...]. The point of the
+	# particle `i` (in rawData) at time `j` is `offset + i*ntimes + j`. A trajectory is split where
+	# the particle is absent and where the line is broken.
+	def _trajectoryCells(self, rawData, xaxis, offset):
+		valid = ~(self._np.isnan(rawData[xaxis]) + self._np.isnan(rawData["y"]) + self._np.isnan(rawData["z"]))
+		start = valid.copy()
+		start[1:] *= ~valid[:-1] + self._findLineBreaks(dict((k, rawData[k]) for k in [xaxis, "y", "z"]))
+		start = start.T.ravel()
+		points = self._np.flatnonzero(valid.T.ravel())
+		segment = self._np.cumsum(start)[points] - 1
+		npoints = self._np.bincount(segment, minlength=start.sum()) if points.size > 0 else self._np.zeros((0,), dtype=int)
+		# Segments of one point are not lines
+		kept = npoints > 1
+		points = points[kept[segment]] if points.size > 0 else points
+		npoints = npoints[kept]
+		cells = self._np.empty((points.size + npoints.size,), dtype=self._np.int64)
+		heads = self._np.cumsum(npoints + 1) - (npoints + 1)
+		isPoint = self._np.ones(cells.shape, dtype=bool)
+		isPoint[heads] = False
+		cells[heads] = npoints
+		cells[isPoint] = points + offset
+		return npoints.size, cells
+
+	# Write the trajectories in a binary file of the legacy VTK format, by chunks of particles
+	def _writeTrajectories(self, file, xaxis):
+		ntimes = self._timesteps.size
+		npoints = self.nselectedParticles * ntimes
+		attributes = [ax for ax in self.axes if ax not in ["x", "y", "z", "moving_x"]]
+		factors = dict(zip(self.axes, self._factors))
+		if type(self.selectedParticles) is slice:
+			selection = self._np.arange(self.nParticles)
+		else:
+			selection = self.selectedParticles
+		chunks = list(ChunkedRange(self.nselectedParticles, max(1, int(self._gatherBudget // (24*ntimes)))))
+		with open(file, "wb") as f:
+			f.write(("# vtk DataFile Version 3.0\nTrackParticles "+self.species+"\nBINARY\nDATASET POLYDATA\n").encode())
+			# Points, while the cells are written in a temporary file
+			f.write(("POINTS %d float\n" % npoints).encode())
+			ncells, size = 0, 0
+			with open(file+".tmp", "wb+") as cells:
+				for first, last, npart in chunks:
+					rawData = self._readSortedParticles(selection[first:last], [xaxis, "y", "z"])
+					pcoords = self._np.empty((npart, ntimes, 3), dtype=">f4")
+					for i, ax in enumerate([xaxis, "y", "z"]):
+						pcoords[:,:,i] = rawData[ax].T * factors[ax]
+					f.write(pcoords.tobytes())
+					n, c = self._trajectoryCells(rawData, xaxis, first*ntimes)
+					cells.write(c.astype(">i4").tobytes())
+					ncells += n
+					size += c.size
+				f.write(("\nLINES %d %d\n" % (ncells, size)).encode())
+				cells.seek(0)
+				import shutil
+				shutil.copyfileobj(cells, f, 16*1024*1024)
+			self._os.remove(file+".tmp")
+			# Attributes of each point
+			if attributes:
+				f.write(("\nPOINT_DATA %d\nFIELD FieldData %d\n" % (npoints, len(attributes))).encode())
+			for ax in attributes:
+				dtype = ">i4" if ax == "Id" else ">f4"
+				f.write(("%s 1 %d %s\n" % (ax, npoints, "int" if ax == "Id" else "float")).encode())
+				for first, last, npart in chunks:
+					A = self._readSortedParticles(selection[first:last], [ax])[ax].T
+					f.write((A if ax == "Id" else A * factors[ax]).astype(dtype).tobytes())
+				f.write(b"\n")
@@ -3,11 +3,26 @@ __all__ = [
 	"setMatplotLibBackend",
 	"updateMatplotLibColormaps",
 	"ChunkedRange",
+	"Operation",
+	"CylindricalInterpolator",
+	"OutputIndex",
+	"ScalarTable",
+	"DataCache",
+	"Prefetcher",
+	"LazyArray",
+	"_LazyData",
+	"_composeAxis",
+	"_axisToSlice",
 	"openNamelist",
+	"_execNamelist",
+	"NamelistSnapshot",
 	"Options",
 	"Units",
 	"Movie",
 	"SaveAs",
+	"Blitter",
+	"_renderFrames",
+	"_DiagnosticFrames",
 	"multiPlot",
 	"multiSlide",
 	"VTKfile"
@@ -84,6 +99,873 @@ class ChunkedRange:
 		return self.__next__()
 
 
+class Operation(object):
+	""" Operation between arrays, such as "C_Ex**2+C_Ey**2", compiled once
+
+	The arrays are given, at each evaluation, in a dictionary of variables.
+	If the *numexpr* package is available, it is used to evaluate the elementwise
+	operations in a multi-threaded way, without the temporary arrays created by numpy.
+	The attribute `elementwise` tells whether the operation can be evaluated on
+	separate pieces of the arrays (no reductions such as `.max()`, no indexing, etc.).
+	"""
+	# Functions that act on each element separately
+	_elementwiseFunctions = set([
+		"abs", "arccos", "arccosh", "arcsin", "arcsinh", "arctan", "arctan2", "arctanh",
+		"ceil", "conj", "copysign", "cos", "cosh", "exp", "expm1", "floor", "fmod", "hypot",
+		"imag", "isfinite", "isinf", "isnan", "log", "log10", "log1p", "log2", "maximum",
+		"minimum", "real", "sign", "sin", "sinh", "sqrt", "tan", "tanh", "trunc", "where"
+	])
+	def __init__(self, expression, namespace=None):
+		import ast
+		self.expression = expression
+		self._namespace = namespace if namespace is not None else {}
+		self._code = compile(expression, "<operation>", "eval")
+		self.elementwise = self._isElementwise(ast.parse(expression, mode="eval").body)
+		self._numexpr = None
+		if self.elementwise:
+			try:
+				import numexpr
+				self._numexpr = numexpr
+			except ImportError:
+				pass
+	def _isElementwise(self, node):
+		import ast, numbers, numpy
+		children = list(ast.iter_child_nodes(node))
+		if isinstance(node, ast.Name):
+			# Variables, or constant numbers of the namespace
+			if node.id not in self._namespace: return True
+			return isinstance(self._namespace[node.id], (numbers.Number, numpy.generic))
+		if isinstance(node, ast.Call):
+			if not isinstance(node.func, ast.Name) or node.func.id not in self._elementwiseFunctions or node.keywords:
+				return False
+			# The function must be the numpy one (or the builtin `abs`)
+			f = self._namespace.get(node.func.id)
+			if f is None and node.func.id != "abs": return False
+			if f is not None and f is not getattr(numpy, node.func.id, None): return False
+			children = node.args
+		elif isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Compare)):
+			children = [c for c in children if not isinstance(c, (ast.operator, ast.unaryop, ast.cmpop))]
+		elif not isinstance(node, ast.Constant if hasattr(ast, "Constant") else ast.Num):
+			return False
+		return all(self._isElementwise(c) for c in children)
+	def __call__(self, variables):
+		if self._numexpr is not None:
+			try:
+				return self._numexpr.evaluate(self.expression, local_dict=variables, global_dict=self._namespace)
+			except NotImplementedError as e:
+				# Data types not supported by numexpr
+				pass
+		return eval(self._code, self._namespace, variables)
+
+
+class CylindricalInterpolator(object):
+	""" Linear interpolation of cylindrical (x,r) arrays onto a cartesian (x,y,z) box
+
+	The indices and weights of the interpolation are calculated once, separately
+	for the x and r directions, so that it can be applied to many arrays
+	(several modes and timesteps) at a low cost.
+	The box is ordered as in the `build3d` option of Field: the last two
+	axes correspond to z and y respectively.
+	"""
+	def __init__(self, raw_positions, x, y, z, selection=None):
+		import numpy
+		self._np = numpy
+		if selection is None:
+			selection = (slice(None),)*3
+		# Single indices are kept as axes of length 1
+		selection = tuple(slice(s, s+1) if type(s) is not slice else s for s in selection)
+		y2, z2 = numpy.meshgrid(y, z)
+		y2, z2 = y2[selection[1:]], z2[selection[1:]]
+		self.theta = numpy.arctan2(z2, y2)
+		self._xindex, self._xweight = self._weights(raw_positions[0], x[selection[0]])
+		self._rindex, self._rweight = self._weights(raw_positions[1], numpy.sqrt(y2**2 + z2**2))
+		self._tables = {}
+
+	def _weights(self, grid, points):
+		# Index of the cell containing each point, and weights of both cell edges.
+		# Points out of the grid have zero weights.
+		np = self._np
+		index = np.clip(np.searchsorted(grid, points, side="right") - 1, 0, len(grid)-2)
+		w = (points - grid[index]) / (grid[index+1] - grid[index])
+		outside = (points < grid[0]) | (points > grid[-1])
+		weight = np.stack((1.-w, w))
+		weight[:, outside] = 0.
+		return index, weight
+
+	def __call__(self, B):
+		"""Interpolates the 2D array B(x,r), and returns a 3D array"""
+		# Interpolate along x
+		Bx = self._xweight[0][:,None] * B[self._xindex] + self._xweight[1][:,None] * B[self._xindex+1]
+		# Interpolate along r
+		return self._rweight[0] * Bx[:, self._rindex] + self._rweight[1] * Bx[:, self._rindex+1]
+
+	def cos(self, imode):
+		"""Table of cos(imode*theta)"""
+		if ("cos", imode) not in self._tables:
+			self._tables[("cos", imode)] = self._np.cos(imode*self.theta)
+		return self._tables[("cos", imode)]
+
+	def sin(self, imode):
+		"""Table of sin(imode*theta)"""
+		if ("sin", imode) not in self._tables:
+			self._tables[("sin", imode)] = self._np.sin(imode*self.theta)
+		return self._tables[("sin", imode)]
+
+
+class OutputIndex(object):
+	""" Persistent index of the metadata contained in the HDF5 output files
+
+	For each results directory, a small sidecar file (`.happi_index.json`) stores,
+	for every HDF5 file that has been inspected, its root attributes, its list
+	of groups/datasets, the fields of its first data group, and its small datasets.
+	Entries are keyed by the file size and modification time: a file that has
+	changed (e.g. a running simulation) is re-inspected, re-using what cannot change.
+	"""
+
+	filename = ".happi_index.json"
+	maxDatasetSize = 16
+
+	def __init__(self, persistent=True):
+		import os, json, h5py, numpy
+		self._os = os
+		self._json = json
+		self._h5py = h5py
+		self._np = numpy
+		self.persistent = persistent
+		self._directories = {} # directory -> {"entries":{}, "modified":bool}
+
+	def _directory(self, directory):
+		if directory not in self._directories:
+			entries = {}
+			if self.persistent:
+				try:
+					with open(directory+self._os.sep+self.filename, 'r') as f:
+						entries = self._json.load(f)
+				except Exception as e:
+					entries = {}
+				if type(entries) is not dict:
+					entries = {}
+			self._directories[directory] = {"entries":entries, "modified":False}
+		return self._directories[directory]
+
+	def _toJSON(self, value):
+		# Convert HDF5 attributes to simple python types
+		if isinstance(value, bytes):
+			try:
+				return value.decode()
+			except Exception as e:
+				return None
+		if isinstance(value, self._np.ndarray):
+			return [self._toJSON(v) for v in value.tolist()]
+		if isinstance(value, (list, tuple)):
+			return [self._toJSON(v) for v in value]
+		if isinstance(value, self._np.generic):
+			return self._toJSON(value.item())
+		if value is None or isinstance(value, (str, bool, int, float)):
+			return value
+		return str(value)
+
+	def _inspect(self, file, previous):
+		with self._h5py.File(file, 'r') as f:
+			entry = {}
+			entry["attrs"] = dict( (k, self._toJSON(v)) for k,v in f.attrs.items() )
+			entry["keys"] = list(f.keys())
+			entry["datasets"] = {}
+			for k in entry["keys"]:
+				item = f.get(k, getclass=True)
+				if item is self._h5py.Dataset and f[k].size <= self.maxDatasetSize:
+					entry["datasets"][k] = self._toJSON(f[k][()])
+			entry["data_keys"] = []
+			entry["fields"] = []
+			if "data" in f and isinstance(f["data"], self._h5py.Group):
+				entry["data_keys"] = [k for k in f["data"].keys() if k != "tmp"]
+				# The fields of the first data group do not change when the file grows
+				if previous and previous.get("fields"):
+					entry["fields"] = previous["fields"]
+				elif entry["data_keys"]:
+					entry["fields"] = list(f["data"][entry["data_keys"][0]].keys())
+		return entry
+
+	def get(self, file):
+		"""Returns the index entry of an HDF5 file, or None if it cannot be read"""
+		directory, name = self._os.path.split(file)
+		d = self._directory(directory or ".")
+		try:
+			stat = self._os.stat(file)
+		except Exception as e:
+			return None
+		entry = d["entries"].get(name)
+		if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+			return entry
+		try:
+			entry = self._inspect(file, entry)
+		except Exception as e:
+			return None
+		entry["size"] = stat.st_size
+		entry["mtime"] = stat.st_mtime
+		d["entries"][name] = entry
+		d["modified"] = True
+		return entry
+
+	def flush(self):
+		"""Writes the modified indexes to disk"""
+		if not self.persistent: return
+		for directory, d in self._directories.items():
+			if not d["modified"]: continue
+			file = directory+self._os.sep+self.filename
+			tmpfile = file+".tmp"+str(self._os.getpid())
+			try:
+				with open(tmpfile, 'w') as f:
+					self._json.dump(d["entries"], f)
+				try:
+					self._os.rename(tmpfile, file)
+				except Exception as e:
+					self._os.remove(file)
+					self._os.rename(tmpfile, file)
+			except Exception as e:
+				# Directory not writable: the index remains in memory only
+				try: self._os.remove(tmpfile)
+				except Exception as e: pass
+			d["modified"] = False
+
+
+class ScalarTable(object):
+	""" Table containing all the columns of the `scalars.txt` files
+
+	Each file is parsed in one pass and its content is saved in a binary sidecar
+	file (`.happi_scalars.npz`). When the file grows (e.g. a running simulation),
+	only the new lines are parsed.
+	"""
+
+	filename = ".happi_scalars.npz"
+
+	def __init__(self, persistent=True):
+		import os, numpy
+		self._os = os
+		self._np = numpy
+		self.persistent = persistent
+		self._files = {} # path -> {"names", "header", "data", "offset"}
+		self._merged = {} # (paths, timestep) -> (key, names, timesteps, data)
+
+	def _load(self, path):
+		try:
+			with self._np.load(path+self._os.sep+self.filename) as f:
+				return {
+					"names" : f["names"].tolist(),
+					"header": f["header"].tobytes(),
+					"data"  : f["data"],
+					"offset": int(f["offset"]),
+				}
+		except Exception as e:
+			return None
+
+	def _save(self, path, table):
+		file = path+self._os.sep+self.filename
+		tmpfile = file+".tmp"+str(self._os.getpid())
+		try:
+			with open(tmpfile, 'wb') as f:
+				self._np.savez(f,
+					names = self._np.array(table["names"]),
+					header = self._np.frombuffer(table["header"], dtype=self._np.uint8),
+					data = table["data"],
+					offset = table["offset"],
+				)
+			self._os.rename(tmpfile, file)
+		except Exception as e:
+			# Directory not writable: the table remains in memory only
+			try: self._os.remove(tmpfile)
+			except Exception as e: pass
+
+	def _parse(self, text, ncols):
+		# Parse complete lines of numbers into a 2D array
+		nlines = text.count(b"\n")
+		if nlines == 0:
+			return self._np.zeros((0, ncols))
+		if b"#" not in text:
+			try:
+				values = self._np.array(text.split(), dtype=float)
+			except Exception as e:
+				values = None
+			if values is not None and values.size == nlines * ncols:
+				return values.reshape((nlines, ncols))
+		# Slow parsing when some lines are not regular
+		rows = []
+		for line in text.decode().splitlines():
+			line = line.split()
+			if len(line) != ncols or line[0][0] == "#": continue
+			try:
+				rows.append([float(v) for v in line])
+			except Exception as e:
+				pass
+		return self._np.array(rows, dtype=float).reshape((-1, ncols))
+
+	def _update(self, path):
+		# Update the table of one scalars.txt file, parsing only the new lines
+		file = path+self._os.sep+"scalars.txt"
+		try:
+			size = self._os.path.getsize(file)
+		except Exception as e:
+			return None
+		table = self._files.get(path)
+		if table is None and self.persistent:
+			table = self._load(path)
+		if table is not None and table["offset"] == size:
+			self._files[path] = table
+			return table
+		with open(file, 'rb') as f:
+			# Continue from the previous table if the header has not changed
+			if table is not None and table["offset"] < size and f.read(len(table["header"])) == table["header"]:
+				f.seek(table["offset"])
+				text = f.read()
+				start = 0
+			else:
+				f.seek(0)
+				text = f.read()
+				# Find the last commented line before the data
+				start, prevline = 0, b""
+				while text.startswith(b"#", start):
+					end = text.find(b"\n", start)
+					if end < 0: break
+					prevline = text[start:end]
+					start = end + 1
+				names = prevline[1:].decode().split()
+				table = {"names":names, "header":text[:start], "data":self._np.zeros((0, len(names))), "offset":start}
+		end = text.rfind(b"\n") + 1
+		if end > start:
+			new = self._parse(text[start:end], len(table["names"]))
+			table["data"] = self._np.concatenate((table["data"], new))
+			table["offset"] += end - start
+			if self.persistent:
+				self._save(path, table)
+		self._files[path] = table
+		return table
+
+	def get(self, paths, timestep):
+		"""Returns the names of all columns, the timesteps, and the table of all values
+
+		When there are several paths, only the common columns are kept, and
+		the values of the latest paths prevail for identical timesteps.
+		"""
+		tables = [(path, self._update(path)) for path in paths]
+		tables = [(path, table) for path, table in tables if table is not None]
+		if len(tables) == 0:
+			return None, None, None
+		key = tuple( (path, table["offset"]) for path, table in tables )
+		previous = self._merged.get((tuple(paths), timestep))
+		if previous is not None and previous[0] == key:
+			return previous[1:]
+		# Common columns
+		names = tables[0][1]["names"]
+		if len(tables) > 1:
+			common = tables[0][1]["names"][1:]
+			for path, table in tables[1:]:
+				common = self._np.intersect1d(common, table["names"][1:])
+			names = names[:1] + list(common)
+		# Concatenate all tables, in the order of the common columns
+		data = []
+		for path, table in tables:
+			columns = [table["names"].index(n) for n in names[1:]]
+			data.append( table["data"][:, [0]+columns] )
+		data = self._np.concatenate(data)
+		# Keep the last occurrence of each timestep
+		timesteps = self._np.round(data[:,0] / float(timestep)).astype(int)
+		timesteps, last = self._np.unique(timesteps[::-1], return_index=True)
+		data = data[len(data)-1-last]
+		self._merged[(tuple(paths), timestep)] = (key, names, timesteps, data)
+		return names, timesteps, data
+
+
+class DataCache(object):
+	""" Least-recently-used cache of the arrays obtained by the diagnostics
+
+	Arrays are stored with a key made of the diagnostic's arguments and the timestep.
+	When the total size exceeds the budget, the least recently used arrays are evicted.
+	"""
+
+	def __init__(self, size=1000.):
+		from collections import OrderedDict
+		import numpy
+		self._np = numpy
+		self._items = OrderedDict()
+		self.clear()
+		self.resize(size)
+
+	def resize(self, size):
+		"""Sets the memory budget, in megabytes"""
+		self.maxbytes = int(max(size, 0.) * 1e6)
+		self._evict()
+
+	def clear(self):
+		"""Removes all arrays from the cache and resets the statistics"""
+		self._items.clear()
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def _evict(self):
+		while self.nbytes > self.maxbytes and len(self._items) > 0:
+			key, A = self._items.popitem(last=False)
+			self.nbytes -= A.nbytes
+			self.evictions += 1
+
+	def get(self, key):
+		"""Returns the (read-only) array stored with `key`, or None"""
+		A = self._items.pop(key, None)
+		if A is None:
+			self.misses += 1
+			return None
+		self._items[key] = A # move to the most recent position
+		self.hits += 1
+		return A
+
+	def put(self, key, A):
+		"""Stores a read-only copy of the array `A` with `key`"""
+		if not isinstance(A, self._np.ndarray) or A.nbytes > self.maxbytes:
+			return
+		A = A.copy()
+		A.flags.writeable = False
+		previous = self._items.pop(key, None)
+		if previous is not None:
+			self.nbytes -= previous.nbytes
+		self._items[key] = A
+		self.nbytes += A.nbytes
+		self._evict()
+
+	def __len__(self):
+		return len(self._items)
+
+	def __contains__(self, key):
+		return key in self._items
+
+	def info(self):
+		"""Prints the size and statistics of the cache"""
+		print("Data cache: %d arrays, %.1f MB / %.1f MB" % (len(self._items), self.nbytes/1e6, self.maxbytes/1e6))
+		print("\thits: %d, misses: %d, evictions: %d" % (self.hits, self.misses, self.evictions))
+
+	def __repr__(self):
+		self.info()
+		return ""
+
+
+# Diagnostics re-created in each worker process of a Prefetcher (only the most recently used ones are kept)
+_prefetchDiagnostics = []
+_prefetchMaxDiagnostics = 4
+
+def _prefetchWorker(key, simulationArgs, diagClass, args, kwargs, t):
+	for i, (k, diag) in enumerate(_prefetchDiagnostics):
+		if k == key:
+			_prefetchDiagnostics.pop(i)
+			break
+	else:
+		from ._core import SmileiSimulation
+		simulation = SmileiSimulation(**simulationArgs)
+		diag = diagClass(simulation, *args, **kwargs)
+		diag._prepare1()
+		del _prefetchDiagnostics[_prefetchMaxDiagnostics-1:]
+	_prefetchDiagnostics.insert(0, (key, diag))
+	return diag._getDataAtTime(t)
+
+
+class Prefetcher(object):
+	""" Pool of worker processes that read the data of upcoming timesteps
+	while the main process is plotting or writing the current one.
+	"""
+
+	def __init__(self, workers=0, depth=None):
+		self.workers = int(workers)
+		self.depth = int(depth) if depth is not None else 2*self.workers
+		self._pool = None
+		self._closeAtExit = False
+
+	def start(self, simulationArgs, diagClass, args, kwargs, timesteps):
+		"""Starts reading the given timesteps, and returns the queue of results (or None)"""
+		if self.workers < 1 or self.depth < 1 or len(timesteps) < 2:
+			return None
+		task = (simulationArgs, diagClass, args, kwargs)
+		try:
+			import pickle, hashlib
+			key = hashlib.sha1(pickle.dumps(task)).hexdigest()
+		except Exception as e:
+			return None
+		if self._pool is None:
+			import multiprocessing, atexit
+			if not hasattr(multiprocessing, "get_context"):
+				return None
+			# New processes are started (not forked), so that they do not inherit the open HDF5 files
+			self._pool = multiprocessing.get_context("spawn").Pool(self.workers)
+			if not self._closeAtExit:
+				atexit.register(self.close)
+				self._closeAtExit = True
+		return _PrefetchQueue(self._pool, (key,)+task, timesteps, self.depth)
+
+	def close(self):
+		"""Stops the worker processes"""
+		if self._pool is not None:
+			self._pool.terminate()
+			self._pool = None
+
+
+class _PrefetchQueue(object):
+	def __init__(self, pool, task, timesteps, depth):
+		from collections import deque, OrderedDict
+		self._pool = pool
+		self._task = task
+		self._depth = depth
+		self._pending = deque(timesteps)
+		self._running = OrderedDict() # timestep -> asynchronous result
+		self._fill()
+
+	def _fill(self):
+		while len(self._pending) > 0 and len(self._running) < self._depth:
+			t = self._pending.popleft()
+			self._running[t] = self._pool.apply_async(_prefetchWorker, self._task+(t,))
+
+	def pop(self, t):
+		"""Returns the data of timestep `t` if it has been requested, otherwise None"""
+		result = self._running.pop(t, None)
+		if result is None:
+			return None
+		try:
+			A = result.get()
+		except Exception as e:
+			print("WARNING: prefetching failed ("+str(e)+"). Reading data serially.")
+			self._pending.clear()
+			self._running.clear()
+			return None
+		self._fill()
+		return A
+
+
+class LazyArray(object):
+	""" N-dimensional array of the data of a diagnostic, indexed as [time, axis1, axis2, ...]
+
+	No data is read until `compute()` is called (or the array is converted by `numpy.asarray`).
+	Indexing with integers and slices selects the timesteps and the region to read;
+	elementwise operations (arithmetic, numpy ufuncs) and reductions (`sum`, `mean`,
+	`min`, `max`) return new lazy arrays. They are evaluated one timestep at a time.
+	"""
+
+	def __init__(self):
+		import numpy
+		self._np = numpy
+		self._timeAxis = True # whether the first axis is the time
+		self._ntimes = 0 # number of blocks of data (one per timestep)
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	@property
+	def size(self):
+		return int(self._np.prod(self.shape))
+
+	def __len__(self):
+		if self.ndim == 0:
+			raise TypeError("len() of unsized object")
+		return self.shape[0]
+
+	def __repr__(self):
+		return "<happi.LazyArray shape="+str(self.shape)+" dtype="+str(self.dtype)+">"
+
+	# Data of the i-th block. The blocks of arrays without a time axis are computed once per evaluation
+	def _blockAt(self, i, memo):
+		if self._timeAxis:
+			return self._block(i if self._ntimes > 1 else 0, memo)
+		if id(self) not in memo:
+			memo[id(self)] = self._block(0, memo)
+		return memo[id(self)]
+
+	# List of the data sources in this expression
+	def _leaves(self):
+		return []
+
+	# Split the key into the positions of the timesteps, and the integers or slices of the other axes
+	def _splitKey(self, key):
+		if not isinstance(key, tuple):
+			key = (key,)
+		if any(k is None for k in key):
+			raise IndexError("new axes are not supported by LazyArray")
+		ellipsis = [i for i, k in enumerate(key) if k is Ellipsis]
+		if len(ellipsis) > 1:
+			raise IndexError("an index can only have a single ellipsis")
+		if ellipsis:
+			i = ellipsis[0]
+			key = key[:i] + (slice(None),)*(self.ndim-len(key)+1) + key[i+1:]
+		if len(key) > self.ndim:
+			raise IndexError("too many indices for an array of dimension "+str(self.ndim))
+		key = key + (slice(None),)*(self.ndim-len(key))
+		positions = None
+		if self._timeAxis:
+			positions = self._np.arange(self._ntimes)[key[0]]
+			key = key[1:]
+		try:
+			import operator
+			key = tuple(k if type(k) is slice else operator.index(k) for k in key)
+		except Exception as e:
+			raise IndexError("only integers and slices are supported on the axes other than time")
+		return positions, key
+
+	def __getitem__(self, key):
+		positions, key = self._splitKey(key)
+		return _LazyIndex(self, positions, key)
+
+	# Elementwise operations
+	def _elementwise(self, func, *operands):
+		return _LazyElementwise(func, operands)
+	def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+		if method != "__call__" or kwargs or ufunc.nout != 1:
+			return NotImplemented
+		return self._elementwise(ufunc, *inputs)
+	def __add__(self, other): return self._elementwise(self._np.add, self, other)
+	def __radd__(self, other): return self._elementwise(self._np.add, other, self)
+	def __sub__(self, other): return self._elementwise(self._np.subtract, self, other)
+	def __rsub__(self, other): return self._elementwise(self._np.subtract, other, self)
+	def __mul__(self, other): return self._elementwise(self._np.multiply, self, other)
+	def __rmul__(self, other): return self._elementwise(self._np.multiply, other, self)
+	def __truediv__(self, other): return self._elementwise(self._np.true_divide, self, other)
+	def __rtruediv__(self, other): return self._elementwise(self._np.true_divide, other, self)
+	__div__, __rdiv__ = __truediv__, __rtruediv__ # for python 2
+	def __pow__(self, other): return self._elementwise(self._np.power, self, other)
+	def __rpow__(self, other): return self._elementwise(self._np.power, other, self)
+	def __neg__(self): return self._elementwise(self._np.negative, self)
+	def __pos__(self): return self
+	def __abs__(self): return self._elementwise(self._np.absolute, self)
+
+	# Reductions
+	def _reduce(self, name, axis, dtype, out):
+		if out is not None:
+			raise ValueError("LazyArray reductions do not support `out`")
+		R = _LazyReduction(self, name, axis)
+		return R if dtype is None else R._elementwise(lambda A: self._np.asarray(A, dtype=dtype), R)
+	def sum(self, axis=None, dtype=None, out=None):
+		"""Sum of the elements over the given axis (lazy)"""
+		return self._reduce("sum", axis, dtype, out)
+	def mean(self, axis=None, dtype=None, out=None):
+		"""Average of the elements over the given axis (lazy)"""
+		return self._reduce("mean", axis, dtype, out)
+	def min(self, axis=None, out=None):
+		"""Minimum of the elements over the given axis (lazy)"""
+		return self._reduce("min", axis, None, out)
+	def max(self, axis=None, out=None):
+		"""Maximum of the elements over the given axis (lazy)"""
+		return self._reduce("max", axis, None, out)
+
+	def compute(self, file=None):
+		"""Reads the data and evaluates the operations, one timestep at a time.
+
+		Parameters:
+		-----------
+		file: path string (default: None)
+			If given, the result is a memory-mapped `.npy` file, written at this location,
+			which may be larger than the available memory.
+
+		Returns:
+		--------
+		A numpy array.
+		"""
+		memo = {}
+		diags = self._startPrefetch()
+		try:
+			if not self._timeAxis:
+				return self._np.asarray(self._blockAt(0, memo))
+			if file is None:
+				data = self._np.empty(self.shape, dtype=self.dtype)
+			else:
+				data = self._np.lib.format.open_memmap(file, mode="w+", dtype=self.dtype, shape=self.shape)
+			for i in range(self._ntimes):
+				data[i] = self._blockAt(i, memo)
+		finally:
+			for diag in diags:
+				diag._stopPrefetch()
+		if file is not None:
+			data.flush()
+		return data
+
+	def __array__(self, dtype=None, copy=None):
+		A = self.compute()
+		return A if dtype is None else A.astype(dtype)
+
+	# Starts the prefetching of the timesteps that are read entirely
+	def _startPrefetch(self):
+		timesteps = {}
+		for leaf in self._leaves():
+			if leaf._diag._subsetSelection(leaf._index()) is not None:
+				continue
+			t = timesteps.setdefault(leaf._diag, [])
+			t += [s for s in self._np.atleast_1d(leaf._timesteps) if s not in t]
+		for diag, t in timesteps.items():
+			diag._startPrefetch(t)
+		return list(timesteps)
+
+
+# Shape obtained by broadcasting several shapes together
+def _broadcastShapes(*shapes):
+	ndim = max([len(s) for s in shapes]+[0])
+	shape = []
+	for sizes in zip(*[(1,)*(ndim-len(s)) + tuple(s) for s in shapes]):
+		others = set(n for n in sizes if n != 1)
+		if len(others) > 1:
+			raise ValueError("operands could not be broadcast together with shapes "+" ".join(str(tuple(s)) for s in shapes))
+		shape.append(others.pop() if others else 1)
+	return tuple(shape)
+
+# Compose an axis (start, step, length) with an integer or a slice
+def _composeAxis(axis, k):
+	start, step, n = axis
+	if type(k) is slice:
+		first, last, s = k.indices(n)
+		m = max(0, (last - first + s - (1 if s > 0 else -1)) // s)
+		return (start + first*step, step*s, m)
+	if k < -n or k >= n:
+		raise IndexError("index "+str(k)+" is out of bounds for axis with size "+str(n))
+	return start + (k % n)*step
+
+# Slice equivalent to an axis (start, step, length), or the integer itself
+def _axisToSlice(axis):
+	if type(axis) is not tuple:
+		return axis
+	start, step, n = axis
+	if n == 0:
+		return slice(0, 0)
+	stop = start + (n-1)*step + (1 if step > 0 else -1)
+	return slice(start, stop if stop >= 0 else None, step)
+
+class _LazyData(LazyArray):
+	""" Data of a diagnostic at several timesteps, restricted to a region """
+	def __init__(self, diag, timesteps, axes, dtype):
+		super(_LazyData, self).__init__()
+		self._diag = diag
+		self._timesteps = timesteps # array of timesteps, or one timestep
+		self._axes = axes # (start, step, length) or an integer for each axis of the diagnostic's data
+		self._timeAxis = self._np.ndim(timesteps) > 0
+		self._ntimes = self._np.size(timesteps)
+		self.shape = ((self._ntimes,) if self._timeAxis else ()) + tuple(a[2] for a in axes if type(a) is tuple)
+		self.dtype = dtype
+	def _leaves(self):
+		return [self]
+	def _index(self):
+		return tuple(_axisToSlice(a) for a in self._axes)
+	def _block(self, i, memo):
+		t = self._timesteps[i] if self._timeAxis else self._timesteps
+		return self._diag._dataAtTimeSubset(t, self._index())
+	def __getitem__(self, key):
+		positions, key = self._splitKey(key)
+		timesteps = self._timesteps if positions is None else self._timesteps[positions]
+		key = iter(key)
+		axes = [_composeAxis(a, next(key)) if type(a) is tuple else a for a in self._axes]
+		return _LazyData(self._diag, timesteps, axes, self.dtype)
+
+class _LazyIndex(LazyArray):
+	""" Subset of another lazy array """
+	def __init__(self, array, positions, key):
+		super(_LazyIndex, self).__init__()
+		self._array = array
+		self._positions = positions
+		self._timeAxis = self._np.ndim(positions) > 0
+		self._ntimes = self._np.size(positions) if positions is not None else 1
+		axes = [_composeAxis((0, 1, n), k) for n, k in zip(array.shape[1 if array._timeAxis else 0:], key)]
+		self._key = tuple(_axisToSlice(a) for a in axes)
+		self.shape = ((self._ntimes,) if self._timeAxis else ()) + tuple(a[2] for a in axes if type(a) is tuple)
+		self.dtype = array.dtype
+	def _leaves(self):
+		return self._array._leaves()
+	def _block(self, i, memo):
+		if self._positions is None:
+			A = self._array._blockAt(0, memo)
+		else:
+			A = self._array._blockAt(self._positions[i] if self._timeAxis else self._positions, memo)
+		return self._np.asarray(A)[self._key]
+
+class _LazyTimeConstant(LazyArray):
+	""" Numpy array whose first axis is the time """
+	def __init__(self, A):
+		super(_LazyTimeConstant, self).__init__()
+		self._A = A
+		self._ntimes = len(A)
+		self.shape = A.shape
+		self.dtype = A.dtype
+	def _block(self, i, memo):
+		return self._A[i]
+
+class _LazyElementwise(LazyArray):
+	""" Elementwise function of several operands """
+	def __init__(self, func, operands):
+		super(_LazyElementwise, self).__init__()
+		self._func = func
+		timed = [op for op in operands if isinstance(op, LazyArray) and op._timeAxis]
+		blockdim = max([op.ndim-1 for op in timed]+[-1])
+		self._operands = []
+		for op in operands:
+			if not isinstance(op, LazyArray):
+				op = self._np.asarray(op)
+				if timed and op.ndim > blockdim:
+					op = _LazyTimeConstant(op)
+			elif timed and not op._timeAxis and op.ndim > blockdim:
+				raise ValueError("cannot broadcast an array of shape "+str(op.shape)+" without time axis")
+			self._operands.append(op)
+		timed = [op for op in self._operands if isinstance(op, LazyArray) and op._timeAxis]
+		ntimes = set(op._ntimes for op in timed if op._ntimes != 1)
+		if len(ntimes) > 1:
+			raise ValueError("operands have different numbers of timesteps")
+		self._timeAxis = len(timed) > 0
+		self._ntimes = ntimes.pop() if ntimes else 1
+		blockShapes = [op.shape[1:] if isinstance(op, LazyArray) and op._timeAxis else op.shape for op in self._operands]
+		self.shape = ((self._ntimes,) if self._timeAxis else ()) + _broadcastShapes(*blockShapes)
+		with self._np.errstate(all="ignore"):
+			self.dtype = self._np.asarray(func(*[
+				self._np.ones((1,), dtype=op.dtype) for op in self._operands
+			])).dtype
+	def _leaves(self):
+		return [leaf for op in self._operands if isinstance(op, LazyArray) for leaf in op._leaves()]
+	def _block(self, i, memo):
+		return self._func(*[op._blockAt(i, memo) if isinstance(op, LazyArray) else op for op in self._operands])
+	def __getitem__(self, key):
+		# When no operand is broadcast, the selection is applied to the operands for smaller reads
+		if all(op.shape == self.shape and op._timeAxis == self._timeAxis if isinstance(op, LazyArray) else op.ndim == 0 for op in self._operands):
+			return _LazyElementwise(self._func, [op[key] if isinstance(op, LazyArray) else op for op in self._operands])
+		return LazyArray.__getitem__(self, key)
+
+class _LazyReduction(LazyArray):
+	""" Sum, mean, min or max of a lazy array along some axes """
+	def __init__(self, array, name, axis):
+		super(_LazyReduction, self).__init__()
+		self._array = array
+		self._func = getattr(self._np, name)
+		ndim = array.ndim
+		axes = range(ndim) if axis is None else self._np.atleast_1d(axis)
+		axes = set(int(a) + ndim if int(a) < 0 else int(a) for a in axes)
+		if any(a < 0 or a >= ndim for a in axes):
+			raise ValueError("axis out of bounds for an array of dimension "+str(ndim))
+		self._overTime = array._timeAxis and 0 in axes
+		offset = 1 if array._timeAxis else 0
+		self._axes = tuple(sorted(a-offset for a in axes if a >= offset))
+		self._timeAxis = array._timeAxis and not self._overTime
+		self._ntimes = 1 if self._overTime else array._ntimes
+		self.shape = tuple(n for a, n in enumerate(array.shape) if a not in axes)
+		self.dtype = self._np.asarray(self._func(self._np.ones((1,), dtype=array.dtype))).dtype
+	def _leaves(self):
+		return self._array._leaves()
+	def _reduceBlock(self, i, memo):
+		A = self._array._blockAt(i, memo)
+		return self._func(A, axis=self._axes) if self._axes else A
+	def _block(self, i, memo):
+		if not self._overTime:
+			return self._reduceBlock(i, memo)
+		if self._array._ntimes == 0:
+			return self._func(self._np.empty(self._array.shape), axis=(0,)+tuple(a+1 for a in self._axes))
+		# Accumulate the blocks of all timesteps
+		A = self._np.array(self._reduceBlock(0, memo), dtype=self.dtype)
+		for j in range(1, self._array._ntimes):
+			B = self._reduceBlock(j, memo)
+			if self._func is self._np.min: A = self._np.minimum(A, B)
+			elif self._func is self._np.max: A = self._np.maximum(A, B)
+			else: A += B
+		if self._func is self._np.mean:
+			A /= self._array._ntimes
+		return A[()] if A.ndim == 0 else A
+
+
 def openNamelist(namelist):
 	"""
 	Function to execute a namelist and store all its content in the returned object.
@@ -115,6 +997,277 @@ def openNamelist(namelist):
 	return namelist
 
 
+class _LightModule(object):
+	""" Wrapper of the numpy module (or numpy.random) that limits the size of
+	the arrays it creates, for executing namelists in the "light" mode """
+	
+	maxDimension = 10000
+	
+	# Index of the positional argument containing the shape or size ("*" for all arguments)
+	_shapeArgument = {
+		"zeros":0, "ones":0, "empty":0, "full":0, "linspace":2,
+		"rand":"*", "randn":"*", "random":0, "random_sample":0, "standard_normal":0,
+		"normal":2, "uniform":2, "randint":2, "exponential":1, "poisson":1,
+	}
+	
+	def __init__(self, module):
+		self._module = module
+	
+	@classmethod
+	def _cap(cls, shape):
+		try:
+			return tuple(1 if int(n) > cls.maxDimension else n for n in shape)
+		except TypeError:
+			return 1 if int(shape) > cls.maxDimension else shape
+	
+	def __getattr__(self, name):
+		attr = getattr(self._module, name)
+		if name == "random":
+			return _LightModule(attr)
+		if name not in self._shapeArgument:
+			return attr
+		index = self._shapeArgument[name]
+		def capped(*args, **kwargs):
+			args = list(args)
+			if index == "*":
+				args = list(self._cap(args))
+			elif len(args) > index:
+				args[index] = self._cap(args[index])
+			for key in ["shape", "size", "num"]:
+				if kwargs.get(key) is not None:
+					kwargs[key] = self._cap(kwargs[key])
+			return attr(*args, **kwargs)
+		return capped
+
+
+def _namespaceToNamelist(namespace):
+	class Namelist: pass # empty class to store the namelist variables
+	namelist = Namelist() # create new empty object
+	for key, value in namespace.items(): # transfer all variables to this object
+		if key[0]=="_": continue # skip builtins
+		setattr(namelist, key, value)
+	return namelist
+
+def _execNamelist(file, light=False):
+	# Execute a namelist file and return its namespace
+	namespace = {}
+	if light:
+		try:
+			import __builtin__ as builtins # python 2
+		except ImportError:
+			import builtins
+		import numpy
+		def lightImport(name, *args, **kwargs):
+			module = builtins.__import__(name, *args, **kwargs)
+			if module is numpy or module is numpy.random:
+				return _LightModule(module)
+			return module
+		namespace["__builtins__"] = dict(builtins.__dict__, __import__=lightImport)
+	exec(open(file).read(), namespace)
+	return namespace
+
+
+class NamelistSnapshot(object):
+	""" Lightweight copy of a namelist, which can be saved to disk
+
+	Only the simple values (numbers, strings, lists, small arrays) of the namelist
+	variables and of the Smilei blocks (Main, Species, Diag*, etc.) are kept.
+	When an attribute is missing from the snapshot (e.g. a profile function),
+	the full namelist is executed in order to provide it.
+	"""
+	
+	maxArraySize = 1000
+	
+	def __init__(self, data, fullNamelist):
+		self._data = data
+		self._fullNamelist = fullNamelist
+		for name, value in data["variables"].items():
+			setattr(self, name, value)
+		for name, component in data["components"].items():
+			if component["singleton"]:
+				obj = _SnapshotObject(component["attrs"], self._getFullAttr(name))
+			else:
+				obj = _SnapshotList(name, component["attrs"], component["instances"], self._getFullAttr(name))
+			setattr(self, name, obj)
+	
+	filename = ".happi_namelist.json"
+	
+	@classmethod
+	def load(cls, file, cache=True, light=False):
+		"""Returns the namelist contained in `file`, from its snapshot if possible
+
+		If `cache` is True, the snapshot is saved next to the namelist and reused
+		as long as the namelist is unchanged.
+		If `light` is True, the namelist is executed with arrays of limited size
+		in order to build the snapshot. Such a snapshot is not reused when `light`
+		is False.
+		"""
+		import os, json, hashlib
+		with open(file, 'rb') as f:
+			hash = hashlib.sha1(f.read()).hexdigest()
+		snapshotFile = os.path.dirname(os.path.abspath(file))+os.sep+cls.filename
+		
+		# The full namelist is executed only once, and only if needed
+		full = []
+		def fullNamelist():
+			if not full:
+				full.append( _namespaceToNamelist(_execNamelist(file)) )
+			return full[0]
+		
+		# Try to read an existing snapshot
+		if cache:
+			try:
+				with open(snapshotFile, 'r') as f:
+					data = json.load(f)
+				if data["hash"] == hash and (light or not data.get("light", True)):
+					return cls(data, fullNamelist)
+			except Exception as e:
+				pass
+		elif not light:
+			return fullNamelist()
+		
+		# Execute the namelist to build a new snapshot
+		namespace = None
+		if light:
+			try:
+				namespace = _execNamelist(file, light=True)
+			except Exception as e:
+				print("WARNING: could not execute the namelist in the light mode ("+str(e)+"). Executing the full namelist.")
+		if namespace is None:
+			light = False
+			namespace = _execNamelist(file)
+			full.append( _namespaceToNamelist(namespace) )
+		data = cls.extract(namespace, light)
+		data["hash"] = hash
+		
+		# Save the snapshot (ignored if the directory is not writable)
+		if cache:
+			tmpfile = snapshotFile+".tmp"+str(os.getpid())
+			try:
+				with open(tmpfile, 'w') as f:
+					json.dump(data, f)
+				os.rename(tmpfile, snapshotFile)
+			except Exception as e:
+				try: os.remove(tmpfile)
+				except Exception as e: pass
+		return cls(data, fullNamelist)
+	
+	def _getFullAttr(self, name):
+		return lambda: getattr(self._fullNamelist(), name)
+	
+	def __getattr__(self, name):
+		# Only called when the attribute was not found in the snapshot
+		if name[0] == "_":
+			raise AttributeError(name)
+		return getattr(self._fullNamelist(), name)
+	
+	@classmethod
+	def _simple(cls, value, light):
+		# Convert a value to simple python types, or raise ValueError
+		import numpy
+		if value is None or isinstance(value, (str, bool, int, float)):
+			return value
+		if isinstance(value, numpy.generic):
+			return value.item()
+		if isinstance(value, numpy.ndarray):
+			if light or value.size > cls.maxArraySize or value.dtype.kind not in "biuf":
+				raise ValueError
+			return value.tolist()
+		if isinstance(value, (list, tuple)):
+			return [cls._simple(v, light) for v in value]
+		if isinstance(value, dict) and all(isinstance(k, str) for k in value):
+			return dict( (k, cls._simple(v, light)) for k,v in value.items() )
+		raise ValueError
+	
+	@classmethod
+	def _simpleAttributes(cls, items, light):
+		# The keys of values that cannot be stored are listed in "_missing"
+		attrs = {"_missing":[]}
+		for key, value in items:
+			if key[0] == "_": continue
+			try:
+				attrs[key] = cls._simple(value, light)
+			except ValueError:
+				attrs["_missing"].append(key)
+		return attrs
+	
+	@classmethod
+	def extract(cls, namespace, light=False):
+		"""Extracts the data of a snapshot from the namespace of an executed namelist"""
+		data = {"light":light, "variables":{}, "components":{}}
+		for name, value in namespace.items():
+			if name[0] == "_": continue
+			if isinstance(value, type) and hasattr(value, "_list"):
+				# Smilei block
+				classItems = [(k, getattr(value, k)) for k in dir(value) if k[0] != "_"]
+				classItems = [(k, v) for k, v in classItems if not callable(v)]
+				component = {"attrs":cls._simpleAttributes(classItems, light)}
+				component["singleton"] = type(value).__name__ == "SmileiSingletonType"
+				if component["singleton"]:
+					for obj in value._list:
+						attrs = cls._simpleAttributes(obj.__dict__.items(), light)
+						component["attrs"]["_missing"] += attrs.pop("_missing")
+						component["attrs"].update( attrs )
+				else:
+					component["instances"] = [cls._simpleAttributes(obj.__dict__.items(), light) for obj in value._list]
+				data["components"][name] = component
+			elif not isinstance(value, type) and not callable(value) and type(value).__name__ != "module":
+				try:
+					data["variables"][name] = cls._simple(value, light)
+				except ValueError:
+					pass
+		return data
+
+
+class _SnapshotObject(object):
+	""" One Smilei block in a NamelistSnapshot """
+	def __init__(self, attrs, full):
+		missing = attrs.get("_missing", [])
+		self.__dict__.update( (k,v) for k,v in attrs.items() if k not in missing )
+		self._full = full
+	def __getattr__(self, name):
+		if name[0] == "_":
+			raise AttributeError(name)
+		return getattr(self._full(), name)
+	def __repr__(self):
+		return "<Smilei "+type(self._full()).__name__+">"
+
+
+class _SnapshotList(object):
+	""" A list of Smilei blocks (e.g. Species) in a NamelistSnapshot """
+	def __init__(self, name, defaults, instances, full):
+		self.__name__ = name
+		self._full = full
+		self._list = []
+		for i, attrs in enumerate(instances):
+			missing = attrs.get("_missing", [])
+			attrs = dict(defaults, **attrs)
+			attrs["_missing"] = missing
+			self._list.append( _SnapshotObject(attrs, lambda i=i: full()._list[i]) )
+		self.__dict__.update( (k,v) for k,v in defaults.items() if k[0] != "_" )
+	def __getattr__(self, name):
+		if name[0] == "_":
+			raise AttributeError(name)
+		return getattr(self._full(), name)
+	def __iter__(self):
+		return iter(self._list)
+	def __getitem__(self, key):
+		for obj in self._list:
+			if obj.__dict__.get("name") == key:
+				return obj
+		return self._list[key]
+	def has(self, key):
+		if type(key) is int and key < len(self._list):
+			return True
+		return any(obj.__dict__.get("name") == key for obj in self._list)
+	def __len__(self):
+		return len(self._list)
+	def __repr__(self):
+		if len(self._list)==0:
+			return "<Empty list of "+self.__name__+">"
+		return "["+", ".join(["<Smilei "+self.__name__+">"]*len(self._list))+"]"
+
+
 class Options(object):
 	""" Class to contain matplotlib plotting options """
 
@@ -310,6 +1463,13 @@ class Units(object):
 			print("WARNING: units `%s` requested on non-existent or dimensionless axis" % requestedUnits)
 		return 1., ""
 
+	# Units are sent to other processes as the requested units only
+	def __getstate__(self):
+		return (self.requestedUnits, self.requestedX, self.requestedY, self.requestedV, self.verbose)
+	def __setstate__(self, state):
+		units, x, y, v, verbose = state
+		self.__init__(*units, x=x, y=y, v=v, verbose=verbose)
+
 	def prepare(self, reference_angular_frequency_SI=None):
 		if self.UnitRegistry:
 			if reference_angular_frequency_SI:
@@ -363,6 +1523,7 @@ class Movie:
 	def __init__(self, fig, movie="", fps=15, dpi=200):
 		import os.path as ospath
 		self.writer = None
+		self.fig = fig
 		if type(movie) is not str:
 			print("ERROR: argument 'movie' must be a filename")
 			return
@@ -399,6 +1560,56 @@ class Movie:
 		if self.writer is not None:
 			self.writer.grab_frame()
 
+	def write_frame(self, image):
+		"""Writes a frame already drawn as raw RGBA bytes, with the size of the movie"""
+		if self.writer is None or image is None:
+			return
+		# The image is shown in the figure of the movie, at its exact pixel size
+		import numpy
+		width, height = self.writer.frame_size
+		im = self.fig.figimage(numpy.frombuffer(image, dtype="uint8").reshape(height, width, 4), resize=False)
+		self.writer.grab_frame()
+		im.remove()
+
+
+
+class Blitter(object):
+	""" Redraws only some artists of a figure over a saved background (blitting)
+
+	The background is saved each time the whole figure is drawn.
+	"""
+
+	def __init__(self, fig, artists):
+		self.canvas = fig.canvas
+		self.artists = artists
+		self.background = None
+		self.state = None
+		for artist in artists:
+			artist.set_animated(True)
+		self.canvas.mpl_connect("draw_event", self._onDraw)
+		self.canvas.draw()
+
+	def _onDraw(self, event):
+		# Figures drawn to files are not the displayed ones
+		if self.canvas.is_saving():
+			return
+		self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+		self._drawArtists()
+
+	def _drawArtists(self):
+		for artist in self.artists:
+			self.canvas.figure.draw_artist(artist)
+
+	def update(self, state=None):
+		"""Redraws the artists only, or the whole figure if `state` changed since the last call"""
+		if self.background is None or state != self.state:
+			self.state = state
+			self.canvas.draw()
+		else:
+			self.canvas.restore_region(self.background)
+			self._drawArtists()
+			self.canvas.blit(self.canvas.figure.bbox)
+		self.canvas.flush_events()
 
 
 class SaveAs:
@@ -448,6 +1659,131 @@ class SaveAs:
 			self.figure.savefig(file)
 
 
+# Frame sources re-created in each worker process of a parallel rendering
+_renderSources = {}
+
+def _renderWorkerInit():
+	# Draw without display
+	import matplotlib.pyplot as plt
+	plt.switch_backend("Agg")
+
+def _renderWorker(source, first, last, figsize, dpi, saveAs, raw):
+	from io import BytesIO
+	if source.key not in _renderSources:
+		_renderSources[source.key] = source.open()
+	frames = []
+	for fig, id in source.draw(_renderSources[source.key], first, last, figsize):
+		if saveAs is not None and id is not None:
+			SaveAs(saveAs, fig, None).frame(id)
+		image = None
+		if raw:
+			buffer = BytesIO()
+			fig.savefig(buffer, format="rgba", dpi=dpi)
+			image = buffer.getvalue()
+		frames.append((id, image))
+	return frames
+
+# Arguments to re-create a diagnostic in a worker process
+def _diagnosticSpec(diag):
+	return (dict(diag.simulation._workerArgs(), show=False), type(diag), diag._initArgs[0], diag._initArgs[1])
+
+def _openDiagnostic(spec):
+	from ._core import SmileiSimulation
+	simulationArgs, diagClass, args, kwargs = spec
+	return diagClass(SmileiSimulation(**simulationArgs), *args, **kwargs)
+
+class _DiagnosticFrames(object):
+	""" Frames of the animation of a diagnostic, drawn in a worker process """
+	def __init__(self, diag):
+		self.spec = _diagnosticSpec(diag)
+		self.key = repr(self.spec)
+		self.options = diag.options
+		self.timesteps = list(diag._timesteps)
+	def open(self):
+		return _openDiagnostic(self.spec)
+	def draw(self, diag, first, last, figsize):
+		diag.options = self.options
+		if not diag._prepare(): return
+		ax = diag._make_axes(None)
+		ax.figure.set_size_inches(figsize)
+		for i in range(first, last):
+			t = self.timesteps[i]
+			if i == first: diag._plotOnAxes(ax, t)
+			elif diag._animateOnAxes(ax, t) is None: return
+			yield ax.figure, t
+
+class _MultiPlotFrames(object):
+	""" Frames of a multiPlot animation, drawn in a worker process """
+	def __init__(self, mp):
+		self.specs = [_diagnosticSpec(Diag) for Diag in mp.Diags]
+		self.key = repr(self.specs)
+		self.options = [Diag.options for Diag in mp.Diags]
+		self.kwargs = mp._kwargs
+		self.alltimes = mp.alltimes
+	def open(self):
+		return [_openDiagnostic(spec) for spec in self.specs]
+	def draw(self, Diags, first, last, figsize):
+		for Diag, options in zip(Diags, self.options):
+			Diag.options = options
+		mp = _multiPlotUtil(*Diags, **self.kwargs)
+		mp.fig.set_size_inches(figsize)
+		# The diagnostics without data at the first frame show their previous timestep, as when drawn one by one
+		missing = [Diag for Diag in Diags if mp.np.round(self.alltimes[first]/Diag.timestep) not in Diag.getTimesteps()]
+		for i in range(first-1, -1, -1):
+			if len(missing) == 0: break
+			found = [Diag for Diag in missing if mp.np.round(self.alltimes[i]/Diag.timestep) in Diag.getTimesteps()]
+			if found:
+				mp._drawFrame(self.alltimes[i], found)
+				missing = [Diag for Diag in missing if Diag not in found]
+		for i in range(first, last):
+			t = mp._drawFrame(self.alltimes[i])
+			yield mp.fig, (None if t is None else int(t))
+
+def _renderFrames(source, nframes, workers, fig, movie, fps, dpi, saveAs, verbose=True):
+	""" Draws the frames in `workers` processes, without display, and writes them in order
+	to the movie and to the image files. Returns False if this is not possible.
+	"""
+	try:
+		import pickle
+		pickle.dumps(source)
+	except Exception as e:
+		print("WARNING: cannot draw frames in parallel ("+str(e)+"). Drawing them one by one.")
+		return False
+	import multiprocessing
+	if not hasattr(multiprocessing, "get_context"):
+		print("WARNING: cannot draw frames in parallel with this version of python. Drawing them one by one.")
+		return False
+	from collections import deque
+	from matplotlib.figure import Figure
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	# The movie receives the frames through a figure of the same size, never displayed
+	frameFigure = Figure(figsize=fig.get_size_inches(), dpi=fig.dpi)
+	FigureCanvasAgg(frameFigure)
+	mov = Movie(frameFigure, movie, fps, dpi)
+	if SaveAs(saveAs, fig, None).prefix is False:
+		saveAs = None
+	if mov.writer is None and saveAs is None:
+		return False
+	figsize = tuple(frameFigure.get_size_inches())
+	# Chunks of consecutive frames are drawn by each worker, and a limited number of chunks is waiting
+	chunks = deque(ChunkedRange(nframes, min((nframes-1)//workers+1, 10)))
+	running = deque()
+	# New processes are started (not forked), so that they do not inherit the open HDF5 files and figures
+	pool = multiprocessing.get_context("spawn").Pool(workers, _renderWorkerInit)
+	try:
+		while len(chunks) > 0 or len(running) > 0:
+			while len(chunks) > 0 and len(running) < 2*workers:
+				first, last, n = chunks.popleft()
+				running.append(pool.apply_async(_renderWorker, (source, first, last, figsize, dpi, saveAs, mov.writer is not None)))
+			for id, image in running.popleft().get():
+				if verbose and id is not None: print("timestep "+str(id))
+				mov.write_frame(image)
+	finally:
+		pool.terminate()
+	mov.finish()
+	return True
+
+
 class _multiPlotUtil(object):
 	def __init__(self, *Diags, **kwargs):
 		from ._Diagnostics import TrackParticles
@@ -461,11 +1797,13 @@ class _multiPlotUtil(object):
 		self.np  = Diags[0]._np  # numpy
 		self.plt = Diags[0]._plt # pyplot
 		# Get keyword arguments
+		self._kwargs = dict((k,v) for k,v in kwargs.items() if k not in ["movie", "saveAs", "workers"])
 		self.shape  = kwargs.pop("shape" , None)
 		self.movie  = kwargs.pop("movie" , ""  )
 		self.fps    = kwargs.pop("fps"   , 15  )
 		self.dpi    = kwargs.pop("dpi"   , 200 )
 		self.saveAs = kwargs.pop("saveAs", None)
+		self.workers = kwargs.pop("workers", 0 )
 		self.skipAnimation = kwargs.pop("skipAnimation", False )
 		self.timesteps = kwargs.pop("timesteps", None )
 		# Gather all times
@@ -571,40 +1909,52 @@ class _multiPlotUtil(object):
 		self.plt.pause(0.00001)
 	
 	def animate(self):
+		# Draw the frames in parallel if requested, then show the last one
+		if self.workers > 0 and _renderFrames(_MultiPlotFrames(self), len(self.alltimes), self.workers,
+				self.fig, self.movie, self.fps, self.dpi, self.saveAs, self.Diags[0]._verbose):
+			self._drawFrame(self.alltimes[-1])
+			self.plt.draw()
+			self.plt.pause(0.00001)
+			return
 		# Loop all times
 		mov = Movie(self.fig, self.movie, self.fps, self.dpi)
 		save = SaveAs(self.saveAs, self.fig, self.plt)
 		for i,time in enumerate(self.alltimes):
-			t = None
-			for Diag in self.Diags:
-				t = self.np.round(time/Diag.timestep) # convert time to timestep
-				if t in Diag.getTimesteps():
-					if Diag._plot is None:
-						Diag._plotOnAxes(Diag._ax, t, cax_id = Diag._cax_id)
-					else:
-						Diag._animateOnAxes(Diag._ax, t, cax_id = Diag._cax_id)
-					if self.sameAxes:
-						Diag._ax.set_xlim(self.xmin,self.xmax)
-						if Diag.dim<2 and self.bothsides:
-							color = Diag._plot.get_color()
-							Diag._ax.yaxis.label.set_color(color)
-							Diag._ax.tick_params(axis='y', colors=color)
-							if Diag.options.side == "right":
-								Diag._ax.spines['right'].set_color(color)
-								Diag._ax.spines['left'].set_color((1.,1.,1.,0.))
-							else:
-								Diag._ax.spines['left'].set_color(color)
-					try:
-						Diag._ax.set_position(Diag._ax.twin.get_position())
-					except Exception as e:
-						pass
-			if self.nlegends > 0: self.plt.legend()
+			t = self._drawFrame(time)
 			self.plt.draw()
 			self.plt.pause(0.00001)
 			mov.grab_frame()
 			if t is not None: save.frame(int(t))
 		mov.finish()
 	
+	# Plot all diagnostics (or only `Diags`) at a given time, and return the last timestep found
+	def _drawFrame(self, time, Diags=None):
+		t = None
+		for Diag in Diags or self.Diags:
+			t = self.np.round(time/Diag.timestep) # convert time to timestep
+			if t in Diag.getTimesteps():
+				if Diag._plot is None:
+					Diag._plotOnAxes(Diag._ax, t, cax_id = Diag._cax_id)
+				else:
+					Diag._animateOnAxes(Diag._ax, t, cax_id = Diag._cax_id)
+				if self.sameAxes:
+					Diag._ax.set_xlim(self.xmin,self.xmax)
+					if Diag.dim<2 and self.bothsides:
+						color = Diag._plot.get_color()
+						Diag._ax.yaxis.label.set_color(color)
+						Diag._ax.tick_params(axis='y', colors=color)
+						if Diag.options.side == "right":
+							Diag._ax.spines['right'].set_color(color)
+							Diag._ax.spines['left'].set_color((1.,1.,1.,0.))
+						else:
+							Diag._ax.spines['left'].set_color(color)
+				try:
+					Diag._ax.set_position(Diag._ax.twin.get_position())
+				except Exception as e:
+					pass
+		if self.nlegends > 0: self.plt.legend()
+		return t
+	
 	def update(self, time):
 		t = self.np.round(time/self.Diags[0].timestep)
 		for Diag in self.Diags:
@@ -628,7 +1978,7 @@ def multiPlot(*Diags, **kwargs):
 	""" multiplot(Diag1, Diag2, ...,
 	              shape=None,
 	              movie="", fps=15, dpi=200, saveAs=None,
-	              skipAnimation=False
+	              skipAnimation=False, workers=0
 	              )
 
 	Plots simultaneously several diagnostics.
@@ -642,6 +1992,7 @@ def multiPlot(*Diags, **kwargs):
 	dpi : resolution of the movie.
 	saveAs : path where to store individual frames as pictures, e.g. "my/path/fig.png"
 	skipAnimation : if True, plots only the last frame.
+	workers : if > 0, number of processes drawing the frames of the movie and pictures, without display.
 	"""
 	
 	
@@ -831,7 +2182,7 @@ class VTKfile:
 		    writer.SetInputData(grid)
 		writer.Write()
 	
-	def WriteLines(self, pcoords, connectivity, attributes, data_format, file):
+	def WriteLines(self, pcoords, connectivity, attributes, data_format, file, ncells=None):
 		"""
 		Create a vtk file that describes lines such as trajectories
 		
@@ -840,8 +2191,9 @@ class VTKfile:
 		* attributes: vtk arrays containing additional values for each point
 		* data_format: the output data format
 		* file: output file path
+		* ncells: the number of lines, when connectivity is flat ([n, id1, ... idn, n, ...])
 		"""
-		ncel = len(connectivity)
+		ncel = len(connectivity) if ncells is None else ncells
 		connectivity = connectivity.flatten()
 		
 		id = self.vtk.vtkIdTypeArray()
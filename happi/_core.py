@@ -2,7 +2,37 @@ from ._Utils import *
 from ._Diagnostics import Scalar, Field, Probe, ParticleBinning, RadiationSpectrum, Performances, Screen, TrackParticles
 
 
-class ScalarFactory(object):
+class DiagnosticFactory(object):
+	"""Mother class of all diagnostic factories.
+	The shortcuts to sub-factories (e.g. S.Field.Field0.Ex) are only built
+	when one of them is first accessed, so that no file is opened before it is needed.
+	"""
+	
+	_shortcuts = None
+	
+	# Return a dictionary of shortcuts. To be overriden by child classes
+	def _buildShortcuts(self):
+		return {}
+	
+	def _getShortcuts(self):
+		if self._shortcuts is None:
+			self._shortcuts = self._buildShortcuts() if self._simulation._scan else {}
+		return self._shortcuts
+	
+	def __getattr__(self, name):
+		# Only called when the attribute was not found in the usual places
+		if name[0] == "_":
+			raise AttributeError(name)
+		try:
+			return self._getShortcuts()[name]
+		except KeyError:
+			raise AttributeError("'"+type(self).__name__+"' object has no attribute '"+name+"'")
+	
+	def __dir__(self):
+		return sorted(set(dir(type(self))) | set(self.__dict__) | set(self._getShortcuts()))
+
+
+class ScalarFactory(DiagnosticFactory):
 	"""Import and analyze a scalar diagnostic from a Smilei simulation
 	
 	Parameters:
@@ -28,28 +58,67 @@ class ScalarFactory(object):
 	def __init__(self, simulation, scalar=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
-		
-		# If not a specific scalar (root level), build a list of scalar shortcuts
-		if scalar is None:
-			if simulation._verbose: print("Scanning for Scalar diagnostics")
-			# Create a temporary, empty scalar diagnostic
-			tmpDiag = Scalar.Scalar(simulation)
-			# Get a list of scalars
-			scalars = tmpDiag.getScalars()
-			# Create scalars shortcuts
-			for scalar in scalars:
-				setattr(self, scalar, ScalarFactory(simulation, scalar))
 		
-		else:
+		# If a specific scalar, no shortcuts
+		if scalar is not None:
+			self._shortcuts = {}
 			# the scalar is saved for generating the object in __call__
 			self._additionalArgs += (scalar, )
+	
+	# If not a specific scalar (root level), build a list of scalar shortcuts
+	def _buildShortcuts(self):
+		if self._simulation._verbose: print("Scanning for Scalar diagnostics")
+		# Create a temporary, empty scalar diagnostic
+		tmpDiag = Scalar.Scalar(self._simulation)
+		# Get a list of scalars
+		scalars = tmpDiag.getScalars()
+		# Create scalars shortcuts
+		return dict( (scalar, ScalarFactory(self._simulation, scalar)) for scalar in scalars )
 
 	def __call__(self, *args, **kwargs):
 		return Scalar.Scalar(self._simulation, *(self._additionalArgs+args), **kwargs)
 
+	def getTable(self, scalars=None, timesteps=None):
+		"""Obtains the values of several scalars at once
+
+		Parameters:
+		-----------
+		scalars : list of strings (optional)
+			The names of the scalars. If omitted, all scalars are included.
+		timesteps : int or [int, int] (optional)
+			If omitted, all timesteps are used.
+			If one number  given, the nearest timestep available is used.
+			If two numbers given, all the timesteps in between are used.
+
+		Returns:
+		--------
+		The array of timesteps, and a 2-D array of values [timestep, scalar].
+		"""
+		np = self._simulation._np
+		names, alltimesteps, table = self._simulation._scalarTable.get(self._simulation._results_path, self._simulation._timestep)
+		if names is None:
+			print("Cannot open 'scalars.txt'")
+			return None, None
+		if scalars is None:
+			scalars = names[1:]
+		unknown = [s for s in scalars if s not in names]
+		if len(unknown) > 0:
+			print("No scalar "+", ".join(["`"+s+"`" for s in unknown])+" found")
+			return None, None
+		rows = np.arange(alltimesteps.size)
+		if timesteps is not None:
+			ts = np.array(np.double(timesteps), ndmin=1)
+			if ts.size == 2:
+				rows = rows[ (alltimesteps>=ts[0]) * (alltimesteps<=ts[1]) ]
+			elif ts.size == 1:
+				rows = rows[[(np.abs(alltimesteps-ts)).argmin()]]
+			else:
+				print("Argument `timesteps` must be one or two non-negative integers")
+				return None, None
+		return alltimesteps[rows], table[np.ix_(rows, [names.index(s) for s in scalars])]
+
 
-class FieldFactory(object):
+class FieldFactory(DiagnosticFactory):
 	"""Import and analyze a Field diagnostic from a Smilei simulation
 
 	Parameters:
@@ -76,6 +145,8 @@ class FieldFactory(object):
 	units : a units specification such as ["m","second"]
 	data_log : bool (default: False)
 		If True, then log10 is applied to the output array before plotting.
+	chunksize : int (default: 10000000)
+		Approximate number of cells read and operated (or averaged) at once.
 	export_dir : the directory to export to VTK
 
 	Usage:
@@ -88,57 +159,42 @@ class FieldFactory(object):
 	def __init__(self, simulation, diagNumber=None, field=None, timestep=None, availableTimesteps=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		self._children = []
-		if not simulation._scan: return
 		
-		# If not a specific diag (root level), build a list of diag shortcuts
-		if diagNumber is None:
-			if simulation._verbose: print("Scanning for Field diagnostics")
-			# Create diags shortcuts
-			for diag in simulation._diag_numbers["Fields"]:
-				child = FieldFactory(simulation, diag)
-				setattr(self, "Field"+str(diag), child)
-				self._children += [child]
-		
-		else:
+		if diagNumber is not None:
 			# the diag is saved for generating the object in __call__
 			self._additionalArgs += (diagNumber, )
 			
-			# If not a specific field, build a list of field shortcuts
-			if field is None:
-				# Create a temporary, empty field diagnostic
-				tmpDiag = Field.Field(simulation, diagNumber)
-				# Get a list of fields
-				fields = tmpDiag.getFields()
-#				# Get a list of timesteps
-#				timesteps = tmpDiag.getAvailableTimesteps()
-#				# Create fields shortcuts
-#				for field in fields:
-#					child = FieldFactory(simulation, diagNumber, field, availableTimesteps=timesteps)
-#					setattr(self, field, child)
-				# Create fields shortcuts
-				for field in fields:
-					child = FieldFactory(simulation, diagNumber, field)
-					setattr(self, field, child)
-
-			else:
+			if field is not None:
+				self._shortcuts = {}
 				# the field is saved for generating the object in __call__
 				self._additionalArgs += (field, )
-
-#				# If not a specific timestep, build a list of timesteps shortcuts
-#				if timestep is None:
-#					for timestep in availableTimesteps:
-#						setattr(self, 't%0.10i'%timestep, FieldFactory(simulation, diagNumber, field, timestep))
-#
-#				else:
-#					# the timestep is saved for generating the object in __call__
-#					self._additionalArgs += (timestep, )
+	
+	def _buildShortcuts(self):
+		shortcuts = {}
+		# If not a specific diag (root level), build a list of diag shortcuts
+		if len(self._additionalArgs) == 0:
+			if self._simulation._verbose: print("Scanning for Field diagnostics")
+			# Create diags shortcuts
+			for diag in self._simulation.getDiags("Fields")[0]:
+				shortcuts["Field"+str(diag)] = FieldFactory(self._simulation, diag)
+		
+		# If not a specific field, build a list of field shortcuts
+		else:
+			diagNumber = self._additionalArgs[0]
+			# Create a temporary, empty field diagnostic
+			tmpDiag = Field.Field(self._simulation, diagNumber)
+			# Get a list of fields
+			fields = tmpDiag.getFields()
+			# Create fields shortcuts
+			for field in fields:
+				shortcuts[field] = FieldFactory(self._simulation, diagNumber, field)
+		return shortcuts
 
 	def __call__(self, *args, **kwargs):
 		return Field.Field(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
-class ProbeFactory(object):
+class ProbeFactory(DiagnosticFactory):
 	"""Import and analyze a probe diagnostic from a Smilei simulation
 
 	Parameters:
@@ -179,53 +235,43 @@ class ProbeFactory(object):
 	def __init__(self, simulation, probeNumber=None, field=None, timestep=None, availableTimesteps=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
 
-		# If not a specific probe, build a list of probe shortcuts
-		if probeNumber is None:
-			if simulation._verbose: print("Scanning for Probe diagnostics")
-			# Create probe shortcuts
-			for probe in simulation._diag_numbers["Probes"]:
-				setattr(self, 'Probe'+str(probe), ProbeFactory(simulation, probe))
-
-		else:
+		if probeNumber is not None:
 			# the probe is saved for generating the object in __call__
 			self._additionalArgs += (probeNumber,)
 
-			# If not a specific field, build a list of field shortcuts
-			if field is None:
-				# Create a temporary, empty probe diagnostic
-				tmpDiag = Probe.Probe(simulation, probeNumber)
-				# Get a list of fields
-				fields = tmpDiag.getFields()
-#				# Get a list of timesteps
-#				timesteps = tmpDiag.getAvailableTimesteps()
-#				# Create fields shortcuts
-#				for field in fields:
-#					setattr(self, field, ProbeFactory(simulation, probeNumber, field, availableTimesteps=timesteps))
-				# Create fields shortcuts
-				for field in fields:
-					setattr(self, field, ProbeFactory(simulation, probeNumber, field))
-
-			else:
+			if field is not None:
+				self._shortcuts = {}
 				# the field is saved for generating the object in __call__
 				self._additionalArgs += (field, )
 
-#				# If not a specific timestep, build a list of timesteps shortcuts
-#				if timestep is None:
-#					for timestep in availableTimesteps:
-#						setattr(self, 't%0.10i'%timestep, ProbeFactory(simulation, probeNumber, field, timestep))
-#
-#				else:
-#					# the timestep is saved for generating the object in __call__
-#					self._additionalArgs += (timestep, )
+	def _buildShortcuts(self):
+		shortcuts = {}
+		# If not a specific probe, build a list of probe shortcuts
+		if len(self._additionalArgs) == 0:
+			if self._simulation._verbose: print("Scanning for Probe diagnostics")
+			# Create probe shortcuts
+			for probe in self._simulation.getDiags("Probes")[0]:
+				shortcuts['Probe'+str(probe)] = ProbeFactory(self._simulation, probe)
+
+		# If not a specific field, build a list of field shortcuts
+		else:
+			probeNumber = self._additionalArgs[0]
+			# Create a temporary, empty probe diagnostic
+			tmpDiag = Probe.Probe(self._simulation, probeNumber)
+			# Get a list of fields
+			fields = tmpDiag.getFields()
+			# Create fields shortcuts
+			for field in fields:
+				shortcuts[field] = ProbeFactory(self._simulation, probeNumber, field)
+		return shortcuts
 
 	def __call__(self, *args, **kwargs):
 		return Probe.Probe(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
 
-class ParticleBinningFactory(object):
+class ParticleBinningFactory(DiagnosticFactory):
 	"""Import and analyze a ParticleBinning diagnostic from a Smilei simulation
 
 	Parameters:
@@ -263,16 +309,9 @@ class ParticleBinningFactory(object):
 	def __init__(self, simulation, diagNumber=None, timestep=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
-
-		# If not a specific diag (root level), build a list of diag shortcuts
-		if diagNumber is None:
-			if simulation._verbose: print("Scanning for ParticleBinning diagnostics")
-			# Create diags shortcuts
-			for diag in simulation._diag_numbers["ParticleBinning"]:
-				setattr(self, 'Diag'+str(diag), ParticleBinningFactory(simulation, diag))
 
-		else:
+		if diagNumber is not None:
+			self._shortcuts = {}
 			# the diag is saved for generating the object in __call__
 			self._additionalArgs += (diagNumber, )
 
@@ -290,11 +329,20 @@ class ParticleBinningFactory(object):
 			#	# the timestep is saved for generating the object in __call__
 			#	self._additionalArgs += (timestep, )
 
+	# If not a specific diag (root level), build a list of diag shortcuts
+	def _buildShortcuts(self):
+		if self._simulation._verbose: print("Scanning for ParticleBinning diagnostics")
+		# Create diags shortcuts
+		shortcuts = {}
+		for diag in self._simulation.getDiags("ParticleBinning")[0]:
+			shortcuts['Diag'+str(diag)] = ParticleBinningFactory(self._simulation, diag)
+		return shortcuts
+
 	def __call__(self, *args, **kwargs):
 		return ParticleBinning.ParticleBinning(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
-class RadiationSpectrumFactory(object):
+class RadiationSpectrumFactory(DiagnosticFactory):
 	"""Import and analyze a RadiationSpectrum diagnostic from a Smilei simulation
 
 	Parameters:
@@ -331,16 +379,9 @@ class RadiationSpectrumFactory(object):
 	def __init__(self, simulation, diagNumber=None, timestep=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
-		
-		# If not a specific diag (root level), build a list of diag shortcuts
-		if diagNumber is None:
-			if simulation._verbose: print("Scanning for RadiationSpectrum diagnostics")
-			# Create diags shortcuts
-			for diag in simulation._diag_numbers["RadiationSpectrum"]:
-				setattr(self, 'Diag'+str(diag), RadiationSpectrumFactory(simulation, diag))
 
-		else:
+		if diagNumber is not None:
+			self._shortcuts = {}
 			# the diag is saved for generating the object in __call__
 			self._additionalArgs += (diagNumber, )
 
@@ -358,12 +399,21 @@ class RadiationSpectrumFactory(object):
 			#	# the timestep is saved for generating the object in __call__
 			#	self._additionalArgs += (timestep, )
 
+	# If not a specific diag (root level), build a list of diag shortcuts
+	def _buildShortcuts(self):
+		if self._simulation._verbose: print("Scanning for RadiationSpectrum diagnostics")
+		# Create diags shortcuts
+		shortcuts = {}
+		for diag in self._simulation.getDiags("RadiationSpectrum")[0]:
+			shortcuts['Diag'+str(diag)] = RadiationSpectrumFactory(self._simulation, diag)
+		return shortcuts
+
 	def __call__(self, *args, **kwargs):
 		return RadiationSpectrum.RadiationSpectrum(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
 
-class PerformancesFactory(object):
+class PerformancesFactory(DiagnosticFactory):
 	"""Import and analyze a Performances diagnostic from a Smilei simulation
 
 	Parameters:
@@ -418,15 +468,14 @@ class PerformancesFactory(object):
 	def __init__(self, simulation):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
-		if simulation._verbose: print("Scanning for Performance diagnostics")
+		self._shortcuts = {}
 	
 	def __call__(self, *args, **kwargs):
 		return Performances.Performances(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
 
-class ScreenFactory(object):
+class ScreenFactory(DiagnosticFactory):
 	"""Import and analyze a screen diagnostic from a Smilei simulation
 
 	Parameters:
@@ -464,16 +513,9 @@ class ScreenFactory(object):
 	def __init__(self, simulation, diagNumber=None, timestep=None):
 		self._simulation = simulation
 		self._additionalArgs = tuple()
-		if not simulation._scan: return
 
-		# If not a specific diag (root level), build a list of diag shortcuts
-		if diagNumber is None:
-			if simulation._verbose: print("Scanning for Screen diagnostics")
-			# Create diags shortcuts
-			for diag in simulation._diag_numbers["Screen"]:
-				setattr(self, 'Screen'+str(diag), ScreenFactory(simulation, diag))
-
-		else:
+		if diagNumber is not None:
+			self._shortcuts = {}
 			# the diag is saved for generating the object in __call__
 			self._additionalArgs += (diagNumber, )
 
@@ -491,12 +533,21 @@ class ScreenFactory(object):
 			#	# the timestep is saved for generating the object in __call__
 			#	self._additionalArgs += (timestep, )
 
+	# If not a specific diag (root level), build a list of diag shortcuts
+	def _buildShortcuts(self):
+		if self._simulation._verbose: print("Scanning for Screen diagnostics")
+		# Create diags shortcuts
+		shortcuts = {}
+		for diag in self._simulation.getDiags("Screen")[0]:
+			shortcuts['Screen'+str(diag)] = ScreenFactory(self._simulation, diag)
+		return shortcuts
+
 	def __call__(self, *args, **kwargs):
 		return Screen.Screen(self._simulation, *(self._additionalArgs+args), **kwargs)
 
 
 
-class TrackParticlesFactory(object):
+class TrackParticlesFactory(DiagnosticFactory):
 	"""Import and analyze tracked particles from a Smilei simulation
 
 	Parameters:
@@ -542,23 +593,9 @@ class TrackParticlesFactory(object):
 	def __init__(self, simulation, species=None, timestep=None):
 		self._simulation = simulation
 		self._additionalKwargs = dict()
-		self._children = []
-		if not simulation._scan: return
-
-		# If not a specific species (root level), build a list of species shortcuts
-		if species is None:
-			if simulation._verbose: print("Scanning for Tracked particle diagnostics")
-			# Create a temporary, empty tracked-particle diagnostic
-			tmpDiag = TrackParticles.TrackParticles(simulation)
-			# Get a list of species
-			specs = tmpDiag.getTrackSpecies()
-			# Create species shortcuts
-			for spec in specs:
-				child = TrackParticlesFactory(simulation, spec)
-				setattr(self, spec, child)
-				self._children += [child]
 
-		else:
+		if species is not None:
+			self._shortcuts = {}
 			# the species is saved for generating the object in __call__
 			self._additionalKwargs.update( {"species":species} )
 
@@ -580,6 +617,16 @@ class TrackParticlesFactory(object):
 			#	# the timestep is saved for generating the object in __call__
 			#	self._additionalKwargs.update( {"timesteps":timestep} )
 
+	# If not a specific species (root level), build a list of species shortcuts
+	def _buildShortcuts(self):
+		if self._simulation._verbose: print("Scanning for Tracked particle diagnostics")
+		# Create a temporary, empty tracked-particle diagnostic
+		tmpDiag = TrackParticles.TrackParticles(self._simulation)
+		# Get a list of species
+		specs = tmpDiag.getTrackSpecies()
+		# Create species shortcuts
+		return dict( (spec, TrackParticlesFactory(self._simulation, spec)) for spec in specs )
+
 	def __call__(self, *args, **kwargs):
 		kwargs.update(self._additionalKwargs)
 		return TrackParticles.TrackParticles(self._simulation, *args, **kwargs)
@@ -609,6 +656,33 @@ def Open(*args, **kwargs):
 	scan : bool (default True)
 		If False, the HDF5 output files are not initially scanned.
 
+	index : bool (default True)
+		If True, the metadata of the HDF5 output files is stored in a file
+		`.happi_index.json` in each results directory, so that it is not
+		read again from the HDF5 files next time. Similarly, the content of
+		`scalars.txt` is stored in a binary file `.happi_scalars.npz`, and
+		the ordering of the points of each probe in `.happi_probeN_ordering.npz`.
+
+	namelist_cache : bool (default True)
+		If True, the content of the namelist is stored in a file
+		`.happi_namelist.json` in each results directory, so that the namelist
+		is not executed again next time.
+
+	light_namelist : bool (default False)
+		If True, the namelist is executed with numpy arrays of limited size,
+		to avoid building large arrays (e.g. particles initialized from numpy).
+
+	cache_size : float (default 1000.)
+		Maximum memory, in megabytes, used to keep the data already obtained
+		from the diagnostics. Set to 0 to disable this cache.
+
+	workers : int (default 0)
+		Number of processes reading the data of the next timesteps in the
+		background, when looping over timesteps (getData, animate, streak, toVTK).
+
+	prefetch : int (default 2*workers)
+		Maximum number of timesteps read in advance by the workers.
+
 	Returns:
 	--------
 	A SmileiSimulation object, i.e. a container that holds information about a simulation.
@@ -617,6 +691,8 @@ def Open(*args, **kwargs):
 	----------------------------------
 	namelist :
 		An object that holds the information of the original user namelist.
+	cache :
+		The cache of the data obtained from the diagnostics (see `cache.info()`).
 	Scalar :
 		A method to access the `DiagScalar` diagnostic.
 	Field :
@@ -641,6 +717,8 @@ class SmileiSimulation(object):
 	-----------
 	namelist :
 		An object that holds the information of the original user namelist.
+	cache :
+		The cache of the data obtained from the diagnostics (see `cache.info()`).
 	Scalar :
 		A method to access the `DiagScalar` diagnostic.
 	Field :
@@ -656,7 +734,7 @@ class SmileiSimulation(object):
 
 	"""
 
-	def __init__(self, results_path=".", reference_angular_frequency_SI=None, show=True, verbose=True, scan=True):
+	def __init__(self, results_path=".", reference_angular_frequency_SI=None, show=True, verbose=True, scan=True, index=True, namelist_cache=True, light_namelist=False, cache_size=1000., workers=0, prefetch=None):
 		self.valid = False
 		# Import packages
 		import h5py
@@ -679,6 +757,14 @@ class SmileiSimulation(object):
 		self._verbose = verbose
 		self._reference_angular_frequency_SI = reference_angular_frequency_SI
 		self._scan = scan
+		self._index = OutputIndex(persistent=index)
+		self._scalarTable = ScalarTable(persistent=index)
+		self._namelist_cache = namelist_cache
+		self._light_namelist = light_namelist
+		self.cache = DataCache(cache_size)
+		self._diagInfo = {}
+		self._show = show
+		self._prefetcher = Prefetcher(workers, prefetch)
 
 		# Load the simulation (verify the path, get the namelist)
 		self.reload()
@@ -689,9 +775,7 @@ class SmileiSimulation(object):
 			self._diag_names = {}
 			for diagType in ["Fields", "Probes", "ParticleBinning", "Screen", "RadiationSpectrum"]:
 				self._diag_numbers[diagType], self._diag_names[diagType] = None, None
-				if self._scan:
-					self.getDiags(diagType)
-			
+
 			self.Scalar = ScalarFactory(self)
 			self.Field = FieldFactory(self)
 			self.Probe = ProbeFactory(self)
@@ -703,14 +787,8 @@ class SmileiSimulation(object):
 
 
 	def _openNamelist(self, path):
-		# Fetch the python namelist
-		namespace={}
-		exec(open(path+self._os.sep+'smilei.py').read(), namespace) # execute the namelist into an empty namespace
-		class Namelist: pass # empty class to store the namelist variables
-		namelist = Namelist() # create new empty object
-		for key, value in namespace.items(): # transfer all variables to this object
-			if key[0]=="_": continue # skip builtins
-			setattr(namelist, key, value)
+		# Fetch the python namelist (from its snapshot if possible)
+		namelist = NamelistSnapshot.load(path+self._os.sep+'smilei.py', cache=self._namelist_cache, light=self._light_namelist)
 
 		# Get some info on the simulation
 		try:
@@ -780,6 +858,9 @@ class SmileiSimulation(object):
 
 		# Reload if necessary
 		if lastmodif > self._mtime:
+			self.cache.clear()
+			self._diagInfo.clear()
+			self._prefetcher.close() # workers may hold the previous files
 			W_r = None
 			# Loop paths and verify the namelist is compatible
 			for path in newPaths:
@@ -810,9 +891,23 @@ class SmileiSimulation(object):
 		self._mtime = lastmodif
 		self.valid = True
 	
+	# Arguments to re-open this simulation in a worker process
+	def _workerArgs(self):
+		return dict(
+			results_path = self._results_path,
+			reference_angular_frequency_SI = self._reference_angular_frequency_SI,
+			show = self._show,
+			verbose = False,
+			index = self._index.persistent,
+			namelist_cache = self._namelist_cache,
+			light_namelist = self._light_namelist,
+			cache_size = 0,
+		)
+
 	def getDiags(self, diagType):
 		if self._diag_numbers[diagType] is None:
 			self._diag_numbers[diagType], self._diag_names[diagType] = self.scanDiags(diagType)
+			self._index.flush()
 		return self._diag_numbers[diagType], self._diag_names[diagType]
 	
 	def scanDiags(self, diagType):
@@ -824,8 +919,9 @@ class SmileiSimulation(object):
 				# get number
 				number = int(self._re.findall(diagType+"([0-9]+).h5$",file)[0])
 				# get name
-				with self._h5py.File(file, 'r') as f:
-					name = f.attrs["name"].decode() if "name" in f.attrs else ""
+				entry = self._index.get(file)
+				if entry is None: continue
+				name = entry["attrs"].get("name", "")
 				these_diags += [(number, name)]
 			# Update diags with those of previous paths
 			diags = list(set(diags+these_diags)) # unique diags